@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Verify the decision paths of dcgc against the reference logic over synthetic
+snapshots, and report how long it takes.
+
+    python benchmarks/oracle.py --containers 20000 --images 10000 --seeds 3
+"""
+import argparse
+import sys
+import time
+
+from docker_custodian.args import datetime_seconds_ago
+from docker_custodian.docker_gc import format_exclude_labels
+from docker_custodian.oracle import synthetic_snapshot
+from docker_custodian.oracle import verify_snapshot
+
+
+DAY = 24 * 3600
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--containers', type=int, default=2000)
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--seeds', type=int, default=5)
+    opts = parser.parse_args()
+
+    print("%-6s %10s %10s %10s %10s" % (
+        'seed', 'containers', 'images', 'diverged', 'seconds'))
+    failed = False
+    for seed in range(opts.seeds):
+        snapshot = synthetic_snapshot(opts.containers, opts.images, seed=seed)
+        start = time.monotonic()
+        reference, divergences = verify_snapshot(
+            snapshot,
+            datetime_seconds_ago(7 * DAY),
+            datetime_seconds_ago(30 * DAY),
+            format_exclude_labels(['keep', 'team=ci']),
+            {'user/repo1:*'},
+        )
+        elapsed = time.monotonic() - start
+        diverged = sum(len(found) for found in divergences.values())
+        failed = failed or bool(diverged)
+        print("%-6s %10s %10s %10s %10.1f" % (
+            seed,
+            len(reference.containers),
+            len(reference.images),
+            diverged,
+            elapsed))
+        for found in divergences.values():
+            for divergence in found[:5]:
+                print("    %s" % (divergence,))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measure the startup cost of the dcgc and dcstop entry points.
+
+Each command is run in a fresh interpreter several times and the median wall
+time, the median time spent importing the entry point module and the peak
+RSS are reported.
+
+    python benchmarks/startup.py --runs 20
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+
+COMMANDS = [
+    ('dcgc --help', 'docker_custodian.docker_gc', ['--help']),
+    ('dcgc (no-op)', 'docker_custodian.docker_gc', []),
+    ('dcgc --dry-run', 'docker_custodian.docker_gc',
+     ['--dry-run', '--max-image-age', '1000d', '-t', '1']),
+    ('dcstop --help', 'docker_custodian.docker_autostop', ['--help']),
+]
+
+IMPORT_TIME_RE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \| (\S+)$')
+
+
+def run_once(module, args):
+    """Return (wall seconds, import microseconds, max RSS in KiB)."""
+    cmd = [sys.executable, '-X', 'importtime', '-m', module] + args
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    stderr = proc.stderr.read()
+    _, _, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = 0
+    elapsed = time.monotonic() - start
+
+    import_us = 0
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        # Top level imports are not indented
+        if match and not line.split('|')[2].startswith('  '):
+            import_us += int(match.group(1))
+    return elapsed, import_us, rusage.ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    opts = parser.parse_args()
+
+    print("%-16s %10s %12s %10s" % ('command', 'wall ms', 'imports ms', 'rss KiB'))
+    for name, module, args in COMMANDS:
+        results = [run_once(module, args) for _ in range(opts.runs)]
+        wall, imports, rss = zip(*results)
+        print("%-16s %10.1f %12.1f %10d" % (
+            name,
+            statistics.median(wall) * 1000,
+            statistics.median(imports) / 1000,
+            max(rss)))
+
+
+if __name__ == '__main__':
+    main()
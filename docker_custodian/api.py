@@ -0,0 +1,202 @@
+# -*- coding: utf8 -*-
+"""
+Run the dcgc and dcstop cleanups from Python, with a client which is kept
+between runs, instead of starting a new process every time.
+
+Every function takes a backend, reports a :class:`Result` for every object to
+an optional sink, and returns the list of results::
+
+    import docker
+    from docker_custodian import api
+
+    client = docker.APIClient(version='auto')
+    results = api.remove_containers(client, max_age=3 * 24 * 3600)
+    failed = [result for result in results if not result.ok]
+
+A backend is a :class:`docker.APIClient`, or any object with the part of its
+interface used by the cleanups, for example a pool of clients, a cache or a
+fake for tests:
+
+- ``_version``, the docker API version of the daemon, for example ``'1.41'``
+- ``containers(all=False)``, ``inspect_container(container)``,
+  ``remove_container(container, v=False)`` and ``stop(container)``
+- ``images()``, ``inspect_image(image)`` and
+  ``remove_image(image, force=False)``
+- ``volumes(filters=None)`` and ``remove_volume(name)``
+- ``networks()`` and ``remove_network(net_id)``
+
+Methods are called with keyword arguments, and only the methods used by the
+called cleanup are needed.
+"""
+import datetime
+
+from docker_custodian import docker_autostop
+from docker_custodian import docker_gc
+from docker_custodian.args import datetime_seconds_ago
+from docker_custodian.docker_gc import Result  # noqa: F401
+
+
+class CachingBackend(object):
+    """Wrap a backend to cache image inspect data, which never changes for an
+    image id, across runs of a long lived process.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.image_cache = {}
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def inspect_image(self, image):
+        if image not in self.image_cache:
+            self.image_cache[image] = self.backend.inspect_image(image=image)
+        return self.image_cache[image]
+
+    def remove_image(self, image, force=False):
+        self.image_cache.pop(image, None)
+        return self.backend.remove_image(image=image, force=force)
+
+
+def min_date(max_age):
+    """Return the date before which objects are older than max_age, given as
+    a :class:`datetime.timedelta` or in seconds.
+    """
+    if max_age is None:
+        return None
+    if isinstance(max_age, datetime.timedelta):
+        max_age = max_age.total_seconds()
+    return datetime_seconds_ago(max_age)
+
+
+def collect(sink):
+    """Return a list of results, and a sink which appends to it and also
+    calls sink.
+    """
+    results = []
+
+    def collecting_sink(result):
+        results.append(result)
+        if sink is not None:
+            sink(result)
+    return results, collecting_sink
+
+
+def remove_containers(
+    backend,
+    max_age=None,
+    policy=None,
+    exclude_labels=(),
+    dry_run=False,
+    sink=None,
+    containers=None,
+):
+    """Remove containers which finished more than max_age ago, or as decided
+    by a :class:`docker_custodian.policy.Policy`.
+
+    :param exclude_labels: ``key`` or ``key=value`` patterns of labels of
+        containers which are never removed
+    :param containers: a listing of all containers, to avoid listing them
+        again
+    """
+    if max_age is None and policy is None:
+        raise ValueError("max_age or policy is required")
+    results, collecting_sink = collect(sink)
+    docker_gc.cleanup_containers(
+        backend,
+        min_date(max_age),
+        dry_run,
+        docker_gc.format_exclude_labels(exclude_labels),
+        containers=containers,
+        policy=policy,
+        sink=collecting_sink,
+    )
+    return results
+
+
+def remove_images(
+    backend,
+    max_age=None,
+    policy=None,
+    exclude_images=(),
+    dry_run=False,
+    sink=None,
+    containers=None,
+):
+    """Remove images which are not used by any container and were created
+    more than max_age ago, or as decided by a
+    :class:`docker_custodian.policy.Policy`.
+
+    :param exclude_images: patterns of image tags which are never removed
+    """
+    if max_age is None and policy is None:
+        raise ValueError("max_age or policy is required")
+    results, collecting_sink = collect(sink)
+    docker_gc.cleanup_images(
+        backend,
+        min_date(max_age),
+        dry_run,
+        set(exclude_images),
+        containers=containers,
+        policy=policy,
+        sink=collecting_sink,
+    )
+    return results
+
+
+def remove_volumes(backend, dry_run=False, sink=None):
+    """Remove dangling volumes."""
+    results, collecting_sink = collect(sink)
+    docker_gc.cleanup_volumes(backend, dry_run, sink=collecting_sink)
+    return results
+
+
+def remove_networks(
+    backend,
+    max_age,
+    exclude_labels=(),
+    dry_run=False,
+    sink=None,
+    containers=None,
+):
+    """Remove networks which no container is attached to and were created
+    more than max_age ago.
+
+    :param exclude_labels: ``key`` or ``key=value`` patterns of labels of
+        networks which are never removed
+    """
+    if max_age is None:
+        raise ValueError("max_age is required")
+    results, collecting_sink = collect(sink)
+    docker_gc.cleanup_networks(
+        backend,
+        min_date(max_age),
+        dry_run,
+        docker_gc.format_exclude_labels(exclude_labels),
+        containers=containers,
+        sink=collecting_sink,
+    )
+    return results
+
+
+def stop_containers(
+    backend,
+    max_run_time,
+    prefixes,
+    dry_run=False,
+    sink=None,
+    containers=None,
+):
+    """Stop containers with a name starting with one of prefixes which have
+    been running for longer than max_run_time.
+    """
+    results, collecting_sink = collect(sink)
+    docker_autostop.stop_containers(
+        backend,
+        min_date(max_run_time),
+        docker_autostop.build_container_matcher(prefixes),
+        dry_run,
+        containers=containers,
+        sink=collecting_sink,
+    )
+    return results
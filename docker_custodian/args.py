@@ -1,6 +1,7 @@
+# -*- coding: utf8 -*-
 import datetime
+import re
 
-from dateutil import tz
 from pytimeparse import timeparse
 
 
@@ -15,6 +16,67 @@ def timedelta_type(value):
     return datetime_seconds_ago(timeparse.timeparse(value))
 
 
+def seconds_type(value):
+    """Return the number of seconds in a time format supported by
+    mod:`pytimeparse`.
+    """
+    if value is None:
+        return None
+    seconds = timeparse.timeparse(value)
+    if seconds is None:
+        raise ValueError("Invalid duration: %s" % value)
+    return int(seconds)
+
+
+SIZE_UNITS = {
+    '': 1,
+    'k': 1024,
+    'm': 1024 ** 2,
+    'g': 1024 ** 3,
+    't': 1024 ** 4,
+}
+
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+
+
+def size_type(value):
+    """Return the number of bytes in a size like ``512M`` or ``8GB``."""
+    if value is None:
+        return None
+    match = SIZE_RE.match(value)
+    if not match:
+        raise ValueError("Invalid size: %s" % value)
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.lower()])
+
+
+def percent_type(value):
+    """Return the number in a percentage like ``200%``."""
+    if value is None:
+        return None
+    return float(value.strip().rstrip('%'))
+
+
+def keep_last_type(value):
+    """Return a ``(pattern, count)`` tuple for ``N`` or ``PATTERN=N``, with a
+    pattern of None for ``N``.
+    """
+    pattern, _, count = value.rpartition('=')
+    if not count.isdigit():
+        raise ValueError("Invalid count: %s" % value)
+    return pattern or None, int(count)
+
+
 def datetime_seconds_ago(seconds):
-    now = datetime.datetime.now(tz.tzutc())
+    now = datetime.datetime.now(datetime.timezone.utc)
     return now - datetime.timedelta(seconds=seconds)
+
+
+def parse_date(value):
+    """Parse a timestamp returned by the docker API.
+
+    :mod:`dateutil` is imported on first use so that commands which never
+    look at a timestamp don't pay for importing it.
+    """
+    import dateutil.parser
+    return dateutil.parser.parse(value)
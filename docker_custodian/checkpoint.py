@@ -0,0 +1,206 @@
+# -*- coding: utf8 -*-
+"""
+Resume a dcgc run which was interrupted.
+
+With ``--checkpoint`` the plan of a run is written to a journal file before
+anything is removed, and every removal is appended to it as it completes. If
+the run is killed, the next run with the same options removes what is left of
+the plan, re-validated against a listing of the current objects, instead of
+inspecting everything again. The journal is removed once the plan is done.
+
+Lines are flushed but not synced to disk. A removal lost in a crash is tried
+again and skipped, because the object is gone.
+"""
+import datetime
+import json
+import logging
+import os
+
+from docker_custodian.docker_gc import plan_sink
+from docker_custodian.plan import apply_plan
+from docker_custodian.plan import build_plan
+
+
+log = logging.getLogger(__name__)
+
+
+CHECKPOINT_VERSION = 1
+
+# The options which decide what is planned. A checkpoint written with other
+# values for any of them is not resumed.
+PLAN_OPTIONS = (
+    'max_container_age',
+    'max_image_age',
+    'dangling_volumes',
+    'exclude_image',
+    'exclude_image_file',
+    'exclude_container_label',
+    'policy',
+)
+
+PLAN_KEYS = (
+    ('container', 'containers', 'id'),
+    ('image', 'images', 'id'),
+    ('volume', 'volumes', 'name'),
+)
+
+
+def plan_options(args):
+    """Return the plan options of args as JSON values."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def to_json(value):
+        if isinstance(value, datetime.datetime):
+            # Ages are parsed into dates, compare them in minutes
+            return 'age:%dm' % round((now - value).total_seconds() / 60)
+        if hasattr(value, 'name'):
+            return value.name
+        if isinstance(value, list):
+            return sorted(value)
+        return value
+
+    return {
+        option: to_json(getattr(args, option, None))
+        for option in PLAN_OPTIONS
+    }
+
+
+def read_checkpoint(path, options):
+    """Return the part of the plan in the checkpoint at path which was not
+    done yet, or None if there is no checkpoint which can be resumed.
+    """
+    try:
+        with open(path) as journal_file:
+            lines = journal_file.read().splitlines()
+    except FileNotFoundError:
+        return None
+
+    try:
+        header = json.loads(lines[0])
+    except (IndexError, ValueError):
+        log.info("Ignoring unreadable checkpoint %s" % path)
+        return None
+    if header.get('version') != CHECKPOINT_VERSION:
+        log.info("Ignoring checkpoint %s: unsupported version %s" % (
+            path, header.get('version')))
+        return None
+    if header.get('options') != options:
+        log.info("Ignoring checkpoint %s: written with other options" % path)
+        return None
+
+    done = set()
+    for line in lines[1:]:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # The last line is cut short when the run was killed writing it
+            break
+        done.add((entry['kind'], entry['id']))
+
+    plan = header['plan']
+    for kind, plan_key, id_key in PLAN_KEYS:
+        plan[plan_key] = [
+            entry for entry in plan[plan_key]
+            if (kind, entry[id_key]) not in done
+        ]
+    return plan
+
+
+class Journal(object):
+    """Append the objects removed from the plan of a checkpoint."""
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_file = open(path, 'a')
+
+    @classmethod
+    def start(cls, path, plan, options):
+        """Write a new checkpoint for plan, replacing any previous one."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as journal_file:
+            journal_file.write(json.dumps({
+                'version': CHECKPOINT_VERSION,
+                'options': options,
+                'plan': plan,
+            }, sort_keys=True) + '\n')
+        os.rename(tmp_path, path)
+        return cls(path)
+
+    def removed(self, kind, object_id):
+        self.journal_file.write(json.dumps(
+            {'kind': kind, 'id': object_id}, sort_keys=True) + '\n')
+        self.journal_file.flush()
+
+    def close(self, finished):
+        """Close the journal, and remove the checkpoint if the plan is
+        finished.
+        """
+        self.journal_file.close()
+        if finished:
+            os.remove(self.path)
+
+
+def run_checkpointed(
+    client,
+    args,
+    exclude_container_labels,
+    exclude_set,
+    policy=None,
+    sink=None,
+):
+    """Plan and remove containers, images and volumes, or resume the plan of
+    the checkpoint at args.checkpoint. Returns True if the plan is finished.
+    sink is called with a :class:`docker_custodian.docker_gc.Result` for
+    every removed object.
+    """
+    options = plan_options(args)
+    plan = read_checkpoint(args.checkpoint, options)
+    deadline = None
+    if args.max_duration:
+        from docker_custodian.deadline import Deadline
+        deadline = Deadline(args.max_duration)
+
+    journal = None
+    if plan is None:
+        plan = build_plan(
+            client,
+            args.max_container_age,
+            args.max_image_age,
+            args.dangling_volumes,
+            exclude_container_labels,
+            exclude_set,
+            deadline=deadline,
+            policy=policy,
+        )
+        if not args.dry_run:
+            journal = Journal.start(args.checkpoint, plan, options)
+    else:
+        log.info(
+            "Resuming from checkpoint %s: %s containers, %s images and %s "
+            "volumes left" % (
+                args.checkpoint,
+                len(plan['containers']),
+                len(plan['images']),
+                len(plan['volumes'])))
+        if not args.dry_run:
+            journal = Journal(args.checkpoint)
+
+    report = plan_sink(sink, args.dry_run)
+
+    def on_removed(kind, key):
+        if journal:
+            journal.removed(kind, key)
+        if report:
+            report(kind, key)
+    if deadline is not None:
+        from docker_custodian.deadline import apply_plan_by_value
+        deferred = apply_plan_by_value(
+            client, plan, args.dry_run, deadline, on_removed=on_removed)
+        finished = not deferred and not deadline.expired()
+    else:
+        apply_plan(client, plan, args.dry_run, on_removed=on_removed)
+        finished = True
+
+    if journal:
+        journal.close(finished)
+    return finished
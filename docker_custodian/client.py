@@ -0,0 +1,56 @@
+# -*- coding: utf8 -*-
+"""
+Build the docker API client.
+
+:mod:`docker` (and :mod:`requests` with it) is only imported when a client is
+built, so that ``--help``, argument errors and runs with nothing to do stay
+fast.
+"""
+import argparse
+
+
+def build_client(timeout):
+    import docker
+    from docker.utils import kwargs_from_env
+
+    return docker.APIClient(version='auto',
+                            timeout=timeout,
+                            **kwargs_from_env())
+
+
+def client_from_args(args):
+    """Build the client selected by the options of
+    :func:`add_client_arguments`.
+    """
+    if args.replay:
+        from docker_custodian.trace import replay_client
+        return replay_client(args.replay, scale=args.replay_latency_scale)
+
+    client = build_client(args.timeout)
+    if args.record:
+        from docker_custodian.trace import record
+        record(client, args.record, anonymize=args.anonymize)
+    return client
+
+
+def add_client_arguments(parser):
+    parser.add_argument(
+        '-t', '--timeout', type=int, default=60,
+        help="HTTP timeout in seconds for making docker API calls.")
+    parser.add_argument(
+        '--anonymize', action="store_true",
+        help="Replace names, tags, labels and paths in the --record trace "
+             "with stable tokens.")
+    parser.add_argument(
+        '--replay-latency-scale', type=float, default=1.0,
+        help="Multiply the recorded latency of every --replay response by "
+             "this factor. 0 replays without any delay.")
+    traffic = parser.add_mutually_exclusive_group()
+    traffic.add_argument(
+        '--record', type=argparse.FileType('w'),
+        help="Write every docker API request and response to this JSON "
+             "lines file.")
+    traffic.add_argument(
+        '--replay', type=argparse.FileType('r'),
+        help="Serve docker API requests from a trace written by --record "
+             "instead of a docker daemon.")
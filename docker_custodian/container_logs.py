@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+"""
+Keep the ``json-file`` logs of containers under a size limit.
+
+The log files are read from the ``LogPath`` of the container inspect data,
+so dcgc needs access to the docker data root (usually
+``/var/lib/docker/containers``) for this to work. Files are only ever read in
+chunks, never loaded into memory.
+"""
+import collections
+import gzip
+import logging
+import os
+import shutil
+
+from docker_custodian.log_output import object_extra
+
+
+log = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 1024 * 1024
+
+TRUNCATE = 'truncate'
+ROTATE = 'rotate'
+LOG_ACTIONS = (TRUNCATE, ROTATE)
+
+LogLimit = collections.namedtuple('LogLimit', ['max_size', 'action'])
+
+
+def get_log_path(container):
+    log_config = container.get('HostConfig', {}).get('LogConfig') or {}
+    if log_config.get('Type', 'json-file') != 'json-file':
+        return None
+    return container.get('LogPath') or None
+
+
+def get_log_size(container):
+    """Return the size of the log file of a container, 0 if it has none."""
+    log_path = get_log_path(container)
+    if not log_path:
+        return 0
+    try:
+        return os.stat(log_path).st_size
+    except OSError:
+        return 0
+
+
+def enforce_log_limit(container, log_limit, dry_run):
+    """Truncate or rotate the log of a container if it is larger than the
+    limit. Returns the number of bytes freed.
+    """
+    size = get_log_size(container)
+    if size <= log_limit.max_size:
+        return 0
+
+    log_path = get_log_path(container)
+    log.info(
+        "%s log of container %s %s: %s bytes",
+        log_limit.action.capitalize(),
+        container['Id'][:16],
+        container.get('Name', '').lstrip('/'),
+        size,
+        extra=object_extra(
+            'log', log_limit.action, container['Id'], size=size),
+    )
+    if dry_run:
+        return size
+
+    try:
+        if log_limit.action == ROTATE:
+            return rotate_log(log_path)
+        return truncate_log(log_path)
+    except (IOError, OSError) as e:
+        log.warn("Failed to %s log %s: %s" % (log_limit.action, log_path, e))
+        return 0
+
+
+def truncate_log(log_path):
+    size = os.stat(log_path).st_size
+    # dockerd appends to the file, so truncating in place is safe
+    os.truncate(log_path, 0)
+    return size
+
+
+def rotate_log(log_path):
+    """Compress the log to ``<log_path>.1.gz``, replacing any previous
+    rotation, then truncate it. Lines written between the copy and the
+    truncate are lost.
+    """
+    rotated_path = log_path + '.1.gz'
+    previous_size = 0
+    if os.path.exists(rotated_path):
+        previous_size = os.stat(rotated_path).st_size
+
+    tmp_path = rotated_path + '.tmp'
+    with open(log_path, 'rb') as source:
+        with gzip.open(tmp_path, 'wb') as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+    os.rename(tmp_path, rotated_path)
+
+    size = truncate_log(log_path)
+    return size + previous_size - os.stat(rotated_path).st_size
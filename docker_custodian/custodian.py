@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Stop containers which have been running for too long, then remove old
+containers, images and volumes, in one process.
+
+This is the same as running dcstop followed by dcgc, but the docker client
+and the listing of all containers are shared by both.
+"""
+import argparse
+import logging
+import sys
+
+from docker_custodian import docker_autostop
+from docker_custodian import docker_gc
+from docker_custodian.client import add_client_arguments
+from docker_custodian.client import client_from_args
+from docker_custodian.lock import run_lock
+from docker_custodian.log_output import add_logging_arguments
+from docker_custodian.log_output import configure_logging
+
+
+log = logging.getLogger(__name__)
+
+
+class Custodian(object):
+    """Runs dcstop and dcgc phases against one client, listing the containers
+    at most once.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._containers = None
+
+    @property
+    def containers(self):
+        if self._containers is None:
+            self._containers = docker_gc.get_all_containers(self.client)
+        return self._containers
+
+    def stop_containers(self, max_run_time, prefixes, dry_run):
+        docker_autostop.stop_containers(
+            self.client,
+            max_run_time,
+            docker_autostop.build_container_matcher(prefixes),
+            dry_run,
+            containers=self.containers,
+        )
+
+    def stop_containers_over_limits(
+        self,
+        limits,
+        window,
+        interval,
+        workers,
+        prefixes,
+        dry_run,
+    ):
+        docker_autostop.stop_containers_over_limits(
+            self.client,
+            limits,
+            window,
+            interval,
+            workers,
+            docker_autostop.build_container_matcher(prefixes),
+            dry_run,
+            containers=self.containers,
+        )
+
+    def gc(self, args):
+        """Run the dcgc phases selected by args, see
+        :func:`docker_custodian.docker_gc.get_args`. Returns the exit status
+        of :func:`docker_custodian.docker_gc.run`.
+        """
+        return docker_gc.run(self.client, args, containers=self.containers)
+
+
+def main():
+    args = get_args()
+    configure_logging(args)
+    limits = docker_autostop.get_resource_limits(args)
+    should_stop = bool(args.prefix and (args.max_run_time or limits))
+    if not should_stop and not docker_gc.has_work(args):
+        log.info("Nothing to do, no stop or cleanup options were given")
+        return
+
+    status = None
+    with run_lock(args.lock_file) as acquired:
+        if acquired:
+            status = run(Custodian(client_from_args(args)), args, limits)
+    if status:
+        sys.exit(status)
+
+
+def run(custodian, args, limits):
+    """Stop and remove what args select, returns the exit status of the
+    dcgc phases.
+    """
+    if args.prefix and args.max_run_time:
+        custodian.stop_containers(args.max_run_time, args.prefix, args.dry_run)
+    if args.prefix and limits:
+        custodian.stop_containers_over_limits(
+            limits,
+            args.limit_window,
+            args.sample_interval,
+            args.stats_workers,
+            args.prefix,
+            args.dry_run,
+        )
+    if docker_gc.has_work(args):
+        return custodian.gc(args)
+    return None
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser()
+    docker_autostop.add_arguments(parser)
+    docker_gc.add_arguments(parser)
+    parser.add_argument(
+        '--dry-run', action="store_true",
+        help="Only log actions, don't stop or remove anything.")
+    add_client_arguments(parser)
+    add_logging_arguments(parser)
+    return parser.parse_args(args=args)
+
+
+if __name__ == "__main__":
+    main()
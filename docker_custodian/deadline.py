@@ -0,0 +1,230 @@
+# -*- coding: utf8 -*-
+"""
+Remove as much as possible within a time budget.
+
+Candidates are collected with :func:`docker_custodian.plan.build_plan` and
+then removed in order of reclaimable bytes per API call, so that the most
+valuable removals happen first. Once the deadline passes the remaining
+candidates are reported as deferred and left for the next run.
+"""
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+
+from docker_custodian.docker_gc import can_remove_by_id
+from docker_custodian.docker_gc import format_size
+from docker_custodian.docker_gc import no_image_tags
+from docker_custodian.plan import remove_planned_container
+from docker_custodian.plan import remove_planned_image
+from docker_custodian.plan import remove_planned_volume
+from docker_custodian.plan import removable_containers
+from docker_custodian.plan import removable_images
+from docker_custodian.plan import removable_volumes
+
+
+log = logging.getLogger(__name__)
+
+
+# The share of the budget which may be spent finding candidates
+PLANNING_SHARE = 0.5
+
+
+Candidate = collections.namedtuple(
+    'Candidate',
+    ['kind', 'name', 'size', 'calls', 'remove', 'blocked_by'],
+)
+
+
+class Deadline(object):
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self.start = clock()
+
+    def elapsed(self):
+        return self.clock() - self.start
+
+    def expired(self):
+        return self.elapsed() >= self.seconds
+
+    def planning_expired(self):
+        return self.elapsed() >= self.seconds * PLANNING_SHARE
+
+    def planning_left(self):
+        return self.seconds * PLANNING_SHARE - self.elapsed()
+
+
+def value(candidate):
+    return float(candidate.size) / max(candidate.calls, 1)
+
+
+def image_removal_calls(image_summary):
+    image_tags = image_summary.get('RepoTags')
+    if no_image_tags(image_tags) or can_remove_by_id(image_tags, ()):
+        return 1
+    return len(image_tags)
+
+
+def image_unique_size(image_summary):
+    size = image_summary.get('Size') or 0
+    shared_size = image_summary.get('SharedSize')
+    if shared_size is None or shared_size < 0:
+        return size
+    return size - shared_size
+
+
+def list_containers(client, deadline=None):
+    """Return the listing of all containers, with their sizes if dockerd
+    computes them before the planning share of the deadline is spent.
+
+    Computing sizes can take minutes on a busy host. Without them, containers
+    are ranked as if they were empty.
+    """
+    log.info("Getting all containers with sizes")
+    if deadline is None:
+        return client.containers(all=True, size=True)
+
+    timeout = deadline.planning_left()
+    if timeout > 0:
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(client.containers, all=True, size=True)
+        # A listing which is still running is left to finish on its own
+        executor.shutdown(wait=False)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            pass
+    log.warning("Container sizes took too long, ranking containers without "
+                "their size")
+    return client.containers(all=True)
+
+
+def collect_candidates(client, plan, dry_run, deadline=None):
+    """Return the planned removals which are still valid, as
+    :class:`Candidate` in no particular order.
+    """
+    candidates = []
+    planned_ids = {entry['id'] for entry in plan['containers']}
+
+    # One listing with sizes ranks the containers and re-validates them
+    containers = list_containers(client, deadline)
+
+    for entry, container_summary in removable_containers(
+        client,
+        plan['containers'],
+        containers=containers,
+        since=plan.get('created'),
+    ):
+        candidates.append(Candidate(
+            kind='container',
+            name=entry['id'],
+            size=container_summary.get('SizeRw') or 0,
+            calls=1,
+            remove=make_remover(
+                remove_planned_container, client, entry, dry_run),
+            blocked_by=(),
+        ))
+
+    if plan['images']:
+        # Planned containers are removed before the images they use
+        users = collections.defaultdict(list)
+        for container in containers:
+            if container['Id'] in planned_ids:
+                users[container.get('ImageID')].append(container['Id'])
+        remaining = [
+            container for container in containers
+            if container['Id'] not in planned_ids
+        ]
+        for entry, image_summary in removable_images(
+            client,
+            plan['images'],
+            plan['exclude_images'],
+            containers=remaining,
+        ):
+            candidates.append(Candidate(
+                kind='image',
+                name=entry['id'],
+                size=image_unique_size(image_summary),
+                calls=image_removal_calls(image_summary),
+                remove=make_remover(
+                    remove_planned_image, client, image_summary, dry_run),
+                blocked_by=tuple(users.get(image_summary['Id'], ())),
+            ))
+
+    if plan['volumes']:
+        for entry in removable_volumes(client, plan['volumes']):
+            candidates.append(Candidate(
+                kind='volume',
+                name=entry['name'],
+                # Volume sizes are only available from /system/df
+                size=0,
+                calls=1,
+                remove=make_remover(
+                    remove_planned_volume, client, entry, dry_run),
+                blocked_by=(),
+            ))
+    return candidates
+
+
+def make_remover(func, client, subject, dry_run):
+    def remove():
+        return func(client, subject, dry_run)
+    return remove
+
+
+def apply_plan_by_value(client, plan, dry_run, deadline, on_removed=None):
+    """Remove the planned objects, most bytes per API call first, until the
+    deadline. Returns the candidates which were deferred.
+
+    :param on_removed: called like the on_removed of
+        :func:`docker_custodian.plan.apply_plan`
+    """
+    candidates = collect_candidates(client, plan, dry_run, deadline)
+    candidates.sort(key=value, reverse=True)
+    by_name = {
+        candidate.name: candidate for candidate in candidates
+        if candidate.kind == 'container'
+    }
+
+    done = {}
+    deferred = []
+
+    def run(candidate):
+        if candidate.name in done:
+            return done[candidate.name]
+        for name in candidate.blocked_by:
+            blocker = by_name.get(name)
+            # A planned container which is now running keeps the image
+            if blocker is None or deadline.expired() or not run(blocker):
+                deferred.append(candidate)
+                return False
+        done[candidate.name] = candidate.remove()
+        if done[candidate.name] and on_removed is not None:
+            on_removed(candidate.kind, candidate.name)
+        return done[candidate.name]
+
+    for candidate in candidates:
+        if candidate.name in done:
+            continue
+        if deadline.expired():
+            deferred.append(candidate)
+            continue
+        run(candidate)
+
+    log_deferred(deferred)
+    return deferred
+
+
+def log_deferred(deferred):
+    if not deferred:
+        return
+    counts = collections.Counter(candidate.kind for candidate in deferred)
+    log.info("Deferred %s containers, %s images and %s volumes (%s) to the "
+             "next run" % (
+                 counts['container'],
+                 counts['image'],
+                 counts['volume'],
+                 format_size(sum(candidate.size for candidate in deferred))))
@@ -5,22 +5,51 @@ match some prefix.
 """
 import argparse
 import logging
-import sys
-
-import dateutil.parser
-import docker
-import docker.errors
-import requests.exceptions
 
+from docker_custodian.args import parse_date
+from docker_custodian.args import percent_type
+from docker_custodian.args import seconds_type
+from docker_custodian.args import size_type
 from docker_custodian.args import timedelta_type
-from docker.utils import kwargs_from_env
+from docker_custodian.client import add_client_arguments
+from docker_custodian.client import client_from_args
+from docker_custodian.docker_gc import report
+from docker_custodian.log_output import add_logging_arguments
+from docker_custodian.log_output import configure_logging
+from docker_custodian.log_output import object_extra
+from docker_custodian.resource_limits import find_containers_over_limits
+from docker_custodian.resource_limits import ResourceLimits
 
 
 log = logging.getLogger(__name__)
 
 
-def stop_containers(client, max_run_time, matcher, dry_run):
-    for container_summary in client.containers():
+def stop_containers(
+    client,
+    max_run_time,
+    matcher,
+    dry_run,
+    containers=None,
+    sink=None,
+):
+    """Stop the running containers which match and have been running for
+    longer than max_run_time.
+
+    :param containers: a listing of containers to use instead of listing the
+        running containers, may include stopped containers
+    :param sink: called with a :class:`docker_custodian.docker_gc.Result` for
+        every container
+    """
+    if containers is None:
+        containers = client.containers()
+    else:
+        containers = filter(is_running, containers)
+    for container_summary in containers:
+        names = [
+            name.lstrip('/') for name in container_summary.get('Names') or []
+        ]
+        if names and not any(matcher(name) for name in names):
+            continue
         container = client.inspect_container(container_summary['Id'])
         name = container['Name'].lstrip('/')
         if (
@@ -28,22 +57,94 @@ def stop_containers(client, max_run_time, matcher, dry_run):
             has_been_running_since(container, max_run_time)
         ):
 
-            log.info("Stopping container %s %s: running since %s" % (
+            log.info(
+                "Stopping container %s %s: running since %s",
                 container['Id'][:16],
                 name,
-                container['State']['StartedAt']))
+                container['State']['StartedAt'],
+                extra=object_extra('container', 'stop', container['Id']),
+            )
 
+            error = None
             if not dry_run:
-                stop_container(client, container['Id'])
+                error = stop_container(client, container['Id'])
+            report(sink, 'container', 'stop', container['Id'], name, dry_run,
+                   error)
+
+
+def stop_containers_over_limits(
+    client,
+    limits,
+    window,
+    interval,
+    workers,
+    matcher,
+    dry_run,
+    containers=None,
+):
+    """Stop the running containers which match and stayed over the
+    :class:`docker_custodian.resource_limits.ResourceLimits` for window
+    seconds.
+    """
+    if containers is None:
+        containers = client.containers()
+    else:
+        containers = filter(is_running, containers)
+    container_ids = [
+        container_summary['Id'] for container_summary in containers
+        if any(
+            matcher(name.lstrip('/'))
+            for name in container_summary.get('Names') or []
+        )
+    ]
+    log.info("Sampling resource usage of %s containers", len(container_ids))
+
+    for container_id in find_containers_over_limits(
+        client,
+        container_ids,
+        limits,
+        window,
+        interval,
+        workers,
+    ):
+        log.info(
+            "Stopping container %s: over resource limits for %ss",
+            container_id[:16],
+            window,
+            extra=object_extra('container', 'stop', container_id),
+        )
+        if not dry_run:
+            stop_container(client, container_id)
+
+
+def get_resource_limits(opts):
+    if opts.max_cpu is None and opts.max_memory is None:
+        return None
+    return ResourceLimits(opts.max_cpu, opts.max_memory)
 
 
 def stop_container(client, id):
+    """Stop a container, returns the error which was logged or None."""
+    import docker.errors
+    import requests.exceptions
+
     try:
         client.stop(id)
     except requests.exceptions.Timeout as e:
         log.warn("Failed to stop container %s: %s" % (id, e))
+        return e
     except docker.errors.APIError as ae:
         log.warn("Error stopping %s: %s" % (id, ae))
+        return ae
+    return None
+
+
+def is_running(container_summary):
+    # State was added to the container list in API 1.23
+    state = container_summary.get('State')
+    if state is not None:
+        return state == 'running'
+    return container_summary.get('Status', 'Up').startswith('Up')
 
 
 def build_container_matcher(prefixes):
@@ -57,26 +158,50 @@ def has_been_running_since(container, min_time):
     if not started_at:
         return False
 
-    return dateutil.parser.parse(started_at) <= min_time
+    return parse_date(started_at) <= min_time
 
 
 def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(message)s",
-        stream=sys.stdout)
-
     opts = get_opts()
-    client = docker.APIClient(version='auto',
-                              timeout=opts.timeout,
-                              **kwargs_from_env())
+    configure_logging(opts)
+    client = client_from_args(opts)
 
     matcher = build_container_matcher(opts.prefix)
-    stop_containers(client, opts.max_run_time, matcher, opts.dry_run)
+    if opts.max_run_time:
+        stop_containers(client, opts.max_run_time, matcher, opts.dry_run)
+
+    limits = get_resource_limits(opts)
+    if limits:
+        stop_containers_over_limits(
+            client,
+            limits,
+            opts.limit_window,
+            opts.sample_interval,
+            opts.stats_workers,
+            matcher,
+            opts.dry_run,
+        )
 
 
 def get_opts(args=None):
     parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument(
+        '--dry-run', action="store_true",
+        help="Only log actions, don't stop anything."
+    )
+    add_client_arguments(parser)
+    add_logging_arguments(parser)
+    opts = parser.parse_args(args=args)
+
+    if not opts.prefix:
+        parser.error("Running with no --prefix will match nothing.")
+
+    return opts
+
+
+def add_arguments(parser):
+    """Add the stop options, shared with dccustodian."""
     parser.add_argument(
         '--max-run-time',
         type=timedelta_type,
@@ -89,19 +214,30 @@ def get_opts(args=None):
              "prefix."
     )
     parser.add_argument(
-        '--dry-run', action="store_true",
-        help="Only log actions, don't stop anything."
+        '--max-cpu',
+        type=percent_type,
+        help="Stop containers using more CPU than this, in percent of one "
+             "CPU, for example 200%%."
     )
     parser.add_argument(
-        '-t', '--timeout', type=int, default=60,
-        help="HTTP timeout in seconds for making docker API calls."
+        '--max-memory',
+        type=size_type,
+        help="Stop containers using more memory than this, excluding the "
+             "page cache, for example 8G."
+    )
+    parser.add_argument(
+        '--for', dest='limit_window', type=seconds_type, default=0,
+        help="Only stop containers which stay over --max-cpu or "
+             "--max-memory for this long, sampled every --sample-interval."
+    )
+    parser.add_argument(
+        '--sample-interval', type=seconds_type, default=30,
+        help="Time between resource usage samples."
+    )
+    parser.add_argument(
+        '--stats-workers', type=int, default=8,
+        help="Number of containers to sample resource usage of at once."
     )
-    opts = parser.parse_args(args=args)
-
-    if not opts.prefix:
-        parser.error("Running with no --prefix will match nothing.")
-
-    return opts
 
 
 if __name__ == "__main__":
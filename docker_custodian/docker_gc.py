@@ -4,18 +4,35 @@ Remove old docker containers and images that are no longer in use.
 
 """
 import argparse
+import contextlib
+import datetime
 import fnmatch
 import logging
 import sys
-
-import dateutil.parser
-import docker
-import docker.errors
-import requests.exceptions
+import threading
+import time
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from docker_custodian.args import datetime_seconds_ago
+from docker_custodian.args import keep_last_type
+from docker_custodian.args import parse_date
+from docker_custodian.args import seconds_type
+from docker_custodian.args import size_type
 from docker_custodian.args import timedelta_type
-from docker.utils import kwargs_from_env
+from docker_custodian.client import add_client_arguments
+from docker_custodian.client import client_from_args
+from docker_custodian.container_logs import enforce_log_limit
+from docker_custodian.container_logs import get_log_size
+from docker_custodian.container_logs import LOG_ACTIONS
+from docker_custodian.container_logs import LogLimit
+from docker_custodian.lock import run_lock
+from docker_custodian.log_output import add_logging_arguments
+from docker_custodian.log_output import configure_logging
+from docker_custodian.log_output import format_counts
+from docker_custodian.log_output import LazyFormat
+from docker_custodian.log_output import object_counter
+from docker_custodian.log_output import object_extra
 
 log = logging.getLogger(__name__)
 
@@ -23,42 +40,202 @@ log = logging.getLogger(__name__)
 # This seems to be something docker uses for a null/zero date
 YEAR_ZERO = "0001-01-01T00:00:00Z"
 
+# Networks created by dockerd, and by swarm, which can't be removed
+PREDEFINED_NETWORKS = frozenset([
+    'bridge', 'host', 'none', 'docker_gwbridge', 'ingress'])
+
 ExcludeLabel = namedtuple('ExcludeLabel', ['key', 'value'])
 
 
+class Result(namedtuple(
+    'Result',
+    ['kind', 'action', 'id', 'name', 'dry_run', 'error'],
+)):
+    """The outcome of an action on one container, image or volume.
+
+    ``error`` is the exception raised by the API call, or None if the call
+    succeeded or was skipped by ``dry_run``.
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def report(sink, kind, action, object_id, name, dry_run, error=None):
+    if sink is not None:
+        sink(Result(kind, action, object_id, name, dry_run, error))
+
+
 def cleanup_containers(
     client,
     max_container_age,
     dry_run,
     exclude_container_labels,
+    containers=None,
+    log_limit=None,
+    policy=None,
+    sink=None,
+    skip=None,
+    archive=None,
+):
+    """Remove old containers, returns the set of removed container ids.
+
+    When a :class:`docker_custodian.container_logs.LogLimit` is given, the
+    logs of the containers which are kept are held under the limit. When a
+    :class:`docker_custodian.policy.Policy` is given, it replaces
+    max_container_age. sink is called with a :class:`Result` for every
+    container. skip is called with the kind and id of every object before it
+    is inspected, objects for which it returns True are left alone.
+
+    When a :class:`docker_custodian.log_archive.LogArchiver` is given, the
+    containers it wants are only removed once their logs are archived, in
+    the background while other containers are removed.
+    """
+    removed = set()
+    log_bytes = 0
+    # The size of the logs of containers being removed, read before removal
+    log_sizes = {}
+    lock = threading.Lock()
+
+    def report_removal(container, error):
+        nonlocal log_bytes
+        with lock:
+            log_size = log_sizes.pop(container['Id'], 0)
+            if error is None:
+                removed.add(container['Id'])
+                log_bytes += log_size
+            report(sink, 'container', 'remove', container['Id'],
+                   container.get('Name', '').lstrip('/'), False, error)
+
+    def remove(container):
+        _, error = api_call_with_error(
+            client.remove_container,
+            container=container['Id'],
+            v=True,
+        )
+        report_removal(container, error)
+
+    def keep(container):
+        nonlocal log_bytes
+        log_bytes += enforce_log_limit(container, log_limit, dry_run)
+
+    for container in find_containers_to_remove(
+        client,
+        max_container_age,
+        exclude_container_labels,
+        containers=containers,
+        keep=keep if log_limit else None,
+        policy=policy,
+        skip=skip,
+    ):
+        log.info(
+            "Removing container %s %s %s",
+            container['Id'][:16],
+            container.get('Name', '').lstrip('/'),
+            container['State']['FinishedAt'],
+            extra=object_extra('container', 'remove', container['Id']),
+        )
+
+        name = container.get('Name', '').lstrip('/')
+        if dry_run:
+            report(sink, 'container', 'remove', container['Id'], name, True)
+            continue
+        if log_limit:
+            with lock:
+                log_sizes[container['Id']] = get_log_size(container)
+        if archive is not None and archive.wants(container):
+            archive.submit(container, remove, report_removal)
+            continue
+        remove(container)
+
+    if archive is not None:
+        archive.wait()
+    if log_limit:
+        log.info("Container logs freed: %s" % format_size(log_bytes))
+    return removed
+
+
+def cleanup_container_logs(
+    client,
+    log_limit,
+    dry_run,
+    exclude_container_labels,
+    containers=None,
+):
+    """Hold the logs of all containers under log_limit, without removing
+    any container.
+    """
+    if containers is None:
+        containers = get_all_containers(client)
+    freed = 0
+    for container_summary in filter_excluded_containers(
+        containers,
+        exclude_container_labels,
+    ):
+        container = api_call(
+            client.inspect_container,
+            container=container_summary['Id'],
+        )
+        if container:
+            freed += enforce_log_limit(container, log_limit, dry_run)
+    log.info("Container logs freed: %s" % format_size(freed))
+
+
+def find_containers_to_remove(
+    client,
+    max_container_age,
+    exclude_container_labels,
+    containers=None,
+    keep=None,
+    policy=None,
+    skip=None,
+    stop=None,
 ):
-    all_containers = get_all_containers(client)
+    """Yield the inspected containers which are old enough to be removed.
+
+    :param keep: called with the inspect data of each container which is
+        not removed
+    :param policy: a :class:`docker_custodian.policy.Policy` which gives the
+        max age of each container instead of max_container_age. Containers
+        kept by the policy are not inspected.
+    :param skip: called with the kind and id of each container, containers
+        for which it returns True are not inspected
+    :param stop: called before each container is inspected, no more
+        containers are inspected once it returns True
+    """
+    if containers is None:
+        containers = get_all_containers(client)
     filtered_containers = filter_excluded_containers(
-        all_containers,
+        containers,
         exclude_container_labels,
     )
     for container_summary in reversed(list(filtered_containers)):
+        if skip and skip('container', container_summary['Id']):
+            continue
+        min_date = max_container_age
+        if policy is not None:
+            min_date = policy.container_min_date(container_summary)
+            if min_date is None and not keep:
+                continue
+        if stop and stop():
+            return
         container = api_call(
             client.inspect_container,
             container=container_summary['Id'],
         )
-        if not container or not should_remove_container(
+        if not container:
+            continue
+        if min_date is None or not should_remove_container(
             container,
-            max_container_age,
+            min_date,
         ):
+            if keep:
+                keep(container)
             continue
-
-        log.info("Removing container %s %s %s" % (
-            container['Id'][:16],
-            container.get('Name', '').lstrip('/'),
-            container['State']['FinishedAt']))
-
-        if not dry_run:
-            api_call(
-                client.remove_container,
-                container=container['Id'],
-                v=True,
-            )
+        yield container
 
 
 def filter_excluded_containers(containers, exclude_container_labels):
@@ -109,10 +286,10 @@ def should_remove_container(container, min_date):
 
     # Container was created, but never started
     if state.get('FinishedAt') == YEAR_ZERO:
-        created_date = dateutil.parser.parse(container['Created'])
+        created_date = parse_date(container['Created'])
         return created_date < min_date
 
-    finished_date = dateutil.parser.parse(state['FinishedAt'])
+    finished_date = parse_date(state['FinishedAt'])
     return finished_date < min_date
 
 
@@ -137,22 +314,210 @@ def get_dangling_volumes(client):
     return volumes
 
 
-def cleanup_images(client, max_image_age, dry_run, exclude_set):
-    # re-fetch container list so that we don't include removed containers
-
-    containers = get_all_containers(client)
-    images = get_all_images(client)
-    if docker.utils.compare_version('1.21', client._version) < 0:
-        image_tags_in_use = {container['Image'] for container in containers}
-        images = filter_images_in_use(images, image_tags_in_use)
+def cleanup_images(
+    client,
+    max_image_age,
+    dry_run,
+    exclude_set,
+    report_reclaimable=False,
+    containers=None,
+    policy=None,
+    sink=None,
+    skip=None,
+    keep_last=None,
+):
+    """Remove unused images older than max_image_age, or than the age given
+    by the first matching rule of a :class:`docker_custodian.policy.Policy`.
+    sink is called with a :class:`Result` for every image, and images for
+    which skip returns True are not inspected.
+
+    When a :class:`docker_custodian.keep_last.KeepLast` is given, the images
+    of the repositories it keeps by count are removed by count instead of
+    by age.
+    """
+    if keep_last is not None:
+        from docker_custodian.keep_last import (
+            cleanup_images_by_count,
+            exclude_patterns,
+        )
+        # Both passes list the unused images, each image counts as skipped
+        # once per run
+        skip = skip_once(skip)
+        cleanup_images_by_count(
+            client,
+            keep_last,
+            dry_run,
+            exclude_set,
+            containers=containers,
+            sink=sink,
+            skip=skip,
+        )
+        if max_image_age is None and policy is None:
+            return
+        # Tags kept by count are kept, the other tags of their images are
+        # still removed by age
+        counted = exclude_patterns(keep_last)
     else:
-        # ImageID field was added in 1.21
-        image_ids_in_use = {container['ImageID'] for container in containers}
-        images = filter_images_in_use_by_id(images, image_ids_in_use)
+        counted = ()
+    keep_tags_by_id = {}
+
+    def find_images(images=None):
+        for image_summary in find_unused_images(
+            client,
+            exclude_set,
+            containers=containers,
+            images=images,
+            skip=skip,
+        ):
+            keep_tags = matching_tags(image_summary, counted)
+            if not keep_tags or len(keep_tags) < len(image_summary['RepoTags']):
+                keep_tags_by_id[image_summary['Id']] = keep_tags
+                yield image_summary
+
+    if not report_reclaimable:
+        calls_saved = 0
+        for image_summary in find_images():
+            keep_tags = keep_tags_by_id[image_summary['Id']]
+            min_date = max_image_age
+            if policy is not None:
+                min_date = policy.image_min_date(image_summary)
+                if min_date is None:
+                    continue
+            if remove_image(
+                client, image_summary, min_date, dry_run, sink=sink,
+                keep_tags=keep_tags,
+            ):
+                calls_saved += removal_calls_saved(image_summary, keep_tags)
+        log_calls_saved(calls_saved)
+        return
+
+    # Everything is inspected before removing anything, so that the layers
+    # of the images being removed are known when the estimate is made.
+    from docker_custodian.reclaim import build_layer_index
+
+    all_images = get_all_images(client)
+    removals = list(find_old_images(
+        client,
+        find_images(all_images),
+        max_image_age,
+        policy=policy,
+    ))
+    index = build_layer_index(
+        client,
+        all_images,
+        {image['Id']: image for image, _ in removals},
+    )
+    # Images which keep some of their tags are only untagged
+    freed = [
+        image['Id'] for image, _ in removals
+        if not keep_tags_by_id[image['Id']]
+    ]
+    log.info("Reclaimable space from %s images: %s" % (
+        len(freed),
+        format_size(index.reclaimable(freed))))
+
+    removed = []
+    calls_saved = 0
+    for image, image_summary in removals:
+        keep_tags = keep_tags_by_id[image_summary['Id']]
+        log_image_removal(image, image_summary)
+        calls_saved += removal_calls_saved(image_summary, keep_tags)
+        if dry_run:
+            report_image(sink, image_summary, True)
+            continue
+        error = delete_image_with_error(client, image_summary, keep_tags)
+        if error is None and not keep_tags:
+            removed.append(image['Id'])
+        report_image(sink, image_summary, False, error)
+    log_calls_saved(calls_saved)
+
+    if not dry_run:
+        log.info("Reclaimed space from %s images: %s" % (
+            len(removed),
+            format_size(index.reclaimable(removed))))
+
+
+def skip_once(skip):
+    """Return a skip callable which calls skip only once for each object,
+    and gives the same answer when asked again.
+    """
+    if skip is None:
+        return None
+    decisions = {}
+
+    def skip_object(kind, object_id):
+        key = (kind, object_id)
+        if key not in decisions:
+            decisions[key] = skip(kind, object_id)
+        return decisions[key]
+    return skip_object
+
+
+def find_unused_images(
+    client,
+    exclude_set,
+    containers=None,
+    images=None,
+    skip=None,
+):
+    """Return the image summaries which are not used by any container and
+    are not excluded, in the order they should be removed.
+    """
+    if containers is None:
+        # re-fetch container list so that we don't include removed containers
+        containers = get_all_containers(client)
+    if images is None:
+        images = get_all_images(client)
+    images = filter_images_not_in_use(client, images, containers)
     images = filter_excluded_images(images, exclude_set)
+    if skip:
+        images = (image for image in images if not skip('image', image['Id']))
+    return list(reversed(list(images)))
+
+
+def find_old_images(
+    client,
+    image_summaries,
+    min_date,
+    policy=None,
+    stop=None,
+):
+    """Yield (image, image_summary) for the images older than min_date, or
+    than the age given by policy. stop is called before each image is
+    inspected, no more images are inspected once it returns True.
+    """
+    for image_summary in image_summaries:
+        if policy is not None:
+            min_date = policy.image_min_date(image_summary)
+            if min_date is None:
+                continue
+        if stop and stop():
+            return
+        image = api_call(client.inspect_image, image=image_summary['Id'])
+        if image and is_image_old(image, min_date):
+            yield image, image_summary
+
+
+def matching_tags(image_summary, patterns):
+    """Return the tags of an image which match one of patterns."""
+    image_tags = image_summary.get('RepoTags')
+    if not patterns or no_image_tags(image_tags):
+        return []
+    return [
+        image_tag for image_tag in image_tags
+        if any(fnmatch.fnmatch(image_tag, pattern) for pattern in patterns)
+    ]
 
-    for image_summary in reversed(list(images)):
-        remove_image(client, image_summary, max_image_age, dry_run)
+
+def filter_images_not_in_use(client, images, containers):
+    from docker.utils import compare_version
+
+    if compare_version('1.21', client._version) < 0:
+        image_tags_in_use = {container['Image'] for container in containers}
+        return filter_images_in_use(images, image_tags_in_use)
+    # ImageID field was added in 1.21
+    image_ids_in_use = {container['ImageID'] for container in containers}
+    return filter_images_in_use_by_id(images, image_ids_in_use)
 
 
 def filter_excluded_images(images, exclude_set):
@@ -190,61 +555,363 @@ def filter_images_in_use_by_id(images, image_ids_in_use):
 
 
 def is_image_old(image, min_date):
-    return dateutil.parser.parse(image['Created']) < min_date
+    return parse_date(image['Created']) < min_date
 
 
 def no_image_tags(image_tags):
     return not image_tags or image_tags == ['<none>:<none>']
 
 
-def remove_image(client, image_summary, min_date, dry_run):
+def remove_image(
+    client,
+    image_summary,
+    min_date,
+    dry_run,
+    sink=None,
+    keep_tags=(),
+):
+    """Remove an image, or only the tags which are not in keep_tags, if it is
+    older than min_date. Returns True if the image was old enough to be
+    removed.
+    """
     image = api_call(client.inspect_image, image=image_summary['Id'])
     if not image or not is_image_old(image, min_date):
-        return
+        return False
 
-    log.info("Removing image %s" % format_image(image, image_summary))
+    log_image_removal(image, image_summary)
     if dry_run:
-        return
+        report_image(sink, image_summary, True)
+    else:
+        report_image(
+            sink,
+            image_summary,
+            False,
+            delete_image_with_error(client, image_summary, keep_tags),
+        )
+    return True
 
+
+def report_image(sink, image_summary, dry_run, error=None):
+    image_tags = image_summary.get('RepoTags')
+    name = '' if no_image_tags(image_tags) else ', '.join(image_tags)
+    report(sink, 'image', 'remove', image_summary['Id'], name, dry_run, error)
+
+
+def log_image_removal(image, image_summary):
+    log.info(
+        "Removing image %s",
+        LazyFormat(format_image, image, image_summary),
+        extra=object_extra('image', 'remove', image_summary['Id']),
+    )
+
+
+def delete_image(client, image_summary, keep_tags=()):
+    """Remove an image, or only the tags which are not in keep_tags.
+
+    Returns True if every removal call succeeded.
+    """
+    return delete_image_with_error(client, image_summary, keep_tags) is None
+
+
+def delete_image_with_error(client, image_summary, keep_tags=()):
+    """Remove an image like :func:`delete_image`, and return the first error
+    which was logged, or None if every removal call succeeded.
+    """
     image_tags = image_summary.get('RepoTags')
     # If there are no tags, remove the id
     if no_image_tags(image_tags):
-        api_call(client.remove_image, image=image_summary['Id'])
-        return
+        _, error = api_call_with_error(
+            client.remove_image,
+            image=image_summary['Id'],
+        )
+        return error
+
+    # Removing by id with force removes every tag in a single call
+    if can_remove_by_id(image_tags, keep_tags):
+        _, error = api_call_with_error(
+            client.remove_image,
+            image=image_summary['Id'],
+            force=True,
+        )
+        return error
 
     # Remove any repository tags so we don't hit 409 Conflict
-    for image_tag in image_tags:
-        api_call(client.remove_image, image=image_tag)
+    errors = [
+        api_call_with_error(client.remove_image, image=image_tag)[1]
+        for image_tag in image_tags
+        if image_tag not in keep_tags
+    ]
+    return next((error for error in errors if error is not None), None)
 
 
-def remove_volume(client, volume, dry_run):
+def can_remove_by_id(image_tags, keep_tags):
+    return len(image_tags) > 1 and not set(image_tags) & set(keep_tags)
+
+
+def removal_calls_saved(image_summary, keep_tags=()):
+    image_tags = image_summary.get('RepoTags')
+    if no_image_tags(image_tags) or not can_remove_by_id(image_tags, keep_tags):
+        return 0
+    return len(image_tags) - 1
+
+
+def log_calls_saved(calls_saved):
+    if calls_saved:
+        log.info("Saved %s image removal calls by removing images by id",
+                 calls_saved)
+
+
+def cleanup_build_cache(
+    client,
+    max_build_cache_age,
+    max_build_cache_size,
+    dry_run,
+):
+    """Prune the builder cache which has not been used for
+    max_build_cache_age seconds, then the least recently used cache above
+    max_build_cache_size bytes.
+
+    BuildKit only prunes cache which matches both the age filter and the
+    size limit of one prune, so each limit is pruned by its own call.
+    """
+    if dry_run:
+        log.info("Build cache that would be removed: %s" % format_size(
+            estimate_build_cache(
+                client,
+                max_build_cache_age,
+                max_build_cache_size,
+            )))
+        return
+
+    prunes = []
+    if max_build_cache_age is not None:
+        prunes.append((max_build_cache_age, None))
+    if max_build_cache_size is not None:
+        prunes.append((None, max_build_cache_size))
+
+    reclaimed = None
+    for max_age, keep_storage in prunes:
+        result = api_call(
+            prune_builds,
+            client=client,
+            max_age=max_age,
+            keep_storage=keep_storage,
+        )
+        if result:
+            reclaimed = (reclaimed or 0) + (result.get('SpaceReclaimed') or 0)
+    if reclaimed is not None:
+        log.info("Removed build cache: %s" % format_size(reclaimed))
+
+
+def prune_builds(client, max_age, keep_storage):
+    # APIClient.prune_builds() does not support filters or keep-storage
+    from docker.utils import convert_filters
+
+    filters = {}
+    if max_age is not None:
+        filters['until'] = '%ds' % max_age
+    params = {'filters': convert_filters(filters)}
+    if keep_storage is not None:
+        params['keep-storage'] = keep_storage
+    url = client._url('/build/prune')
+    return client._result(client._post(url, params=params), True)
+
+
+def estimate_build_cache(client, max_build_cache_age, max_build_cache_size):
+    """Return the bytes of build cache :func:`cleanup_build_cache` would
+    remove.
+    """
+    df = api_call(client.df) or {}
+    records = [
+        record for record in df.get('BuildCache') or []
+        if not record.get('InUse')
+    ]
+    total = sum(record.get('Size', 0) for record in df.get('BuildCache') or [])
+
+    def is_old(record):
+        last_used = record.get('LastUsedAt') or record.get('CreatedAt')
+        return parse_date(last_used) < datetime_seconds_ago(
+            max_build_cache_age)
+
+    if max_build_cache_age is None and max_build_cache_size is None:
+        return sum(record.get('Size', 0) for record in records)
+
+    pruned = 0
+    if max_build_cache_age is not None:
+        pruned = sum(
+            record.get('Size', 0) for record in records if is_old(record))
+        records = [record for record in records if not is_old(record)]
+    if max_build_cache_size is not None:
+        pruned += min(
+            sum(record.get('Size', 0) for record in records),
+            max(total - pruned - max_build_cache_size, 0),
+        )
+    return pruned
+
+
+def remove_volume(client, volume, dry_run, sink=None):
     if not volume:
         return
 
-    log.info("Removing volume %s" % volume['Name'])
+    log.info(
+        "Removing volume %s",
+        volume['Name'],
+        extra=object_extra('volume', 'remove', volume['Name']),
+    )
     if dry_run:
+        report(sink, 'volume', 'remove', volume['Name'], volume['Name'], True)
         return
 
-    api_call(client.remove_volume, name=volume['Name'])
+    _, error = api_call_with_error(client.remove_volume, name=volume['Name'])
+    report(sink, 'volume', 'remove', volume['Name'], volume['Name'], False,
+           error)
 
 
-def cleanup_volumes(client, dry_run):
+def cleanup_volumes(client, dry_run, sink=None, skip=None):
     dangling_volumes = get_dangling_volumes(client)
 
     for volume in reversed(dangling_volumes):
-        log.info("Removing dangling volume %s", volume['Name'])
-        remove_volume(client, volume, dry_run)
+        if volume and skip and skip('volume', volume['Name']):
+            continue
+        remove_volume(client, volume, dry_run, sink=sink)
+
+
+def get_networks_in_use(containers):
+    """Return the names and ids of the networks which containers, running or
+    not, are attached to.
+    """
+    in_use = set()
+    for container in containers:
+        networks = (container.get('NetworkSettings') or {}).get('Networks')
+        for name, endpoint in (networks or {}).items():
+            in_use.add(name)
+            if endpoint and endpoint.get('NetworkID'):
+                in_use.add(endpoint['NetworkID'])
+    return in_use
+
+
+def find_networks_to_remove(
+    client,
+    max_network_age,
+    exclude_network_labels,
+    containers=None,
+    skip=None,
+):
+    """Return the networks created before max_network_age which no container
+    is attached to.
+    """
+    if containers is None:
+        containers = get_all_containers(client)
+    in_use = get_networks_in_use(containers)
+
+    log.info("Getting networks")
+    networks = client.networks()
+    log.info("Found %s networks", len(networks))
+
+    for network in networks:
+        if network['Name'] in PREDEFINED_NETWORKS or network.get('Ingress'):
+            continue
+        if network['Id'] in in_use or network['Name'] in in_use:
+            continue
+        if should_exclude_container_with_labels(
+            {'Labels': network.get('Labels')},
+            exclude_network_labels,
+        ):
+            continue
+        if parse_date(network['Created']) >= max_network_age:
+            continue
+        if skip and skip('network', network['Id']):
+            continue
+        yield network
+
+
+def remove_network(client, network, dry_run, sink=None):
+    log.info(
+        "Removing network %s %s",
+        network['Id'][:16],
+        network['Name'],
+        extra=object_extra('network', 'remove', network['Id']),
+    )
+    if dry_run:
+        report(sink, 'network', 'remove', network['Id'], network['Name'],
+               True)
+        return
+
+    _, error = api_call_with_error(client.remove_network, net_id=network['Id'])
+    report(sink, 'network', 'remove', network['Id'], network['Name'], False,
+           error)
+
+
+def cleanup_networks(
+    client,
+    max_network_age,
+    dry_run,
+    exclude_network_labels,
+    containers=None,
+    sink=None,
+    skip=None,
+    workers=4,
+):
+    """Remove old networks which no container is attached to, on a pool of
+    workers.
+
+    :param containers: a listing of all containers, to avoid listing them
+        again
+    """
+    networks = list(find_networks_to_remove(
+        client,
+        max_network_age,
+        exclude_network_labels,
+        containers=containers,
+        skip=skip,
+    ))
+    if not networks:
+        return
+
+    lock = threading.Lock()
+
+    def locked_sink(result):
+        if sink is not None:
+            with lock:
+                sink(result)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [
+            executor.submit(remove_network, client, network, dry_run,
+                            sink=locked_sink)
+            for network in networks
+        ]:
+            future.result()
 
 
 def api_call(func, **kwargs):
+    result, _ = api_call_with_error(func, **kwargs)
+    return result
+
+
+def api_call_with_error(func, **kwargs):
+    """Call func like :func:`api_call`, and return a tuple of the result and
+    the error which was logged, or None if the call succeeded.
+    """
+    import docker.errors
+    import requests.exceptions
+
     try:
-        return func(**kwargs)
+        return func(**kwargs), None
     except requests.exceptions.Timeout as e:
         params = ','.join('%s=%s' % item for item in kwargs.items())
         log.warn("Failed to call %s %s %s" % (func.__name__, params, e))
+        return None, e
     except docker.errors.APIError as ae:
         params = ','.join('%s=%s' % item for item in kwargs.items())
         log.warn("Error calling %s %s %s" % (func.__name__, params, ae))
+        return None, ae
+
+
+def api_call_ok(func, **kwargs):
+    """Call func like :func:`api_call`, and return True if it succeeded."""
+    _, error = api_call_with_error(func, **kwargs)
+    return error is None
 
 
 def format_image(image, image_summary):
@@ -257,6 +924,37 @@ def format_image(image, image_summary):
     return "%s %s" % (image['Id'][:16], get_tags())
 
 
+def format_size(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num_bytes) < 1024:
+            return "%.1f %s" % (num_bytes, unit)
+        num_bytes /= 1024.0
+    return "%.1f TB" % num_bytes
+
+
+@contextlib.contextmanager
+def log_duration(phase):
+    """Log how long a phase took, with a summary of the objects logged
+    during the phase.
+    """
+    object_counter.take()
+    start = time.monotonic()
+    yield
+    duration = time.monotonic() - start
+    counts = object_counter.take()
+    log.info(
+        "Finished %s in %.1fs%s",
+        phase,
+        duration,
+        LazyFormat(format_counts, counts),
+        extra={'summary': {
+            'phase': phase,
+            'seconds': round(duration, 3),
+            'counts': dict(counts),
+        }},
+    )
+
+
 def build_exclude_set(image_tags, exclude_file):
     exclude_set = set(image_tags or [])
 
@@ -288,40 +986,462 @@ def format_exclude_labels(exclude_label_args):
 
 
 def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(message)s",
-        stream=sys.stdout)
-
     args = get_args()
-    client = docker.APIClient(version='auto',
-                              timeout=args.timeout,
-                              **kwargs_from_env())
+    configure_logging(args)
+    if not has_work(args):
+        log.info("Nothing to do, no cleanup options were given")
+        return
 
+    status = None
+    with run_lock(args.lock_file) as acquired:
+        if not acquired:
+            return
+        if args.schedule:
+            run_scheduled(client_from_args(args), args)
+            return
+        from docker_custodian.incremental import incremental_index
+        with incremental_index(client_from_args(args), args.index) as client:
+            status = run(client, args)
+    if status:
+        sys.exit(status)
+
+
+def run_scheduled(client, args):
+    """Run forever on the schedule given by args."""
+    from docker_custodian.incremental import incremental_index
+    from docker_custodian.schedule import Scheduler
+
+    parsed_at = datetime.datetime.now(datetime.timezone.utc)
+
+    def run_once():
+        removed = []
+
+        def sink(result):
+            if result.ok:
+                removed.append(result)
+        try:
+            with incremental_index(client, args.index) as indexed:
+                run(indexed, refresh_args(args, parsed_at), sink=sink)
+        except Exception:
+            log.exception("Run failed")
+        return len(removed)
+
+    scheduler = Scheduler(
+        client,
+        args.schedule,
+        max_load=args.max_load,
+        max_ping=args.max_ping,
+    )
+    scheduler.run_forever(run_once)
+
+
+def refresh_args(args, parsed_at):
+    """Return a copy of args, which were parsed at parsed_at, for another run.
+
+    Max ages are parsed into dates, which are moved forward by the time since
+    then. Files given as arguments are read again from the start.
+    """
+    elapsed = datetime.datetime.now(datetime.timezone.utc) - parsed_at
+    values = {
+        key: value + elapsed if isinstance(value, datetime.datetime) else value
+        for key, value in vars(args).items()
+    }
+    for arg_file in (args.policy, args.exclude_image_file):
+        if arg_file is not None:
+            arg_file.seek(0)
+    return argparse.Namespace(**values)
+
+
+# The options which read or write a file once, and can't be scheduled
+ONE_SHOT_OPTIONS = (
+    ('plan_out', '--plan-out'),
+    ('apply_plan', '--apply-plan'),
+    ('export_inventory', '--export-inventory'),
+    ('verify_against_reference', '--verify-against-reference'),
+    ('scan_orphans', '--scan-orphans'),
+)
+
+# The options only used by the phases of run_cleanups
+CLEANUP_OPTIONS = (
+    ('keep_last', '--keep-last'),
+    ('failure_ledger', '--failure-ledger'),
+    ('max_log_size', '--max-log-size'),
+    ('pipeline', '--pipeline'),
+    ('report_reclaimable', '--report-reclaimable'),
+    ('archive_logs', '--archive-logs'),
+)
+
+
+def warn_ignored_options(args, mode):
+    """Log a warning for each option given in args which is not used with
+    mode.
+    """
+    for dest, option in CLEANUP_OPTIONS:
+        if getattr(args, dest):
+            log.warning("Ignoring %s, it is not used with %s" % (
+                option, mode))
+
+
+def plan_sink(sink, dry_run):
+    """Return an on_removed callback for applying a plan, which reports
+    every removed object to sink.
+    """
+    if sink is None:
+        return None
+
+    def on_removed(kind, object_id):
+        report(sink, kind, 'remove', object_id, object_id, dry_run)
+    return on_removed
+
+
+def run(client, args, containers=None, sink=None):
+    """Run the cleanup phases selected by args.
+
+    :param containers: a listing of all containers to use instead of listing
+        them again. Removed containers are dropped from the list.
+    :param sink: called with a :class:`Result` for every container, image
+        and volume
+    :returns: 1 when ``--verify-against-reference`` found divergences, to be
+        used as the exit status
+    """
     exclude_container_labels = format_exclude_labels(
         args.exclude_container_label
     )
 
-    if args.max_container_age:
-        cleanup_containers(
+    policy = None
+    if args.policy:
+        from docker_custodian.policy import load_policy
+        policy = load_policy(
+            args.policy,
+            max_container_age=args.max_container_age,
+            max_image_age=args.max_image_age,
+        )
+
+    if args.apply_plan:
+        from docker_custodian.plan import apply_plan, read_plan
+        warn_ignored_options(args, '--apply-plan')
+        apply_plan(
             client,
-            args.max_container_age,
+            read_plan(args.apply_plan),
             args.dry_run,
+            on_removed=plan_sink(sink, args.dry_run),
+        )
+        return
+
+    if args.plan_out:
+        from docker_custodian.plan import build_plan, write_plan
+        warn_ignored_options(args, '--plan-out')
+        plan = build_plan(
+            client,
+            args.max_container_age,
+            args.max_image_age,
+            args.dangling_volumes,
             exclude_container_labels,
+            build_exclude_set(args.exclude_image, args.exclude_image_file),
+            policy=policy,
+        )
+        write_plan(plan, args.plan_out)
+        return
+
+    if args.export_inventory:
+        from docker_custodian.inventory import (
+            collect_inventory,
+            write_inventory,
+        )
+        with log_duration('inventory'):
+            write_inventory(
+                collect_inventory(client, containers=containers),
+                args.export_inventory,
+            )
+        return
+
+    if args.verify_against_reference:
+        from docker_custodian.oracle import verify
+        with log_duration('verification'):
+            divergences = verify(
+                client,
+                args,
+                exclude_container_labels,
+                build_exclude_set(args.exclude_image, args.exclude_image_file),
+            )
+        return 1 if divergences else None
+
+    if args.scan_orphans:
+        from docker_custodian.orphans import scan_orphans
+        with log_duration('orphans'):
+            scan_orphans(
+                client,
+                args.scan_orphans,
+                quarantine_dir=args.quarantine_orphans,
+                dry_run=args.dry_run,
+                workers=args.scan_workers,
+                sink=sink,
+            )
+        return
+
+    if args.checkpoint:
+        from docker_custodian.checkpoint import run_checkpointed
+        warn_ignored_options(args, '--checkpoint')
+        with log_duration('containers, images and volumes'):
+            finished = run_checkpointed(
+                client,
+                args,
+                exclude_container_labels,
+                build_exclude_set(args.exclude_image, args.exclude_image_file),
+                policy=policy,
+                sink=sink,
+            )
+        if finished:
+            cleanup_build_cache_phase(client, args)
+            cleanup_networks_phase(client, args, sink=sink)
+        return
+
+    if args.max_duration and args.archive_logs:
+        log.warning("Not using --max-duration with --archive-logs, so that "
+                    "the logs of every container are archived before it is "
+                    "removed")
+    elif args.max_duration:
+        from docker_custodian.deadline import apply_plan_by_value, Deadline
+        from docker_custodian.plan import build_plan
+        warn_ignored_options(args, '--max-duration')
+        deadline = Deadline(args.max_duration)
+        with log_duration('containers, images and volumes'):
+            plan = build_plan(
+                client,
+                args.max_container_age,
+                args.max_image_age,
+                args.dangling_volumes,
+                exclude_container_labels,
+                build_exclude_set(args.exclude_image, args.exclude_image_file),
+                deadline=deadline,
+                policy=policy,
+            )
+            apply_plan_by_value(
+                client,
+                plan,
+                args.dry_run,
+                deadline,
+                on_removed=plan_sink(sink, args.dry_run),
+            )
+        if deadline.expired():
+            return
+        cleanup_build_cache_phase(client, args)
+        cleanup_networks_phase(client, args, sink=sink)
+        return
+
+    from docker_custodian.failures import failure_ledger
+    with failure_ledger(args.failure_ledger, args.dry_run) as ledger:
+        run_cleanups(
+            client,
+            args,
+            exclude_container_labels,
+            policy,
+            containers=containers,
+            sink=ledger.sink(sink) if ledger else sink,
+            skip=ledger.should_skip if ledger else None,
+        )
+
+
+def run_cleanups(
+    client,
+    args,
+    exclude_container_labels,
+    policy,
+    containers=None,
+    sink=None,
+    skip=None,
+):
+    """Run the container, image, build cache and volume phases."""
+    log_limit = None
+    if args.max_log_size is not None:
+        log_limit = LogLimit(args.max_log_size, args.log_action)
+
+    archive = None
+    if args.archive_logs:
+        from docker_custodian.log_archive import LogArchiver
+        archive = LogArchiver(
+            client,
+            args.archive_logs,
+            format_exclude_labels(args.archive_label),
+            workers=args.archive_workers,
         )
 
-    if args.max_image_age:
+    if args.pipeline:
+        from docker_custodian.pipeline import can_pipeline, run_pipelined
+        if can_pipeline(client, args, policy):
+            run_pipelined(
+                client,
+                args,
+                exclude_container_labels,
+                policy,
+                log_limit=log_limit,
+                containers=containers,
+                sink=sink,
+                skip=skip,
+                archive=archive,
+            )
+            return
+        log.info("Running phases one after the other, --pipeline needs "
+                 "both containers and images to be removed by age")
+
+    if args.max_container_age or (policy and policy.container_rules):
+        with log_duration('containers'):
+            removed = cleanup_containers(
+                client,
+                args.max_container_age,
+                args.dry_run,
+                exclude_container_labels,
+                containers=containers,
+                log_limit=log_limit,
+                policy=policy,
+                sink=sink,
+                skip=skip,
+                archive=archive,
+            )
+        if containers is not None:
+            containers[:] = [
+                container for container in containers
+                if container['Id'] not in removed
+            ]
+    elif log_limit:
+        with log_duration('container logs'):
+            cleanup_container_logs(
+                client,
+                log_limit,
+                args.dry_run,
+                exclude_container_labels,
+                containers=containers,
+            )
+
+    keep_last = None
+    if args.keep_last:
+        from docker_custodian.keep_last import build_keep_last
+        keep_last = build_keep_last(args.keep_last)
+
+    if args.max_image_age or (policy and policy.image_rules) or keep_last:
         exclude_set = build_exclude_set(
             args.exclude_image,
             args.exclude_image_file)
-        cleanup_images(client, args.max_image_age, args.dry_run, exclude_set)
+        with log_duration('images'):
+            cleanup_images(
+                client,
+                args.max_image_age,
+                args.dry_run,
+                exclude_set,
+                report_reclaimable=args.report_reclaimable,
+                containers=containers,
+                policy=policy,
+                sink=sink,
+                skip=skip,
+                keep_last=keep_last,
+            )
+
+    cleanup_build_cache_phase(client, args)
 
     if args.dangling_volumes:
-        cleanup_volumes(client, args.dry_run)
+        with log_duration('volumes'):
+            cleanup_volumes(client, args.dry_run, sink=sink, skip=skip)
+
+    cleanup_networks_phase(
+        client, args, containers=containers, sink=sink, skip=skip)
+
+
+def cleanup_build_cache_phase(client, args):
+    if (
+        args.max_build_cache_age is None and
+        args.max_build_cache_size is None
+    ):
+        return
+    with log_duration('build cache'):
+        cleanup_build_cache(
+            client,
+            args.max_build_cache_age,
+            args.max_build_cache_size,
+            args.dry_run,
+        )
+
+
+def cleanup_networks_phase(client, args, containers=None, sink=None, skip=None):
+    if not args.max_network_age:
+        return
+    with log_duration('networks'):
+        cleanup_networks(
+            client,
+            args.max_network_age,
+            args.dry_run,
+            format_exclude_labels(args.exclude_network_label),
+            containers=containers,
+            sink=sink,
+            skip=skip,
+            workers=args.network_workers,
+        )
+
+
+def has_work(args):
+    return any([
+        args.max_container_age,
+        args.max_image_age,
+        args.keep_last,
+        args.policy,
+        args.dangling_volumes,
+        args.max_network_age,
+        args.max_log_size is not None,
+        args.max_build_cache_age is not None,
+        args.max_build_cache_size is not None,
+        args.plan_out,
+        args.apply_plan,
+        args.export_inventory,
+        args.scan_orphans,
+    ])
 
 
 def get_args(args=None):
     parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument(
+        '--dry-run', action="store_true",
+        help="Only log actions, don't remove anything.")
+    parser.add_argument(
+        '--schedule',
+        type=seconds_type,
+        help="Keep running, and clean up once every this long. Every host "
+             "runs at its own offset into the interval. The interval is "
+             "doubled, up to 4 times, while runs remove nothing. Can't be "
+             "used with the options which run once, like --plan-out.")
+    parser.add_argument(
+        '--max-load',
+        type=float,
+        default=1.0,
+        help="With --schedule, defer a run while the 1 minute load average "
+             "per CPU is above this.")
+    parser.add_argument(
+        '--max-ping',
+        type=float,
+        default=1.0,
+        help="With --schedule, defer a run while dockerd takes longer than "
+             "this many seconds to answer a ping.")
+    parser.add_argument(
+        '--index',
+        help="Keep the inspect data of containers and images in this file, "
+             "and only inspect what changed since the last run, from the "
+             "events of dockerd. Everything is inspected again when the "
+             "file is missing, older than a day, or too many events "
+             "happened since.")
+    add_client_arguments(parser)
+    add_logging_arguments(parser)
+    opts = parser.parse_args(args=args)
+
+    if opts.schedule:
+        for dest, option in ONE_SHOT_OPTIONS:
+            if getattr(opts, dest):
+                parser.error("%s runs once, it can't be used with "
+                             "--schedule." % option)
+
+    return opts
+
+
+def add_arguments(parser):
+    """Add the cleanup options, shared with dccustodian."""
     parser.add_argument(
         '--max-container-age',
         type=timedelta_type,
@@ -334,16 +1454,63 @@ def get_args(args=None):
         help="Maxium age for an image. Images older than this age will be "
              "removed. Age can be specified in any pytimeparse supported "
              "format.")
+    parser.add_argument(
+        '--keep-last',
+        type=keep_last_type, action='append', default=[],
+        metavar='[REPO=]N',
+        help="Keep the newest N images of every repository, and remove the "
+             "tags of older images whatever their age. REPO=N keeps N images "
+             "of the repositories matching the REPO pattern instead. Can be "
+             "given more than once. Untagged images are still removed by "
+             "--max-image-age.")
+    parser.add_argument(
+        '--max-log-size',
+        type=size_type,
+        help="Truncate or rotate the json-file logs of containers which are "
+             "larger than this, for example 1GB. Requires access to the "
+             "docker data root.")
+    parser.add_argument(
+        '--log-action',
+        choices=LOG_ACTIONS, default='truncate',
+        help="What to do with logs larger than --max-log-size. rotate "
+             "compresses the log to <LogPath>.1.gz before truncating it.")
+    parser.add_argument(
+        '--max-build-cache-age',
+        type=seconds_type,
+        help="Remove builder cache which has not been used for this long. "
+             "Age can be specified in any pytimeparse supported format.")
+    parser.add_argument(
+        '--max-build-cache-size',
+        type=size_type,
+        help="Remove the least recently used builder cache until at most "
+             "this much is left, for example 20GB. Applied after "
+             "--max-build-cache-age.")
+    parser.add_argument(
+        '--policy',
+        type=argparse.FileType('r'),
+        help="Path to a JSON (or YAML) retention policy with ordered rules "
+             "which give the max age of containers by label and image, and "
+             "of images by tag. Replaces --max-container-age and "
+             "--max-image-age, which are used when the policy has no rules "
+             "for containers or for images.")
     parser.add_argument(
         '--dangling-volumes',
         action="store_true",
         help="Dangling volumes will be removed.")
     parser.add_argument(
-        '--dry-run', action="store_true",
-        help="Only log actions, don't remove anything.")
+        '--max-network-age',
+        type=timedelta_type,
+        help="Remove user defined networks older than this which no "
+             "container, running or not, is attached to. Age can be "
+             "specified in any pytimeparse supported format.")
     parser.add_argument(
-        '-t', '--timeout', type=int, default=60,
-        help="HTTP timeout in seconds for making docker API calls.")
+        '--exclude-network-label',
+        action='append', type=str, default=[],
+        help="Never remove networks with this label key or label key=value")
+    parser.add_argument(
+        '--network-workers',
+        type=int, default=4,
+        help="With --max-network-age, remove this many networks at once.")
     parser.add_argument(
         '--exclude-image',
         action='append',
@@ -357,8 +1524,97 @@ def get_args(args=None):
         '--exclude-container-label',
         action='append', type=str, default=[],
         help="Never remove containers with this label key or label key=value")
-
-    return parser.parse_args(args=args)
+    parser.add_argument(
+        '--report-reclaimable', action="store_true",
+        help="Log the disk space freed by the images which are removed, "
+             "counting layers shared between images once. Unless none of "
+             "the removed images share layers, every image which shares "
+             "layers with any other image is inspected, which is most of "
+             "them on most hosts. With --index they are only inspected "
+             "again when they change.")
+    parser.add_argument(
+        '--pipeline', action="store_true",
+        help="Remove images while containers are still being removed, as "
+             "soon as the last container using an image is removed.")
+    parser.add_argument(
+        '--max-duration',
+        type=seconds_type,
+        help="Stop removing after this long. Containers, images and volumes "
+             "are removed in order of reclaimable bytes per API call, and "
+             "whatever is left is deferred to the next run. Duration can be "
+             "specified in any pytimeparse supported format.")
+
+    plan_group = parser.add_mutually_exclusive_group()
+    plan_group.add_argument(
+        '--plan-out',
+        type=argparse.FileType('w'),
+        help="Write the containers, images and volumes which would be "
+             "removed to this file as JSON, without removing anything.")
+    plan_group.add_argument(
+        '--apply-plan',
+        type=argparse.FileType('r'),
+        help="Remove the objects listed in a plan written by --plan-out. "
+             "Objects which are now running, in use or gone are skipped.")
+    plan_group.add_argument(
+        '--export-inventory',
+        type=argparse.FileType('wb'),
+        help="Write the containers and images of the host to this file as "
+             "NumPy arrays, without removing anything. Requires numpy.")
+    plan_group.add_argument(
+        '--verify-against-reference',
+        action='store_true',
+        help="Check that every way dcgc decides what to remove, with "
+             "--pipeline, plans and inventories, removes exactly what the "
+             "original logic would for --max-container-age, "
+             "--max-image-age and the exclude options, over a single "
+             "listing of the host. Logs the differences, without removing "
+             "anything, and exits with status 1 if there are any.")
+    plan_group.add_argument(
+        '--scan-orphans',
+        metavar='DATA_ROOT',
+        help="Report the overlay2 layer and container directories under the "
+             "docker data root, for example /var/lib/docker, which dockerd "
+             "no longer references, without removing anything.")
+    plan_group.add_argument(
+        '--archive-logs',
+        metavar='DIR',
+        help="Compress the logs of containers to this directory before "
+             "removing them. A container is only removed once its logs are "
+             "archived, other containers are removed in the meantime.")
+    plan_group.add_argument(
+        '--checkpoint',
+        help="Write the plan and every removal to this journal file. If a "
+             "run is interrupted, the next run with the same options "
+             "removes what is left of the plan instead of starting over.")
+    parser.add_argument(
+        '--archive-label',
+        action='append', type=str, default=[],
+        help="With --archive-logs, only archive the logs of containers with "
+             "this label key or label key=value.")
+    parser.add_argument(
+        '--archive-workers',
+        type=int, default=4,
+        help="With --archive-logs, archive the logs of this many containers "
+             "at once.")
+    parser.add_argument(
+        '--quarantine-orphans',
+        metavar='DIR',
+        help="With --scan-orphans, move the orphaned directories to this "
+             "directory, which should be on the same filesystem as the data "
+             "root.")
+    parser.add_argument(
+        '--scan-workers',
+        type=int, default=8,
+        help="With --scan-orphans, measure this many directories at once.")
+    parser.add_argument(
+        '--lock-file',
+        help="Exit without doing anything if another run holds the lock on "
+             "this file.")
+    parser.add_argument(
+        '--failure-ledger',
+        help="Remember the containers, images and volumes which failed to be "
+             "removed in this file, and skip them for a number of runs which "
+             "doubles with every failure in a row.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+# -*- coding: utf8 -*-
+"""
+Back off from containers, images and volumes which fail to be removed on
+every run.
+
+With ``--failure-ledger`` the failed removals of a run are written to a
+ledger file, keyed by object and class of error. An object which failed ``n``
+times in a row with the same class of error is skipped by the next
+``2 ** (n - 1)`` runs, up to :data:`MAX_SKIPPED_RUNS`, before it is inspected
+and removed again. Counting runs instead of time backs off the same way
+whether dcgc runs every hour or every day.
+
+Objects which failed :data:`CHRONIC_FAILURES` times in a row are listed in
+the summary at the end of the run. Entries are forgotten once the object is
+removed, or when it was not seen for :data:`EXPIRE_SECONDS`.
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import time
+
+from docker_custodian.log_output import format_counts
+from docker_custodian.log_output import object_extra
+
+
+log = logging.getLogger(__name__)
+
+
+LEDGER_VERSION = 1
+
+MAX_SKIPPED_RUNS = 64
+
+CHRONIC_FAILURES = 5
+
+# Entries of objects which were not listed for this long are dropped, the
+# object is gone or not a candidate for removal anymore
+EXPIRE_SECONDS = 30 * 24 * 3600
+
+
+def error_class(error):
+    """Return the class of an error, with the HTTP status of API errors."""
+    name = type(error).__name__
+    status_code = getattr(error, 'status_code', None)
+    if status_code:
+        return '%s %s' % (name, status_code)
+    return name
+
+
+def ledger_key(kind, object_id):
+    return '%s:%s' % (kind, object_id)
+
+
+class FailureLedger(object):
+    """The failed removals of earlier runs.
+
+    :param entries: a dict of :func:`ledger_key` to an entry with the class
+        of the error, the number of failures in a row and the number of
+        runs left to skip
+    """
+
+    def __init__(self, path, entries=None, now=None):
+        self.path = path
+        self.entries = entries or {}
+        self.now = time.time() if now is None else now
+        self.skipped = collections.Counter()
+
+    @classmethod
+    def load(cls, path, now=None):
+        """Load the ledger at path, or start an empty one."""
+        ledger = cls(path, now=now)
+        try:
+            with open(path) as ledger_file:
+                content = json.load(ledger_file)
+        except FileNotFoundError:
+            return ledger
+        except ValueError:
+            log.info("Ignoring unreadable failure ledger %s" % path)
+            return ledger
+        if content.get('version') != LEDGER_VERSION:
+            log.info("Ignoring failure ledger %s: unsupported version %s" % (
+                path, content.get('version')))
+            return ledger
+
+        ledger.entries = {
+            key: entry for key, entry in content['failures'].items()
+            if entry['seen'] >= ledger.now - EXPIRE_SECONDS
+        }
+        return ledger
+
+    def should_skip(self, kind, object_id):
+        """Return True if the removal of an object is backing off. Every call
+        counts as one run skipped.
+        """
+        entry = self.entries.get(ledger_key(kind, object_id))
+        if entry is None:
+            return False
+        entry['seen'] = self.now
+        if entry['skip'] <= 0:
+            return False
+        entry['skip'] -= 1
+        self.skipped[kind] += 1
+        log.debug(
+            "Skipping %s %s, removal failed %s times in a row (%s)",
+            kind,
+            object_id[:16],
+            entry['failures'],
+            entry['error'],
+            extra=object_extra(kind, 'skip', object_id),
+        )
+        return True
+
+    def record(self, result):
+        """Record the :class:`docker_custodian.docker_gc.Result` of a
+        removal.
+        """
+        if result.dry_run:
+            return
+        key = ledger_key(result.kind, result.id)
+        if result.ok:
+            self.entries.pop(key, None)
+            return
+
+        error = error_class(result.error)
+        entry = self.entries.get(key)
+        if entry is None or entry['error'] != error:
+            entry = self.entries[key] = {
+                'error': error,
+                'failures': 0,
+                'first': self.now,
+            }
+        entry['failures'] += 1
+        entry['skip'] = min(2 ** (entry['failures'] - 1), MAX_SKIPPED_RUNS)
+        entry['name'] = result.name
+        entry['seen'] = self.now
+        if entry['failures'] >= CHRONIC_FAILURES:
+            log.warning(
+                "Removing %s %s %s failed %s times in a row (%s)",
+                result.kind,
+                result.id[:16],
+                result.name,
+                entry['failures'],
+                error,
+                extra=object_extra(
+                    result.kind, 'fail', result.id,
+                    failures=entry['failures']),
+            )
+
+    def sink(self, sink=None):
+        """Return a sink which records every result, and also calls sink."""
+        def recording_sink(result):
+            self.record(result)
+            if sink is not None:
+                sink(result)
+        return recording_sink
+
+    def chronic(self):
+        """Return the keys and entries of the chronic failures."""
+        return sorted(
+            (key, entry) for key, entry in self.entries.items()
+            if entry['failures'] >= CHRONIC_FAILURES
+        )
+
+    def log_summary(self):
+        chronic = self.chronic()
+        log.info(
+            "Skipped %s objects which failed removal in earlier runs%s, "
+            "%s chronic failures",
+            sum(self.skipped.values()),
+            format_counts(self.skipped),
+            len(chronic),
+            extra={'summary': {
+                'phase': 'failures',
+                'counts': dict(self.skipped),
+                'chronic': {key: entry for key, entry in chronic},
+            }},
+        )
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as ledger_file:
+            json.dump({
+                'version': LEDGER_VERSION,
+                'failures': self.entries,
+            }, ledger_file, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+
+@contextlib.contextmanager
+def failure_ledger(path, dry_run=False):
+    """Load the ledger at path for a run, and log its summary and save it
+    when the run ends. Yields None when path is None. A dry run does not
+    change the ledger.
+    """
+    if path is None:
+        yield None
+        return
+
+    ledger = FailureLedger.load(path)
+    try:
+        yield ledger
+    finally:
+        ledger.log_summary()
+        if not dry_run:
+            ledger.save()
@@ -0,0 +1,262 @@
+# -*- coding: utf8 -*-
+"""
+Keep the inspect data of containers and images between dcgc runs, and only
+inspect what changed since the last run.
+
+With ``--index`` the inspect data used by dcgc is saved to an index file with
+the time the run started. The next run reads the events of dockerd since
+then, and inspects again only the containers which were created, started,
+stopped, renamed or destroyed, and the images which were untagged or
+deleted. Containers and images are still listed on every run, and a
+container whose state in the listing does not match the index is inspected
+again too. That misses a container which was started and stopped again
+since the last run, so a container whose inspect data came from the index
+is inspected again before it is removed, and kept if its state changed.
+
+dockerd only keeps its last :data:`EVENTS_LIMIT` events, in memory. When
+that many events happened since the last run, the index is older than
+:data:`MAX_INDEX_AGE`, or it is missing, everything is inspected again.
+"""
+import contextlib
+import json
+import logging
+import os
+import time
+
+from docker_custodian.plan import is_running
+
+
+log = logging.getLogger(__name__)
+
+
+INDEX_VERSION = 1
+
+EVENTS_LIMIT = 256
+
+MAX_INDEX_AGE = 24 * 3600
+
+CONTAINER_EVENTS = frozenset(['create', 'start', 'die', 'destroy', 'rename'])
+
+IMAGE_EVENTS = frozenset(['untag', 'delete'])
+
+
+def compact_container(container):
+    """Return the parts of the inspect data of a container used by dcgc."""
+    state = container.get('State') or {}
+    return {
+        'Id': container['Id'],
+        'Name': container.get('Name', ''),
+        'Created': container.get('Created'),
+        'State': {
+            key: state[key]
+            for key in ('Running', 'Ghost', 'StartedAt', 'FinishedAt')
+            if key in state
+        },
+        'Config': {'Labels': (container.get('Config') or {}).get('Labels')},
+        'HostConfig': {
+            'LogConfig': (container.get('HostConfig') or {}).get('LogConfig'),
+        },
+        'LogPath': container.get('LogPath'),
+        'GraphDriver': container.get('GraphDriver'),
+    }
+
+
+def compact_image(image):
+    """Return the parts of the inspect data of an image used by dcgc."""
+    return {
+        'Id': image['Id'],
+        'Created': image['Created'],
+        'RootFS': image.get('RootFS'),
+        'GraphDriver': image.get('GraphDriver'),
+    }
+
+
+class IndexedBackend(object):
+    """Wrap a backend to serve the inspect data of containers and images from
+    the index, and add what is inspected to it.
+    """
+
+    def __init__(self, backend, containers=None, images=None):
+        self.backend = backend
+        self.container_index = containers or {}
+        self.image_index = images or {}
+        self.listed_containers = None
+        self.listed_images = None
+        # The containers inspected in this run, rather than served from the
+        # index
+        self.inspected_containers = set()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def containers(self, all=False, **kwargs):
+        containers = self.backend.containers(all=all, **kwargs)
+        for container in containers:
+            indexed = self.container_index.get(container['Id'])
+            if (
+                indexed is not None and
+                bool(indexed['State'].get('Running')) != is_running(container)
+            ):
+                del self.container_index[container['Id']]
+        if all:
+            self.listed_containers = {container['Id'] for container in containers}
+        return containers
+
+    def inspect_container(self, container):
+        indexed = self.container_index.get(container)
+        if indexed is None:
+            indexed = compact_container(
+                self.backend.inspect_container(container=container))
+            self.container_index[container] = indexed
+            self.inspected_containers.add(container)
+        return indexed
+
+    def remove_container(self, container, v=False):
+        indexed = self.container_index.get(container)
+        if indexed is not None and container not in self.inspected_containers:
+            self.check_unchanged(container, indexed)
+        self.container_index.pop(container, None)
+        return self.backend.remove_container(container=container, v=v)
+
+    def check_unchanged(self, container, indexed):
+        """Inspect a container served from the index again, and raise an
+        APIError if its state changed since it was indexed.
+        """
+        import docker.errors
+
+        current = compact_container(
+            self.backend.inspect_container(container=container))
+        self.container_index[container] = current
+        self.inspected_containers.add(container)
+        if current['State'] != indexed['State']:
+            raise docker.errors.APIError(
+                "Container %s changed since it was indexed, not removing it" % (
+                    container))
+
+    def images(self, **kwargs):
+        images = self.backend.images(**kwargs)
+        self.listed_images = {image['Id'] for image in images}
+        return images
+
+    def inspect_image(self, image):
+        indexed = self.image_index.get(image)
+        if indexed is None:
+            indexed = compact_image(self.backend.inspect_image(image=image))
+            self.image_index[image] = indexed
+        return indexed
+
+    def remove_image(self, image, force=False):
+        self.image_index.pop(image, None)
+        return self.backend.remove_image(image=image, force=force)
+
+
+def read_index(path):
+    """Return the index at path, or None if there is no index which can be
+    used.
+    """
+    try:
+        with open(path) as index_file:
+            index = json.load(index_file)
+    except FileNotFoundError:
+        log.info("No index at %s, inspecting everything" % path)
+        return None
+    except ValueError:
+        log.info("Ignoring unreadable index %s" % path)
+        return None
+    if index.get('version') != INDEX_VERSION:
+        log.info("Ignoring index %s: unsupported version %s" % (
+            path, index.get('version')))
+        return None
+    return index
+
+
+def read_events(client, since, until):
+    """Return the events between since and until, or None if they could not
+    be read.
+    """
+    import docker.errors
+    import requests.exceptions
+
+    try:
+        return list(client.events(since=since, until=until, decode=True))
+    except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+        log.warn("Failed to read events: %s" % e)
+        return None
+
+
+def apply_events(client, index, until):
+    """Drop the objects which changed since the index was written from it.
+    Returns False if the events since then can't all be known.
+    """
+    since = index['last_run']
+    if until - since > MAX_INDEX_AGE:
+        log.info("The index is older than %ss, inspecting everything" % (
+            MAX_INDEX_AGE))
+        return False
+
+    events = read_events(client, since, until)
+    if events is None:
+        return False
+    if len(events) >= EVENTS_LIMIT:
+        log.info("%s events since the last run, some may be lost, "
+                 "inspecting everything" % len(events))
+        return False
+
+    changed = 0
+    for event in events:
+        action = event.get('Action') or event.get('status')
+        object_id = event.get('id') or (event.get('Actor') or {}).get('ID')
+        if event.get('Type') == 'container' and action in CONTAINER_EVENTS:
+            changed += index['containers'].pop(object_id, None) is not None
+        elif event.get('Type') == 'image' and action in IMAGE_EVENTS:
+            changed += index['images'].pop(object_id, None) is not None
+    log.info("Applied %s events since the last run, %s indexed objects "
+             "changed" % (len(events), changed))
+    return True
+
+
+def write_index(path, backend, started):
+    containers = backend.container_index
+    if backend.listed_containers is not None:
+        containers = {
+            container_id: container
+            for container_id, container in containers.items()
+            if container_id in backend.listed_containers
+        }
+    images = backend.image_index
+    if backend.listed_images is not None:
+        images = {
+            image_id: image for image_id, image in images.items()
+            if image_id in backend.listed_images
+        }
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as index_file:
+        json.dump({
+            'version': INDEX_VERSION,
+            'last_run': started,
+            'containers': containers,
+            'images': images,
+        }, index_file, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+@contextlib.contextmanager
+def incremental_index(client, path):
+    """Yield a backend which uses the index at path for a run, and save the
+    index when the run finishes. Yields client when path is None.
+    """
+    if path is None:
+        yield client
+        return
+
+    # Events from now on are read by the next run
+    started = int(time.time())
+    index = read_index(path)
+    backend = IndexedBackend(client)
+    if index is not None and apply_events(client, index, started):
+        backend.container_index = index['containers']
+        backend.image_index = index['images']
+
+    yield backend
+    write_index(path, backend, started)
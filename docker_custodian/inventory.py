@@ -0,0 +1,284 @@
+# -*- coding: utf8 -*-
+"""
+Export the containers and images of a host as columns, and evaluate max ages
+over them as array operations.
+
+The inventory is written as a NumPy ``.npz`` file. Dates are seconds since
+the epoch, and tags and labels are interned: every distinct tag or label is
+stored once, and objects refer to them by index. The tags of image ``i`` are
+``tags[image_tag_ids[image_tag_offsets[i]:image_tag_offsets[i + 1]]]``, and
+labels are stored the same way.
+
+:func:`evaluate` makes the same decisions as dcgc for a max container age, a
+max image age and the exclude options, for every object at once. Exclude
+patterns are matched once per distinct tag or label. Policies are not
+supported.
+
+NumPy is only needed by this module, install it with the ``inventory``
+extra.
+"""
+import fnmatch
+
+from docker_custodian.docker_gc import api_call
+from docker_custodian.docker_gc import get_all_containers
+from docker_custodian.docker_gc import get_all_images
+from docker_custodian.docker_gc import no_image_tags
+from docker_custodian.docker_gc import YEAR_ZERO
+from docker_custodian.plan import is_running
+
+
+INVENTORY_VERSION = 1
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError("numpy is required to export or evaluate an "
+                         "inventory")
+    return numpy
+
+
+def to_epoch(date_string):
+    from docker_custodian.args import parse_date
+    return int(parse_date(date_string).timestamp())
+
+
+class Interner(object):
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def intern(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+
+def build_inventory(containers, inspected, images, exported):
+    """Return the inventory columns as a dict of arrays.
+
+    :param containers: the listing of all containers
+    :param inspected: a dict of container id to inspect data, for every
+        container which is not running
+    :param images: the listing of all images
+    :param exported: the time of the export, in seconds since the epoch
+    """
+    numpy = import_numpy()
+    image_index = {image['Id']: i for i, image in enumerate(images)}
+
+    tags = Interner()
+    image_tag_offsets = [0]
+    image_tag_ids = []
+    for image in images:
+        image_tags = image.get('RepoTags')
+        if not no_image_tags(image_tags):
+            image_tag_ids.extend(tags.intern(tag) for tag in image_tags)
+        image_tag_offsets.append(len(image_tag_ids))
+
+    labels = Interner()
+    container_label_offsets = [0]
+    container_label_ids = []
+    created = []
+    finished = []
+    running = []
+    ghost = []
+    for container in containers:
+        container_label_ids.extend(
+            labels.intern(item)
+            for item in sorted((container.get('Labels') or {}).items())
+        )
+        container_label_offsets.append(len(container_label_ids))
+
+        running.append(is_running(container))
+        state = {}
+        if not running[-1]:
+            state = inspected[container['Id']].get('State', {})
+        ghost.append(bool(state.get('Ghost')))
+        created.append(container['Created'])
+        finished_at = state.get('FinishedAt', YEAR_ZERO)
+        finished.append(
+            -1 if finished_at == YEAR_ZERO else to_epoch(finished_at))
+
+    return {
+        'version': numpy.array(INVENTORY_VERSION),
+        'exported': numpy.array(exported, dtype=numpy.int64),
+        'container_id': numpy.array(
+            [container['Id'] for container in containers], dtype=str),
+        # The container listing has the created date as an epoch already
+        'container_created': numpy.array(created, dtype=numpy.int64),
+        'container_finished': numpy.array(finished, dtype=numpy.int64),
+        'container_running': numpy.array(running, dtype=bool),
+        'container_ghost': numpy.array(ghost, dtype=bool),
+        'container_image': numpy.array(
+            [
+                image_index.get(container.get('ImageID'), -1)
+                for container in containers
+            ],
+            dtype=numpy.int32,
+        ),
+        'container_label_offsets': numpy.array(
+            container_label_offsets, dtype=numpy.int64),
+        'container_label_ids': numpy.array(
+            container_label_ids, dtype=numpy.int32),
+        'label_keys': numpy.array(
+            [key for key, _ in labels.values], dtype=str),
+        'label_values': numpy.array(
+            [value for _, value in labels.values], dtype=str),
+        'image_id': numpy.array([image['Id'] for image in images], dtype=str),
+        'image_created': numpy.array(
+            [image['Created'] for image in images], dtype=numpy.int64),
+        'image_size': numpy.array(
+            [image.get('Size', 0) for image in images], dtype=numpy.int64),
+        'image_tag_offsets': numpy.array(
+            image_tag_offsets, dtype=numpy.int64),
+        'image_tag_ids': numpy.array(image_tag_ids, dtype=numpy.int32),
+        'tags': numpy.array(tags.values, dtype=str),
+    }
+
+
+def collect_inventory(client, containers=None, now=None):
+    """List and inspect the containers and images of a host, and return
+    their inventory. Only stopped containers are inspected.
+    """
+    import time
+
+    import_numpy()
+    if containers is None:
+        containers = get_all_containers(client)
+    inspected = {}
+    for container in containers:
+        if is_running(container):
+            continue
+        inspect = api_call(client.inspect_container, container=container['Id'])
+        if inspect:
+            inspected[container['Id']] = inspect
+    # Containers removed while listing are left out
+    containers = [
+        container for container in containers
+        if is_running(container) or container['Id'] in inspected
+    ]
+    return build_inventory(
+        containers,
+        inspected,
+        get_all_images(client),
+        int(time.time() if now is None else now),
+    )
+
+
+def write_inventory(inventory, inventory_file):
+    numpy = import_numpy()
+    numpy.savez_compressed(inventory_file, **inventory)
+
+
+def load_inventory(inventory_file):
+    numpy = import_numpy()
+    with numpy.load(inventory_file, allow_pickle=False) as data:
+        inventory = dict(data)
+    if int(inventory['version']) != INVENTORY_VERSION:
+        raise ValueError("Unsupported inventory version: %s" % (
+            inventory['version']))
+    return inventory
+
+
+def any_per_object(numpy, matches, offsets, ids):
+    """Return for every object whether any of its interned values matches."""
+    counts = numpy.diff(offsets)
+    owners = numpy.repeat(numpy.arange(len(counts)), counts)
+    hits = numpy.bincount(
+        owners,
+        weights=matches[ids],
+        minlength=len(counts),
+    )
+    return hits > 0
+
+
+def match_labels(numpy, inventory, exclude_container_labels):
+    keys = inventory['label_keys']
+    values = inventory['label_values']
+    matches = numpy.zeros(len(keys), dtype=bool)
+    for exclude_label in exclude_container_labels:
+        key_matches = numpy.array(
+            [fnmatch.fnmatch(key, exclude_label.key) for key in keys],
+            dtype=bool,
+        )
+        if exclude_label.value:
+            key_matches &= numpy.array(
+                [fnmatch.fnmatch(value, exclude_label.value)
+                 for value in values],
+                dtype=bool,
+            )
+        matches |= key_matches
+    return matches
+
+
+def evaluate(
+    inventory,
+    max_container_age,
+    max_image_age,
+    exclude_container_labels=(),
+    exclude_images=(),
+    now=None,
+):
+    """Return boolean arrays of the containers and images dcgc would remove.
+
+    :param max_container_age: in seconds, or None to keep all containers
+    :param max_image_age: in seconds, or None to keep all images
+    :param exclude_container_labels: as returned by
+        :func:`docker_custodian.docker_gc.format_exclude_labels`
+    :param exclude_images: patterns of image tags to keep
+    :param now: in seconds since the epoch, defaults to the time of the
+        export
+    """
+    numpy = import_numpy()
+    if now is None:
+        now = int(inventory['exported'])
+
+    container_count = len(inventory['container_id'])
+    remove_containers = numpy.zeros(container_count, dtype=bool)
+    if max_container_age is not None:
+        finished = inventory['container_finished']
+        # Containers which never started are aged from their creation
+        since = numpy.where(
+            finished < 0, inventory['container_created'], finished)
+        remove_containers = (
+            ~inventory['container_running'] &
+            (inventory['container_ghost'] | (since < now - max_container_age))
+        )
+        if exclude_container_labels:
+            remove_containers &= ~any_per_object(
+                numpy,
+                match_labels(numpy, inventory, exclude_container_labels),
+                inventory['container_label_offsets'],
+                inventory['container_label_ids'],
+            )
+
+    image_count = len(inventory['image_id'])
+    if max_image_age is None:
+        return remove_containers, numpy.zeros(image_count, dtype=bool)
+
+    # Images are removed after containers, so only kept containers use them
+    used = inventory['container_image'][~remove_containers]
+    in_use = numpy.zeros(image_count, dtype=bool)
+    in_use[used[used >= 0]] = True
+
+    remove_images = ~in_use & (
+        inventory['image_created'] < now - max_image_age)
+    if exclude_images:
+        tag_matches = numpy.array(
+            [
+                any(fnmatch.fnmatch(tag, pattern) for pattern in exclude_images)
+                for tag in inventory['tags']
+            ],
+            dtype=bool,
+        )
+        remove_images &= ~any_per_object(
+            numpy,
+            tag_matches,
+            inventory['image_tag_offsets'],
+            inventory['image_tag_ids'],
+        )
+    return remove_containers, remove_images
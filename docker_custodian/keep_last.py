@@ -0,0 +1,169 @@
+# -*- coding: utf8 -*-
+"""
+Keep the newest images of every repository by count instead of by age.
+
+With ``--keep-last N`` the tags of each repository are ranked by the created
+date of their image, and only the tags of the newest ``N`` images of the
+repository are kept, however old they are. Tags of older images are removed,
+however new they are. ``--keep-last REPO=N`` gives the repositories matching
+the ``REPO`` pattern their own count, the first matching pattern wins::
+
+    dcgc --keep-last 5 --keep-last 'user/ci-*=20' --keep-last 'user/base=0'
+
+Images which are in use or excluded are never removed, but they still count
+towards the newest ``N`` of their repositories. An image with tags in several
+repositories is only untagged from the repositories where it is too old, and
+removed once none of its tags are kept.
+"""
+import collections
+import fnmatch
+import logging
+
+from docker_custodian.docker_gc import delete_image_with_error
+from docker_custodian.docker_gc import find_unused_images
+from docker_custodian.docker_gc import get_all_images
+from docker_custodian.docker_gc import no_image_tags
+from docker_custodian.docker_gc import report
+from docker_custodian.log_output import object_extra
+
+
+log = logging.getLogger(__name__)
+
+
+KeepLast = collections.namedtuple('KeepLast', ['count', 'overrides'])
+
+
+def build_keep_last(values):
+    """Return the :class:`KeepLast` of the values of ``--keep-last``, which
+    are ``(pattern, count)`` tuples with a pattern of None for the default
+    count.
+    """
+    count = None
+    overrides = []
+    for pattern, value in values:
+        if pattern is None:
+            count = value
+        else:
+            overrides.append((pattern, value))
+    return KeepLast(count, tuple(overrides))
+
+
+def repository_count(keep_last, repository):
+    """Return the number of images to keep in repository, or None if the
+    repository is not kept by count.
+    """
+    for pattern, count in keep_last.overrides:
+        if fnmatch.fnmatch(repository, pattern):
+            return count
+    return keep_last.count
+
+
+def get_repository(image_tag):
+    """Return the repository of a tag, ``host:5000/user/app:1`` is in the
+    ``host:5000/user/app`` repository.
+    """
+    repository, separator, tag = image_tag.rpartition(':')
+    if not separator or '/' in tag:
+        return image_tag
+    return repository
+
+
+def build_tag_index(images):
+    """Return a dict of repository to the ids of its images, newest first."""
+    created = collections.defaultdict(dict)
+    for image in images:
+        image_tags = image.get('RepoTags')
+        if no_image_tags(image_tags):
+            continue
+        for image_tag in image_tags:
+            created[get_repository(image_tag)][image['Id']] = image.get(
+                'Created', 0)
+
+    return {
+        repository: sorted(
+            image_created,
+            key=lambda image_id: (-image_created[image_id], image_id),
+        )
+        for repository, image_created in created.items()
+    }
+
+
+def find_tags_to_remove(keep_last, images):
+    """Return the set of tags of images which are older than the newest
+    images of their repository. Repositories which are not kept by count are
+    left out.
+    """
+    image_tags = {
+        image['Id']: image['RepoTags'] for image in images
+        if not no_image_tags(image.get('RepoTags'))
+    }
+    tags_to_remove = set()
+    for repository, image_ids in build_tag_index(images).items():
+        count = repository_count(keep_last, repository)
+        if count is None:
+            continue
+        for image_id in image_ids[count:]:
+            tags_to_remove.update(
+                image_tag for image_tag in image_tags[image_id]
+                if get_repository(image_tag) == repository
+            )
+    return tags_to_remove
+
+
+def exclude_patterns(keep_last):
+    """Return the patterns of the tags kept by count, which are kept by the
+    removal by age. The other tags of their images are still removed by age.
+    """
+    if keep_last.count is not None:
+        return {'*'}
+    return {pattern + ':*' for pattern, _ in keep_last.overrides}
+
+
+def cleanup_images_by_count(
+    client,
+    keep_last,
+    dry_run,
+    exclude_set,
+    containers=None,
+    sink=None,
+    skip=None,
+):
+    """Remove the tags of unused images which are older than the newest
+    images of their repository. sink is called with a
+    :class:`docker_custodian.docker_gc.Result` for every image.
+    """
+    images = get_all_images(client)
+    tags_to_remove = find_tags_to_remove(keep_last, images)
+    log.info("Found %s tags beyond the newest images of their repository" % (
+        len(tags_to_remove)))
+    if not tags_to_remove:
+        return
+
+    for image_summary in find_unused_images(
+        client,
+        exclude_set,
+        containers=containers,
+        images=images,
+        skip=skip,
+    ):
+        image_tags = image_summary.get('RepoTags')
+        if no_image_tags(image_tags):
+            continue
+        removed_tags = [tag for tag in image_tags if tag in tags_to_remove]
+        if not removed_tags:
+            continue
+        keep_tags = [tag for tag in image_tags if tag not in tags_to_remove]
+
+        name = ', '.join(removed_tags)
+        log.info(
+            "Removing image %s %s",
+            image_summary['Id'][:16],
+            name,
+            extra=object_extra('image', 'remove', image_summary['Id']),
+        )
+        if dry_run:
+            report(sink, 'image', 'remove', image_summary['Id'], name, True)
+            continue
+        error = delete_image_with_error(client, image_summary, keep_tags)
+        report(sink, 'image', 'remove', image_summary['Id'], name, False,
+               error)
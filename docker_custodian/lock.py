@@ -0,0 +1,91 @@
+# -*- coding: utf8 -*-
+"""
+Keep runs from overlapping.
+
+The lock is an ``flock`` on a lock file, so it is released by the kernel when
+the owner exits, even if it is killed. The owner writes its pid, host and
+start time to the file, and clears it when it finishes. A lock file which is
+not locked but still names an owner was left by a run which did not finish.
+"""
+import contextlib
+import datetime
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+
+
+log = logging.getLogger(__name__)
+
+
+def read_owner(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    content = os.read(fd, 4096)
+    if not content:
+        return None
+    try:
+        return json.loads(content.decode('utf-8'))
+    except ValueError:
+        return {}
+
+
+def write_owner(fd, owner):
+    os.ftruncate(fd, 0)
+    if owner is not None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, json.dumps(owner).encode('utf-8'))
+
+
+def format_owner(owner):
+    if not owner:
+        return "unknown owner"
+    return "pid %s on %s, started %s" % (
+        owner.get('pid'),
+        owner.get('host'),
+        owner.get('started'))
+
+
+@contextlib.contextmanager
+def run_lock(path):
+    """Hold the lock at path while the block runs.
+
+    Yields True if the lock was acquired, and False if another run holds it,
+    in which case the block should return without doing anything. When path
+    is None no lock is taken.
+    """
+    if path is None:
+        yield True
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            log.info("Another run holds the lock %s (%s), exiting" % (
+                path, format_owner(read_owner(fd))))
+            yield False
+            return
+
+        stale_owner = read_owner(fd)
+        if stale_owner is not None:
+            log.info("Taking over the lock %s from a run which did not "
+                     "finish (%s)" % (path, format_owner(stale_owner)))
+        write_owner(fd, {
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'started': datetime.datetime.now(
+                datetime.timezone.utc).isoformat(),
+        })
+        try:
+            yield True
+        finally:
+            # The file is kept, removing it would race with a run which
+            # already opened it.
+            write_owner(fd, None)
+    finally:
+        os.close(fd)
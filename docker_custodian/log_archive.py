@@ -0,0 +1,143 @@
+# -*- coding: utf8 -*-
+"""
+Archive the logs of containers before they are removed.
+
+With ``--archive-logs DIR`` the logs of every container which is removed,
+or only of the containers with one of the ``--archive-label`` labels, are
+compressed to ``DIR/<name>-<id>.log.gz`` by a pool of background workers,
+and the container is removed once its archive is complete. Other containers
+are removed in the meantime. A container whose logs could not be archived is
+not removed.
+
+The ``json-file`` log of the container is copied when dcgc can read it, with
+the JSON lines and timestamps written by dockerd. Otherwise, and when the log
+was rotated by dockerd, the logs are streamed from the API with timestamps.
+"""
+import glob
+import gzip
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from docker_custodian.container_logs import CHUNK_SIZE
+from docker_custodian.container_logs import get_log_path
+from docker_custodian.docker_gc import should_exclude_container_with_labels
+from docker_custodian.log_output import object_extra
+
+
+log = logging.getLogger(__name__)
+
+
+def get_archive_path(archive_dir, container):
+    name = container.get('Name', '').lstrip('/') or 'container'
+    return os.path.join(
+        archive_dir, '%s-%s.log.gz' % (name, container['Id'][:16]))
+
+
+def can_copy_log_file(container):
+    """Return True if the json-file log of a container is readable, and has
+    not been rotated.
+    """
+    log_path = get_log_path(container)
+    if not log_path or not os.access(log_path, os.R_OK):
+        return False
+    return not glob.glob(glob.escape(log_path) + '.*')
+
+
+def stream_logs(client, container):
+    """Yield the logs of a container from the API, in chunks."""
+    return client.logs(
+        container=container['Id'],
+        stdout=True,
+        stderr=True,
+        stream=True,
+        timestamps=True,
+    )
+
+
+def archive_logs(client, container, archive_path):
+    """Compress the logs of a container to archive_path. The archive is only
+    moved into place once it is complete.
+    """
+    tmp_path = archive_path + '.tmp'
+    try:
+        with gzip.open(tmp_path, 'wb') as target:
+            if can_copy_log_file(container):
+                with open(get_log_path(container), 'rb') as source:
+                    shutil.copyfileobj(source, target, CHUNK_SIZE)
+            else:
+                for chunk in stream_logs(client, container):
+                    target.write(chunk)
+        os.rename(tmp_path, archive_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class LogArchiver(object):
+    """Archive the logs of containers on a pool of workers.
+
+    :param labels: as returned by
+        :func:`docker_custodian.docker_gc.format_exclude_labels`, only
+        containers with one of these labels are archived. All containers are
+        archived when it is empty.
+    """
+
+    def __init__(self, client, archive_dir, labels=(), workers=4):
+        self.client = client
+        self.archive_dir = archive_dir
+        self.labels = labels
+        self.workers = workers
+        self.executor = None
+        self.futures = []
+
+    def wants(self, container):
+        """Return True if the logs of an inspected container are archived."""
+        if not self.labels:
+            return True
+        labels = (container.get('Config') or {}).get('Labels')
+        return should_exclude_container_with_labels(
+            {'Labels': labels}, self.labels)
+
+    def submit(self, container, remove, failed):
+        """Archive the logs of a container, then call remove with it. failed
+        is called with the container and the error if archiving fails.
+        """
+        if self.executor is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.futures.append(self.executor.submit(
+            self.archive_and_remove, container, remove, failed))
+
+    def archive_and_remove(self, container, remove, failed):
+        archive_path = get_archive_path(self.archive_dir, container)
+        try:
+            archive_logs(self.client, container, archive_path)
+        except Exception as e:
+            log.warn("Failed to archive the logs of container %s to %s, not "
+                     "removing it: %s" % (container['Id'][:16], archive_path, e))
+            failed(container, e)
+            return
+        log.info(
+            "Archived the logs of container %s to %s",
+            container['Id'][:16],
+            archive_path,
+            extra=object_extra('container', 'archive', container['Id']),
+        )
+        remove(container)
+
+    def wait(self):
+        """Wait until every archive is done and its container removed, and
+        raise the first unexpected error.
+        """
+        if self.executor is None:
+            return
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.executor.shutdown()
+            self.executor = None
+            self.futures = []
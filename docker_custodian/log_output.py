@@ -0,0 +1,173 @@
+# -*- coding: utf8 -*-
+"""
+Log output for the command line tools.
+
+Records are handed to a background thread through a queue, and only formatted
+there, so that removing a large number of objects is not slowed down by
+writing to stdout. Output is plain text, or one JSON object per line with
+``--log-format json``.
+
+Lines logged for a single object (a container or image being removed, ...)
+carry an ``object`` field, see :func:`object_extra`. They are counted for the
+summary logged at the end of every phase, and can be sampled with
+``--log-sample`` so that only one in every N of them is written. Warnings are
+never sampled.
+"""
+import atexit
+import collections
+import datetime
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+
+TEXT = 'text'
+JSON = 'json'
+LOG_FORMATS = (TEXT, JSON)
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+def object_extra(kind, action, object_id, **fields):
+    """Return the ``extra`` of a log line about a single object."""
+    fields.update(kind=kind, action=action, id=object_id)
+    return {'object': fields}
+
+
+class LazyFormat(object):
+    """Call func only when the log line is formatted."""
+
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        event = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in ('object', 'summary'):
+            value = getattr(record, field, None)
+            if value is not None:
+                event[field] = value
+        if record.exc_info:
+            event['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(event, sort_keys=True, default=str)
+
+
+class ObjectCounter(logging.Filter):
+    """Count the object lines and warnings, and sample the object lines.
+
+    :param sample: write one in every sample object lines
+    """
+
+    def __init__(self, sample=1):
+        super(ObjectCounter, self).__init__()
+        self.sample = max(sample, 1)
+        self.counter = itertools.count()
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        obj = getattr(record, 'object', None)
+        with self.lock:
+            if record.levelno >= logging.WARNING:
+                self.counts['warnings'] += 1
+                return True
+            if obj is None:
+                return True
+            self.counts['%s %s' % (obj['action'], obj['kind'])] += 1
+        return next(self.counter) % self.sample == 0
+
+    def take(self):
+        """Return the counts since the last call, and reset them."""
+        with self.lock:
+            counts, self.counts = self.counts, collections.Counter()
+        return counts
+
+
+object_counter = ObjectCounter()
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """Enqueue records without formatting them, formatting is done by the
+    :class:`logging.handlers.QueueListener` thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def format_counts(counts):
+    if not counts:
+        return ''
+    return ' (%s)' % ', '.join(
+        '%s: %s' % (key, count) for key, count in sorted(counts.items())
+    )
+
+
+def configure_logging(args, stream=None):
+    """Configure the root logger for the options of
+    :func:`add_logging_arguments`.
+
+    Like :func:`logging.basicConfig` this does nothing if the root logger
+    already has handlers. Returns the background listener, which is stopped
+    at exit.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if args.log_format == JSON:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(message)s"))
+
+    object_counter.sample = max(args.log_sample, 1)
+    handler = BackgroundHandler(queue.Queue())
+    handler.addFilter(object_counter)
+    root.addHandler(handler)
+    root.setLevel(args.log_level)
+
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return listener
+
+
+def stop_listener(listener):
+    """Stop listener after writing all queued records, unless it was already
+    stopped.
+    """
+    if listener._thread is not None:
+        listener.stop()
+
+
+def add_logging_arguments(parser):
+    parser.add_argument(
+        '--log-format', choices=LOG_FORMATS, default=TEXT,
+        help="Write log lines as text, or as one JSON object per line.")
+    parser.add_argument(
+        '--log-level', choices=LOG_LEVELS, default='INFO',
+        help="Only write log lines of this level or above.")
+    parser.add_argument(
+        '--log-sample', type=int, default=1, metavar='N',
+        help="Only write one in every N lines about a single container, "
+             "image or volume. Every phase still logs a summary of all of "
+             "them.")
@@ -0,0 +1,533 @@
+# -*- coding: utf8 -*-
+"""
+Check that the faster decision paths of dcgc remove exactly what the
+reference logic would.
+
+The reference is the original per object logic: ``filter_excluded_containers``
+and ``should_remove_container`` for containers, then
+``filter_images_in_use_by_id``, ``filter_excluded_images`` and
+``is_image_old`` for the images which are not used by a container which is
+kept. Every other path is run over the same :class:`Snapshot` of a host:
+
+* ``phases``: the containers and images phases of a dcgc run
+* ``pipeline``: the same phases with ``--pipeline``
+* ``plan``: the plan written by ``--plan-out``
+* ``inventory``: :func:`docker_custodian.inventory.evaluate`, when numpy is
+  installed
+
+A snapshot is listed and inspected once. The paths which remove objects run
+against a :class:`SimulatedBackend` which removes them from a copy of the
+snapshot, so verifying makes no more API calls than a single run. Snapshots
+can be collected from a host, from a recorded trace with ``--replay``, or
+generated with :func:`synthetic_snapshot`.
+
+Only max ages and exclude options are verified, not policies.
+"""
+import collections
+import contextlib
+import datetime
+import logging
+import random
+import threading
+
+from docker_custodian.docker_gc import api_call
+from docker_custodian.docker_gc import filter_excluded_containers
+from docker_custodian.docker_gc import filter_excluded_images
+from docker_custodian.docker_gc import filter_images_in_use_by_id
+from docker_custodian.docker_gc import get_args
+from docker_custodian.docker_gc import is_image_old
+from docker_custodian.docker_gc import no_image_tags
+from docker_custodian.docker_gc import run_cleanups
+from docker_custodian.docker_gc import should_remove_container
+from docker_custodian.docker_gc import YEAR_ZERO
+
+
+log = logging.getLogger(__name__)
+
+
+Snapshot = collections.namedtuple(
+    'Snapshot',
+    [
+        'api_version',
+        'containers',
+        'inspected_containers',
+        'images',
+        'inspected_images',
+    ],
+)
+
+Decisions = collections.namedtuple('Decisions', ['containers', 'images'])
+
+Divergence = collections.namedtuple(
+    'Divergence',
+    ['path', 'kind', 'id', 'reference'],
+)
+
+# The number of divergences of a path which are logged one by one
+MAX_LOGGED = 20
+
+
+def collect_snapshot(client):
+    """List and inspect all containers and images of a host."""
+    log.info("Getting all containers and images")
+    containers = client.containers(all=True)
+    inspected_containers = {}
+    for container in containers:
+        inspect = api_call(client.inspect_container, container=container['Id'])
+        if inspect:
+            inspected_containers[container['Id']] = inspect
+    images = client.images()
+    inspected_images = {}
+    for image in images:
+        inspect = api_call(client.inspect_image, image=image['Id'])
+        if inspect:
+            inspected_images[image['Id']] = inspect
+    log.info("Found %s containers and %s images" % (
+        len(containers), len(images)))
+    return Snapshot(
+        client._version,
+        containers,
+        inspected_containers,
+        images,
+        inspected_images,
+    )
+
+
+class SimulatedBackend(object):
+    """A backend which serves a snapshot, and removes containers and images
+    from its own copy of it, like dockerd would.
+    """
+
+    def __init__(self, snapshot):
+        self._version = snapshot.api_version
+        self.snapshot = snapshot
+        self.container_summaries = collections.OrderedDict(
+            (container['Id'], container) for container in snapshot.containers)
+        self.image_users = collections.Counter(
+            container.get('ImageID') for container in snapshot.containers)
+        self.image_summaries = collections.OrderedDict(
+            (image['Id'], dict(image)) for image in snapshot.images)
+        self.tagged = {
+            tag: image['Id'] for image in snapshot.images
+            if not no_image_tags(image.get('RepoTags'))
+            for tag in image['RepoTags']
+        }
+        # The pipeline removes images on a worker thread
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def not_found(message):
+        import docker.errors
+        return docker.errors.NotFound(message)
+
+    @staticmethod
+    def conflict(message):
+        import docker.errors
+        import requests
+
+        response = requests.Response()
+        response.status_code = 409
+        return docker.errors.APIError(message, response=response)
+
+    def containers(self, all=False):
+        with self.lock:
+            return list(self.container_summaries.values())
+
+    def inspect_container(self, container):
+        with self.lock:
+            if container not in self.container_summaries:
+                raise self.not_found("No such container: %s" % container)
+            return self.snapshot.inspected_containers[container]
+
+    def remove_container(self, container, v=False):
+        with self.lock:
+            summary = self.container_summaries.pop(container, None)
+            if summary is None:
+                raise self.not_found("No such container: %s" % container)
+            self.image_users[summary.get('ImageID')] -= 1
+
+    def images(self):
+        with self.lock:
+            return [dict(image) for image in self.image_summaries.values()]
+
+    def inspect_image(self, image):
+        with self.lock:
+            if image not in self.image_summaries:
+                raise self.not_found("No such image: %s" % image)
+            return self.snapshot.inspected_images[image]
+
+    def remove_image(self, image, force=False):
+        with self.lock:
+            if image in self.image_summaries:
+                summary = self.image_summaries[image]
+                tags = summary.get('RepoTags')
+                if not force and not no_image_tags(tags) and len(tags) > 1:
+                    raise self.conflict(
+                        "Image %s is referenced in multiple repositories" %
+                        image)
+                self.delete(summary)
+                return
+
+            image_id = self.tagged.get(image)
+            if image_id not in self.image_summaries:
+                raise self.not_found("No such image: %s" % image)
+            summary = self.image_summaries[image_id]
+            if summary['RepoTags'] == [image]:
+                self.delete(summary)
+                return
+            summary['RepoTags'] = [
+                tag for tag in summary['RepoTags'] if tag != image]
+            del self.tagged[image]
+
+    def delete(self, summary):
+        if self.image_users[summary['Id']] > 0:
+            raise self.conflict("Image %s is used by a container" % (
+                summary['Id']))
+        del self.image_summaries[summary['Id']]
+
+    def volumes(self, filters=None):
+        return {'Volumes': []}
+
+
+def reference_decisions(
+    snapshot,
+    max_container_age,
+    max_image_age,
+    exclude_container_labels,
+    exclude_set,
+):
+    containers = set()
+    if max_container_age:
+        for summary in filter_excluded_containers(
+            snapshot.containers,
+            exclude_container_labels,
+        ):
+            inspect = snapshot.inspected_containers.get(summary['Id'])
+            if inspect and should_remove_container(inspect, max_container_age):
+                containers.add(summary['Id'])
+
+    images = set()
+    if max_image_age:
+        image_ids_in_use = {
+            container.get('ImageID') for container in snapshot.containers
+            if container['Id'] not in containers
+        }
+        for summary in filter_excluded_images(
+            filter_images_in_use_by_id(snapshot.images, image_ids_in_use),
+            exclude_set,
+        ):
+            inspect = snapshot.inspected_images.get(summary['Id'])
+            if inspect and is_image_old(inspect, max_image_age):
+                images.add(summary['Id'])
+    return Decisions(containers, images)
+
+
+def run_args(max_container_age, max_image_age, exclude_set, pipeline):
+    """Return the arguments of a dcgc run with only the containers and
+    images phases.
+    """
+    args = get_args(args=[])
+    args.max_container_age = max_container_age
+    args.max_image_age = max_image_age
+    args.exclude_image = sorted(exclude_set)
+    args.pipeline = pipeline
+    return args
+
+
+def removed_by_run(
+    snapshot,
+    max_container_age,
+    max_image_age,
+    exclude_container_labels,
+    exclude_set,
+    pipeline=False,
+):
+    decisions = Decisions(set(), set())
+
+    def sink(result):
+        if result.ok:
+            getattr(decisions, result.kind + 's').add(result.id)
+
+    run_cleanups(
+        SimulatedBackend(snapshot),
+        run_args(max_container_age, max_image_age, exclude_set, pipeline),
+        exclude_container_labels,
+        None,
+        sink=sink,
+    )
+    return decisions
+
+
+def phases_decisions(snapshot, *options):
+    return removed_by_run(snapshot, *options)
+
+
+def pipeline_decisions(snapshot, *options):
+    return removed_by_run(snapshot, *options, pipeline=True)
+
+
+def plan_decisions(
+    snapshot,
+    max_container_age,
+    max_image_age,
+    exclude_container_labels,
+    exclude_set,
+):
+    from docker_custodian.plan import build_plan
+
+    plan = build_plan(
+        SimulatedBackend(snapshot),
+        max_container_age,
+        max_image_age,
+        False,
+        exclude_container_labels,
+        exclude_set,
+    )
+    return Decisions(
+        {entry['id'] for entry in plan['containers']},
+        {entry['id'] for entry in plan['images']},
+    )
+
+
+def inventory_decisions(
+    snapshot,
+    max_container_age,
+    max_image_age,
+    exclude_container_labels,
+    exclude_set,
+):
+    from docker_custodian.inventory import build_inventory, evaluate
+    from docker_custodian.plan import is_running
+
+    now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+
+    def max_age(min_date):
+        if min_date is None:
+            return None
+        return now - int(min_date.timestamp())
+
+    containers = [
+        container for container in snapshot.containers
+        if is_running(container) or
+        container['Id'] in snapshot.inspected_containers
+    ]
+    inventory = build_inventory(
+        containers,
+        snapshot.inspected_containers,
+        [
+            image for image in snapshot.images
+            if image['Id'] in snapshot.inspected_images
+        ],
+        now,
+    )
+    remove_containers, remove_images = evaluate(
+        inventory,
+        max_age(max_container_age),
+        max_age(max_image_age),
+        exclude_container_labels,
+        exclude_set,
+        now=now,
+    )
+    return Decisions(
+        set(inventory['container_id'][remove_containers].tolist()),
+        set(inventory['image_id'][remove_images].tolist()),
+    )
+
+
+PATHS = (
+    ('phases', phases_decisions),
+    ('pipeline', pipeline_decisions),
+    ('plan', plan_decisions),
+    ('inventory', inventory_decisions),
+)
+
+
+def whole_seconds(date):
+    """Round a min date down to a whole second, which the inventory can
+    represent exactly.
+    """
+    if date is None:
+        return None
+    return datetime.datetime.fromtimestamp(
+        int(date.timestamp()), datetime.timezone.utc)
+
+
+def compare(path, reference, decisions):
+    """Return the divergences of the decisions of path from the reference."""
+    divergences = []
+    for kind in ('containers', 'images'):
+        expected = getattr(reference, kind)
+        actual = getattr(decisions, kind)
+        divergences.extend(
+            Divergence(path, kind[:-1], object_id, object_id in expected)
+            for object_id in sorted(expected ^ actual)
+        )
+    return divergences
+
+
+@contextlib.contextmanager
+def quiet_logs():
+    """Hide the info lines of the simulated runs."""
+    logger = logging.getLogger('docker_custodian')
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+def verify_snapshot(
+    snapshot,
+    max_container_age,
+    max_image_age,
+    exclude_container_labels=(),
+    exclude_set=(),
+    paths=PATHS,
+):
+    """Return the reference decisions, and a dict of path name to the
+    divergences of the path from the reference.
+    """
+    options = (
+        whole_seconds(max_container_age),
+        whole_seconds(max_image_age),
+        exclude_container_labels,
+        set(exclude_set),
+    )
+    reference = reference_decisions(snapshot, *options)
+    divergences = {}
+    for name, decide in paths:
+        try:
+            with quiet_logs():
+                decisions = decide(snapshot, *options)
+        except ValueError as e:
+            log.info("Not verifying the %s path: %s" % (name, e))
+            continue
+        divergences[name] = compare(name, reference, decisions)
+    return reference, divergences
+
+
+def verify(client, args, exclude_container_labels, exclude_set):
+    """Verify every path over a snapshot of the host of client, and log the
+    divergences. Returns the list of divergences.
+    """
+    if args.policy:
+        log.info("Policies are not verified, only --max-container-age and "
+                 "--max-image-age")
+    reference, divergences = verify_snapshot(
+        collect_snapshot(client),
+        args.max_container_age,
+        args.max_image_age,
+        exclude_container_labels,
+        exclude_set,
+    )
+    log.info("The reference removes %s containers and %s images" % (
+        len(reference.containers), len(reference.images)))
+
+    found = []
+    for name, path_divergences in sorted(divergences.items()):
+        if not path_divergences:
+            log.info("The %s path agrees with the reference" % name)
+            continue
+        log.warning("The %s path diverges from the reference on %s objects" % (
+            name, len(path_divergences)))
+        for divergence in path_divergences[:MAX_LOGGED]:
+            log.warning(
+                "%s: %s %s is %s by the reference, and %s by the %s path" % (
+                    name,
+                    divergence.kind,
+                    divergence.id[:16],
+                    'removed' if divergence.reference else 'kept',
+                    'kept' if divergence.reference else 'removed',
+                    name,
+                ),
+            )
+        found.extend(path_divergences)
+    return found
+
+
+def format_date(timestamp):
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def synthetic_snapshot(container_count, image_count, seed=0, now=None):
+    """Return a random snapshot of a host, with running, stopped,
+    never started and ghost containers, labels, tagged, multi-tagged and
+    untagged images, and dates within a minute of common max ages.
+    """
+    rand = random.Random(seed)
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    day = 24 * 3600
+
+    def object_id():
+        return '%064x' % rand.getrandbits(256)
+
+    def timestamp():
+        # Cluster dates around whole days, to catch rounding at the max age
+        return now - rand.randrange(0, 60) * day + rand.uniform(-60, 60)
+
+    images = []
+    inspected_images = {}
+    for i in range(image_count):
+        image_id = 'sha256:' + object_id()
+        kind = rand.random()
+        if kind < 0.2:
+            tags = ['<none>:<none>']
+        else:
+            repository = 'user/repo%d' % rand.randrange(20)
+            tags = ['%s:%d' % (repository, i)]
+            if kind > 0.9:
+                tags.append('%s:latest' % repository)
+        created = timestamp()
+        images.append({
+            'Id': image_id,
+            'RepoTags': tags,
+            'Created': int(created),
+            'Size': rand.randrange(1, 1 << 30),
+        })
+        inspected_images[image_id] = {
+            'Id': image_id,
+            'Created': format_date(created),
+        }
+
+    containers = []
+    inspected_containers = {}
+    for i in range(container_count):
+        container_id = object_id()
+        image_id = rand.choice(images)['Id'] if images else 'sha256:gone'
+        labels = {}
+        if rand.random() < 0.3:
+            labels['team'] = rand.choice(['web', 'batch', 'ci'])
+        if rand.random() < 0.05:
+            labels['keep'] = 'yes'
+        created = timestamp()
+        kind = rand.random()
+        state = {'Running': False, 'FinishedAt': YEAR_ZERO}
+        if kind < 0.2:
+            state = {'Running': True, 'FinishedAt': YEAR_ZERO}
+        elif kind < 0.3:
+            created = min(created, now - 60)
+        elif kind < 0.32:
+            state['Ghost'] = True
+        else:
+            state['FinishedAt'] = format_date(min(timestamp(), now))
+        containers.append({
+            'Id': container_id,
+            'Names': ['/container%d' % i],
+            'ImageID': image_id,
+            'Labels': labels,
+            'Created': int(created),
+            'State': 'running' if state['Running'] else 'exited',
+        })
+        inspected_containers[container_id] = {
+            'Id': container_id,
+            'Name': '/container%d' % i,
+            'Created': format_date(created),
+            'State': state,
+            'Config': {'Labels': labels},
+        }
+
+    return Snapshot(
+        '1.41', containers, inspected_containers, images, inspected_images)
@@ -0,0 +1,272 @@
+# -*- coding: utf8 -*-
+"""
+Find directories under the docker data root which dockerd no longer
+references.
+
+After a crash of dockerd, ``overlay2/<layer>`` and ``containers/<id>``
+directories can be left behind for layers and containers which dockerd has
+forgotten. They are never removed through the API. ``--scan-orphans``
+compares the names of these directories with the layers in the
+``GraphDriver`` data of every image and container, and with the ids of all
+containers, and reports the size of every directory which is not
+referenced. With ``--quarantine-orphans`` the orphans are moved to another
+directory, which should be on the same filesystem, instead of removed.
+
+Directories which changed in the last :data:`MIN_AGE_SECONDS` are left out,
+they may belong to a container or image created while scanning. Layers of
+the BuildKit build cache are not visible through the API, so overlay2 orphans
+are not quarantined while the host has build cache.
+
+Nothing is quarantined unless the data root is the ``DockerRootDir`` of
+dockerd and its storage driver is overlay2, as a data root of another
+daemon, or of another driver, has directories which this dockerd does not
+reference.
+"""
+import collections
+import errno
+import logging
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from docker_custodian.docker_gc import api_call
+from docker_custodian.docker_gc import format_size
+from docker_custodian.docker_gc import report
+from docker_custodian.log_output import object_extra
+
+
+log = logging.getLogger(__name__)
+
+
+OVERLAY2 = 'overlay2'
+
+CONTAINERS = 'containers'
+
+# The directory of the short layer names, which are links to the layers
+OVERLAY2_LINKS = 'l'
+
+MIN_AGE_SECONDS = 3600
+
+Orphan = collections.namedtuple('Orphan', ['kind', 'name', 'path'])
+
+
+def list_directories(path, before):
+    """Return a dict of the name to the path of every directory in path which
+    did not change after before.
+    """
+    directories = {}
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return directories
+    for entry in entries:
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.stat(follow_symlinks=False).st_mtime > before:
+                continue
+        except OSError:
+            continue
+        directories[entry.name] = entry.path
+    return directories
+
+
+def graph_driver_layers(data):
+    """Return the names of the overlay2 layer directories used by an image
+    or a container, from its inspect data.
+    """
+    graph_driver = data.get('GraphDriver') or {}
+    if graph_driver.get('Name') != OVERLAY2:
+        return set()
+    layers = set()
+    for value in (graph_driver.get('Data') or {}).values():
+        for path in value.split(':'):
+            # Paths are <data-root>/overlay2/<layer>/diff, ...
+            layer = os.path.basename(os.path.dirname(path.rstrip('/')))
+            if layer:
+                layers.add(layer)
+    return layers
+
+
+def find_referenced(client):
+    """Return the ids of all containers, the overlay2 layers of all images
+    and containers, and whether every one of them could be inspected.
+    """
+    container_ids = set()
+    layers = set()
+    complete = True
+    for container in client.containers(all=True):
+        container_ids.add(container['Id'])
+        inspect = api_call(client.inspect_container, container=container['Id'])
+        if inspect is None:
+            complete = False
+            continue
+        layers.update(graph_driver_layers(inspect))
+    # Intermediate images are listed too, their layers are shared
+    for image in client.images(all=True):
+        inspect = api_call(client.inspect_image, image=image['Id'])
+        if inspect is None:
+            complete = False
+            continue
+        layers.update(graph_driver_layers(inspect))
+    return container_ids, layers, complete
+
+
+def tree_size(path):
+    """Return the number of bytes used by the files under path, counting
+    hard links once. Symlinks are not followed.
+    """
+    total = 0
+    seen = set()
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if stat.S_ISDIR(entry_stat.st_mode):
+                stack.append(entry.path)
+                continue
+            if entry_stat.st_nlink > 1:
+                key = (entry_stat.st_dev, entry_stat.st_ino)
+                if key in seen:
+                    continue
+                seen.add(key)
+            total += entry_stat.st_size
+    return total
+
+
+def measure(orphans, workers):
+    """Return the size of every orphan, measured in parallel."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            tree_size, [orphan.path for orphan in orphans]))
+
+
+def find_orphans(data_root, container_ids, layers, before):
+    """Return the orphans under data_root, containers first."""
+    orphans = [
+        Orphan('container', name, path)
+        for name, path in sorted(list_directories(
+            os.path.join(data_root, CONTAINERS), before).items())
+        if name not in container_ids
+    ]
+    if layers is not None:
+        orphans.extend(
+            Orphan('layer', name, path)
+            for name, path in sorted(list_directories(
+                os.path.join(data_root, OVERLAY2), before).items())
+            if name != OVERLAY2_LINKS and name not in layers
+        )
+    return orphans
+
+
+def has_build_cache(client):
+    usage = api_call(client.df)
+    # Without an answer, assume the worst
+    return usage is None or bool(usage.get('BuildCache'))
+
+
+def is_daemon_data_root(client, data_root):
+    """Return True if data_root is the data root of dockerd, and dockerd
+    uses the overlay2 storage driver.
+    """
+    info = api_call(client.info)
+    if info is None:
+        log.warning("Not quarantining orphans, failed to get the docker info")
+        return False
+    root_dir = info.get('DockerRootDir')
+    if (
+        not root_dir or
+        os.path.realpath(root_dir) != os.path.realpath(data_root)
+    ):
+        log.warning("Not quarantining orphans, %s is not the data root of "
+                    "dockerd: %s" % (data_root, root_dir))
+        return False
+    if info.get('Driver') != OVERLAY2:
+        log.warning("Not quarantining orphans, dockerd uses the %s storage "
+                    "driver, not %s" % (info.get('Driver'), OVERLAY2))
+        return False
+    return True
+
+
+def quarantine(orphan, quarantine_dir):
+    """Move an orphan to quarantine_dir, returns the error or None."""
+    target_dir = os.path.join(quarantine_dir, orphan.kind)
+    try:
+        os.makedirs(target_dir, exist_ok=True)
+        os.rename(orphan.path, os.path.join(target_dir, orphan.name))
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            log.warn("Failed to quarantine %s: %s is on another filesystem" % (
+                orphan.path, quarantine_dir))
+        else:
+            log.warn("Failed to quarantine %s: %s" % (orphan.path, e))
+        return e
+    return None
+
+
+def scan_orphans(
+    client,
+    data_root,
+    quarantine_dir=None,
+    dry_run=False,
+    workers=8,
+    now=None,
+    sink=None,
+):
+    """Report, and move to quarantine_dir, the directories under data_root
+    which are not referenced by dockerd. Returns the list of orphans.
+    """
+    before = (time.time() if now is None else now) - MIN_AGE_SECONDS
+    log.info("Listing the containers and layers known to dockerd")
+    container_ids, layers, complete = find_referenced(client)
+    if not complete:
+        log.warning("Some images or containers could not be inspected, not "
+                    "looking for orphaned layers")
+        layers = None
+
+    orphans = find_orphans(data_root, container_ids, layers, before)
+    sizes = measure(orphans, workers)
+    for orphan, size in zip(orphans, sizes):
+        log.info(
+            "Orphaned %s directory %s: %s",
+            orphan.kind,
+            orphan.path,
+            format_size(size),
+            extra=object_extra(orphan.kind, 'orphan', orphan.name, size=size),
+        )
+    log.info("Found %s orphaned directories using %s" % (
+        len(orphans), format_size(sum(sizes))))
+
+    if quarantine_dir is None or not orphans:
+        return orphans
+    if not is_daemon_data_root(client, data_root):
+        return orphans
+
+    skip_layers = has_build_cache(client)
+    if skip_layers:
+        log.warning("Not quarantining orphaned layers, the build cache may "
+                    "use them. Prune the build cache first.")
+    for orphan in orphans:
+        if orphan.kind == 'layer' and skip_layers:
+            continue
+        log.info(
+            "Quarantining %s directory %s",
+            orphan.kind,
+            orphan.path,
+            extra=object_extra(orphan.kind, 'quarantine', orphan.name),
+        )
+        if dry_run:
+            report(sink, orphan.kind, 'quarantine', orphan.name, orphan.path,
+                   True)
+            continue
+        report(sink, orphan.kind, 'quarantine', orphan.name, orphan.path,
+               False, quarantine(orphan, quarantine_dir))
+    return orphans
@@ -0,0 +1,182 @@
+# -*- coding: utf8 -*-
+"""
+Remove images while containers are still being removed.
+
+Without ``--pipeline`` images are only listed and removed once every old
+container is gone. With it, containers and images are listed once, and the
+number of containers using every image is counted from the container
+listing. Images which are not used by any container are queued for removal
+right away, and every other image is queued as soon as the last container
+using it is removed. Queued images are inspected and removed by a background
+worker while containers, and then dangling volumes, are removed.
+
+Anonymous volumes are removed with their container, as they are without
+``--pipeline``.
+"""
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from docker_custodian.docker_gc import build_exclude_set
+from docker_custodian.docker_gc import cleanup_build_cache_phase
+from docker_custodian.docker_gc import cleanup_containers
+from docker_custodian.docker_gc import cleanup_networks_phase
+from docker_custodian.docker_gc import cleanup_volumes
+from docker_custodian.docker_gc import filter_excluded_images
+from docker_custodian.docker_gc import get_all_containers
+from docker_custodian.docker_gc import get_all_images
+from docker_custodian.docker_gc import log_duration
+from docker_custodian.docker_gc import remove_image
+
+
+def can_pipeline(client, args, policy):
+    """Return True if both containers and images are removed, in a way the
+    pipeline supports.
+    """
+    from docker.utils import compare_version
+
+    return bool(
+        (args.max_container_age or (policy and policy.container_rules)) and
+        (args.max_image_age or (policy and policy.image_rules)) and
+        not args.keep_last and
+        not args.report_reclaimable and
+        # ImageID was added to the container listing in 1.21
+        compare_version('1.21', client._version) >= 0
+    )
+
+
+class ImageQueue(object):
+    """Queue images for removal once no container uses them.
+
+    :param images: the image summaries which can be removed once they are
+        not used, in the order they should be removed
+    :param containers: the listing of all containers
+    :param remove: called with each image summary on the worker
+    """
+
+    def __init__(self, executor, images, containers, remove):
+        self.executor = executor
+        self.candidates = collections.OrderedDict(
+            (image['Id'], image) for image in images)
+        self.image_ids = {
+            container['Id']: container.get('ImageID')
+            for container in containers
+        }
+        self.users = collections.Counter(self.image_ids.values())
+        self.remove = remove
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Queue the images which are not used by any container."""
+        with self.lock:
+            unused = [
+                image_id for image_id in self.candidates
+                if not self.users[image_id]
+            ]
+        for image_id in unused:
+            self.queue(image_id)
+
+    def container_removed(self, container_id):
+        image_id = self.image_ids.get(container_id)
+        with self.lock:
+            self.users[image_id] -= 1
+            unused = self.users[image_id] <= 0
+        if unused:
+            self.queue(image_id)
+
+    def queue(self, image_id):
+        with self.lock:
+            image_summary = self.candidates.pop(image_id, None)
+        if image_summary is not None:
+            self.futures.append(
+                self.executor.submit(self.remove, image_summary))
+
+    def wait(self):
+        """Wait for every queued image, and raise the first error."""
+        for future in self.futures:
+            future.result()
+
+
+def run_pipelined(
+    client,
+    args,
+    exclude_container_labels,
+    policy,
+    log_limit=None,
+    containers=None,
+    sink=None,
+    skip=None,
+    archive=None,
+):
+    """Remove containers, images, build cache and volumes, removing images
+    as soon as no container uses them.
+    """
+    if containers is None:
+        containers = get_all_containers(client)
+    images = get_all_images(client)
+    exclude_set = build_exclude_set(args.exclude_image, args.exclude_image_file)
+    candidates = list(reversed(list(
+        filter_excluded_images(images, exclude_set))))
+
+    # The sink and skip of a failure ledger share its state
+    lock = threading.Lock()
+
+    def locked_sink(result):
+        if sink is not None:
+            with lock:
+                sink(result)
+
+    def locked_skip(kind, object_id):
+        if skip is None:
+            return False
+        with lock:
+            return skip(kind, object_id)
+
+    def remove(image_summary):
+        if locked_skip('image', image_summary['Id']):
+            return
+        min_date = args.max_image_age
+        if policy is not None:
+            min_date = policy.image_min_date(image_summary)
+            if min_date is None:
+                return
+        remove_image(
+            client, image_summary, min_date, args.dry_run, sink=locked_sink)
+
+    with log_duration('containers, images and volumes'):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            image_queue = ImageQueue(executor, candidates, containers, remove)
+            image_queue.start()
+
+            def container_sink(result):
+                locked_sink(result)
+                # A dry run frees the image as the removal would
+                if result.kind == 'container' and result.ok:
+                    image_queue.container_removed(result.id)
+
+            removed = cleanup_containers(
+                client,
+                args.max_container_age,
+                args.dry_run,
+                exclude_container_labels,
+                containers=containers,
+                log_limit=log_limit,
+                policy=policy,
+                sink=container_sink,
+                skip=locked_skip,
+                archive=archive,
+            )
+            containers[:] = [
+                container for container in containers
+                if container['Id'] not in removed
+            ]
+            # Images are still being removed by the worker
+            if args.dangling_volumes:
+                cleanup_volumes(
+                    client, args.dry_run, sink=locked_sink, skip=locked_skip)
+            image_queue.wait()
+
+    cleanup_build_cache_phase(client, args)
+    cleanup_networks_phase(
+        client, args, containers=containers, sink=sink, skip=skip)
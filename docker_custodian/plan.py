@@ -0,0 +1,352 @@
+# -*- coding: utf8 -*-
+"""
+Compute the set of objects dcgc would remove without removing anything, and
+apply a previously computed plan.
+
+A plan is a JSON document which can be reviewed before it is applied. When a
+plan is applied every object is re-validated against a single listing of the
+current containers, images and volumes instead of being inspected again.
+"""
+import datetime
+import json
+import logging
+import time
+
+from docker_custodian.args import parse_date
+from docker_custodian.docker_gc import api_call_ok
+from docker_custodian.docker_gc import delete_image
+from docker_custodian.docker_gc import filter_excluded_images
+from docker_custodian.docker_gc import filter_images_not_in_use
+from docker_custodian.docker_gc import find_containers_to_remove
+from docker_custodian.docker_gc import find_old_images
+from docker_custodian.docker_gc import find_unused_images
+from docker_custodian.docker_gc import format_image
+from docker_custodian.docker_gc import get_all_containers
+from docker_custodian.docker_gc import get_all_images
+from docker_custodian.docker_gc import get_dangling_volumes
+from docker_custodian.docker_gc import YEAR_ZERO
+from docker_custodian.log_output import LazyFormat
+from docker_custodian.log_output import object_extra
+
+
+log = logging.getLogger(__name__)
+
+
+PLAN_VERSION = 1
+
+
+def build_plan(
+    client,
+    max_container_age,
+    max_image_age,
+    dangling_volumes,
+    exclude_container_labels,
+    exclude_set,
+    deadline=None,
+    policy=None,
+):
+    """Return a plan of the containers, images and volumes to remove.
+
+    When a :class:`docker_custodian.deadline.Deadline` is given, planning
+    stops early once its planning budget is spent. A
+    :class:`docker_custodian.policy.Policy` replaces the max ages.
+    """
+    def out_of_time():
+        return deadline is not None and deadline.planning_expired()
+
+    plan = {
+        'version': PLAN_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'max_container_age': format_date(max_container_age),
+        'max_image_age': format_date(max_image_age),
+        'exclude_images': sorted(exclude_set),
+        'containers': [],
+        'images': [],
+        'volumes': [],
+    }
+
+    if max_container_age or (policy and policy.container_rules):
+        for container in find_containers_to_remove(
+            client,
+            max_container_age,
+            exclude_container_labels,
+            policy=policy,
+            stop=out_of_time,
+        ):
+            reason, timestamp = container_removal_reason(container)
+            log.info(
+                "Planning removal of container %s %s %s",
+                container['Id'][:16],
+                container.get('Name', '').lstrip('/'),
+                reason,
+                extra=object_extra('container', 'plan', container['Id']),
+            )
+            plan['containers'].append({
+                'id': container['Id'],
+                'name': container.get('Name', '').lstrip('/'),
+                'reason': reason,
+                'timestamp': timestamp,
+            })
+        if out_of_time():
+            log.info("Stopped planning containers, out of time")
+
+    if max_image_age or (policy and policy.image_rules):
+        # Containers in the plan will be gone by the time images are removed
+        planned_ids = {entry['id'] for entry in plan['containers']}
+        containers = [
+            container for container in get_all_containers(client)
+            if container['Id'] not in planned_ids
+        ]
+        for image, image_summary in find_old_images(
+            client,
+            find_unused_images(client, exclude_set, containers=containers),
+            max_image_age,
+            policy=policy,
+            stop=out_of_time,
+        ):
+            log.info(
+                "Planning removal of image %s",
+                LazyFormat(format_image, image, image_summary),
+                extra=object_extra('image', 'plan', image_summary['Id']),
+            )
+            plan['images'].append({
+                'id': image_summary['Id'],
+                'tags': image_summary.get('RepoTags') or [],
+                'reason': 'unused',
+                'timestamp': image['Created'],
+            })
+        if out_of_time():
+            log.info("Stopped planning images, out of time")
+
+    if dangling_volumes:
+        for volume in reversed(get_dangling_volumes(client)):
+            log.info(
+                "Planning removal of volume %s",
+                volume['Name'],
+                extra=object_extra('volume', 'plan', volume['Name']),
+            )
+            plan['volumes'].append({
+                'name': volume['Name'],
+                'reason': 'dangling',
+            })
+
+    return plan
+
+
+def container_removal_reason(container):
+    """Return the reason a container is removed, and the timestamp which
+    was compared against the max age.
+    """
+    state = container.get('State', {})
+    if state.get('Ghost'):
+        return 'ghost', None
+    if state.get('FinishedAt') == YEAR_ZERO:
+        return 'never-started', container['Created']
+    return 'finished', state['FinishedAt']
+
+
+def format_date(date):
+    if date is None:
+        return None
+    return date.isoformat()
+
+
+def write_plan(plan, plan_file):
+    json.dump(plan, plan_file, indent=2, sort_keys=True)
+    plan_file.write('\n')
+
+
+def read_plan(plan_file):
+    plan = json.load(plan_file)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError("Unsupported plan version: %s" % plan.get('version'))
+    return plan
+
+
+def apply_plan(client, plan, dry_run, on_removed=None):
+    """Remove the planned objects which are still removable.
+
+    :param on_removed: called with the kind and the id (or name, for volumes)
+        of every object which was removed
+    """
+    def removed(kind, key, ok):
+        if ok and on_removed is not None:
+            on_removed(kind, key)
+
+    if plan['containers']:
+        for entry, _ in removable_containers(
+            client,
+            plan['containers'],
+            since=plan.get('created'),
+        ):
+            removed('container', entry['id'], remove_planned_container(
+                client, entry, dry_run))
+    if plan['images']:
+        for entry, image_summary in removable_images(
+            client,
+            plan['images'],
+            plan['exclude_images'],
+        ):
+            removed('image', entry['id'], remove_planned_image(
+                client, image_summary, dry_run))
+    if plan['volumes']:
+        for entry in removable_volumes(client, plan['volumes']):
+            removed('volume', entry['name'], remove_planned_volume(
+                client, entry, dry_run))
+
+
+def removable_containers(client, entries, containers=None, since=None):
+    """Return (entry, container_summary) for the planned containers which
+    still exist and are not running.
+
+    :param since: when the plan was created. Containers started since then
+        are skipped, they were not old when they last finished.
+    """
+    if containers is None:
+        containers = get_all_containers(client)
+    current = {container['Id']: container for container in containers}
+    started = set()
+    if since is not None and entries:
+        started = containers_started_since(client, since)
+
+    removable = []
+    for entry in entries:
+        container_summary = current.get(entry['id'])
+        if not container_summary:
+            skip_container(entry, 'no longer exists')
+            continue
+        if is_running(container_summary):
+            skip_container(entry, 'running')
+            continue
+        if started is None:
+            skip_container(
+                entry, 'may have been started since the plan was created')
+            continue
+        if entry['id'] in started:
+            skip_container(entry, 'started since the plan was created')
+            continue
+        removable.append((entry, container_summary))
+    return removable
+
+
+def skip_container(entry, reason):
+    log.info(
+        "Skipping container %s %s: %s",
+        entry['id'][:16],
+        entry['name'],
+        reason,
+        extra=object_extra('container', 'skip', entry['id']),
+    )
+
+
+def containers_started_since(client, since):
+    """Return the ids of the containers started since the date since, an ISO
+    8601 string, or None if the events of dockerd could not be read.
+    """
+    import docker.errors
+    import requests.exceptions
+
+    try:
+        events = client.events(
+            since=int(parse_date(since).timestamp()),
+            until=int(time.time()),
+            filters={'type': 'container', 'event': ['start']},
+            decode=True,
+        )
+        return {
+            event.get('id') or (event.get('Actor') or {}).get('ID')
+            for event in events
+        }
+    except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+        log.warning("Failed to read the container events since the plan was "
+                    "created: %s" % e)
+        return None
+
+
+def remove_planned_container(client, entry, dry_run):
+    log.info(
+        "Removing container %s %s %s",
+        entry['id'][:16],
+        entry['name'],
+        entry['timestamp'],
+        extra=object_extra('container', 'remove', entry['id']),
+    )
+    if dry_run:
+        return True
+    return api_call_ok(
+        client.remove_container,
+        container=entry['id'],
+        v=True,
+    )
+
+
+def is_running(container_summary):
+    # State was added to the container list in API 1.23
+    state = container_summary.get('State')
+    if state is not None:
+        return state in ('running', 'restarting', 'paused')
+    return container_summary.get('Status', '').startswith('Up')
+
+
+def removable_images(client, entries, exclude_images, containers=None):
+    """Return (entry, image_summary) for the planned images which still
+    exist, are not used by one of containers and are not excluded.
+    """
+    if containers is None:
+        containers = get_all_containers(client)
+    images = get_all_images(client)
+    images = filter_images_not_in_use(client, images, containers)
+    images = filter_excluded_images(images, set(exclude_images))
+    current = {image_summary['Id']: image_summary for image_summary in images}
+
+    removable = []
+    for entry in entries:
+        image_summary = current.get(entry['id'])
+        if not image_summary:
+            log.info(
+                "Skipping image %s: missing, in use or excluded",
+                entry['id'][:16],
+                extra=object_extra('image', 'skip', entry['id']),
+            )
+            continue
+        removable.append((entry, image_summary))
+    return removable
+
+
+def remove_planned_image(client, image_summary, dry_run):
+    log.info(
+        "Removing image %s",
+        LazyFormat(format_image, image_summary, image_summary),
+        extra=object_extra('image', 'remove', image_summary['Id']),
+    )
+    if dry_run:
+        return True
+    return delete_image(client, image_summary)
+
+
+def removable_volumes(client, entries):
+    """Return the planned volume entries which are still dangling."""
+    dangling = {volume['Name'] for volume in get_dangling_volumes(client)}
+
+    removable = []
+    for entry in entries:
+        if entry['name'] not in dangling:
+            log.info(
+                "Skipping volume %s: no longer dangling",
+                entry['name'],
+                extra=object_extra('volume', 'skip', entry['name']),
+            )
+            continue
+        removable.append(entry)
+    return removable
+
+
+def remove_planned_volume(client, entry, dry_run):
+    log.info(
+        "Removing volume %s",
+        entry['name'],
+        extra=object_extra('volume', 'remove', entry['name']),
+    )
+    if dry_run:
+        return True
+    return api_call_ok(client.remove_volume, name=entry['name'])
@@ -0,0 +1,197 @@
+# -*- coding: utf8 -*-
+"""
+Retention policies which give different containers and images different
+maximum ages, evaluated in a single dcgc run.
+
+A policy file is JSON, or YAML when PyYAML is installed, with an ordered list
+of rules for containers and for images. The first rule which matches an
+object decides what happens to it::
+
+    {
+      "containers": [
+        {"labels": ["com.example.keep"], "action": "keep"},
+        {"labels": ["com.docker.compose.project=ci-*"], "max_age": "2h"},
+        {"images": ["user/service:*"], "max_age": "3days"},
+        {"max_age": "7days"}
+      ],
+      "images": [
+        {"tags": ["user/base:*"], "action": "keep"},
+        {"tags": ["ci/*"], "max_age": "2days"},
+        {"max_age": "30days"}
+      ]
+    }
+
+``labels`` use the same ``key`` or ``key=value`` patterns as
+``--exclude-container-label``, ``images`` match the image name of a
+container, and ``tags`` use the same patterns as ``--exclude-image``. A rule
+without a matcher matches everything. Objects which match no rule are kept.
+
+When a policy has no rules for containers, or none for images,
+``--max-container-age`` or ``--max-image-age`` is used for them instead.
+"""
+import collections
+import fnmatch
+import json
+import re
+
+from docker_custodian.args import datetime_seconds_ago
+from docker_custodian.args import seconds_type
+from docker_custodian.docker_gc import format_exclude_labels
+from docker_custodian.docker_gc import no_image_tags
+from docker_custodian.docker_gc import should_exclude_container_with_labels
+
+
+REMOVE = 'remove'
+KEEP = 'keep'
+
+Rule = collections.namedtuple(
+    'Rule',
+    ['labels', 'images', 'tags', 'min_date', 'action'],
+)
+
+
+class Policy(object):
+    """A compiled policy.
+
+    Rules are compiled once, and the decision for a combination of container
+    image and labels is cached, so evaluating a large inventory costs one
+    dict lookup for most objects.
+    """
+
+    def __init__(self, container_rules, image_rules):
+        self.container_rules = container_rules
+        self.image_rules = image_rules
+        self._container_decisions = {}
+
+    def container_min_date(self, container_summary):
+        """Return the date a container must have finished before to be
+        removed, or None if the container is kept.
+        """
+        labels = container_summary.get('Labels') or {}
+        key = (container_summary.get('Image'), frozenset(labels.items()))
+        if key not in self._container_decisions:
+            self._container_decisions[key] = self._first_container_rule(
+                container_summary)
+        return decide(self._container_decisions[key])
+
+    def _first_container_rule(self, container_summary):
+        for rule in self.container_rules:
+            if rule.labels and not should_exclude_container_with_labels(
+                container_summary,
+                rule.labels,
+            ):
+                continue
+            if rule.images and not rule.images.match(
+                container_summary.get('Image') or '',
+            ):
+                continue
+            return rule
+        return None
+
+    def image_min_date(self, image_summary):
+        """Return the date an image must have been created before to be
+        removed, or None if the image is kept.
+        """
+        image_tags = image_summary.get('RepoTags')
+        for rule in self.image_rules:
+            if rule.tags and (
+                no_image_tags(image_tags) or
+                not any(rule.tags.match(tag) for tag in image_tags)
+            ):
+                continue
+            return decide(rule)
+        return None
+
+
+def decide(rule):
+    if rule is None or rule.action == KEEP:
+        return None
+    return rule.min_date
+
+
+def compile_patterns(patterns):
+    """Compile a list of fnmatch patterns into a single regex."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(
+        '(?:%s)' % fnmatch.translate(pattern) for pattern in patterns
+    ))
+
+
+def compile_rule(raw_rule, allowed_matchers):
+    unknown = set(raw_rule) - set(allowed_matchers) - {'action', 'max_age'}
+    if unknown:
+        raise ValueError("Unknown policy rule keys: %s" % ', '.join(
+            sorted(unknown)))
+
+    action = raw_rule.get('action', REMOVE)
+    if action not in (REMOVE, KEEP):
+        raise ValueError("Unknown policy action: %s" % action)
+    if action == REMOVE and 'max_age' not in raw_rule:
+        raise ValueError("Policy rule without max_age: %s" % raw_rule)
+
+    min_date = None
+    if action == REMOVE:
+        min_date = datetime_seconds_ago(seconds_type(raw_rule['max_age']))
+
+    return Rule(
+        labels=format_exclude_labels(raw_rule.get('labels', [])),
+        images=compile_patterns(raw_rule.get('images')),
+        tags=compile_patterns(raw_rule.get('tags')),
+        min_date=min_date,
+        action=action,
+    )
+
+
+def default_rules(min_date):
+    """Return the rules used instead of an empty list of rules, a single rule
+    which removes everything older than min_date.
+    """
+    if min_date is None:
+        return []
+    return [Rule(
+        labels=[],
+        images=None,
+        tags=None,
+        min_date=min_date,
+        action=REMOVE,
+    )]
+
+
+def compile_policy(raw_policy, max_container_age=None, max_image_age=None):
+    """Compile a policy. max_container_age and max_image_age are the dates
+    used for containers or images when the policy has no rules for them.
+    """
+    unknown = set(raw_policy) - {'containers', 'images'}
+    if unknown:
+        raise ValueError("Unknown policy keys: %s" % ', '.join(sorted(unknown)))
+    return Policy(
+        [
+            compile_rule(rule, ('labels', 'images'))
+            for rule in raw_policy.get('containers') or []
+        ] or default_rules(max_container_age),
+        [
+            compile_rule(rule, ('tags',))
+            for rule in raw_policy.get('images') or []
+        ] or default_rules(max_image_age),
+    )
+
+
+def load_policy(policy_file, max_container_age=None, max_image_age=None):
+    """Load and compile a policy from an open JSON or YAML file, like
+    :func:`compile_policy`.
+    """
+    name = getattr(policy_file, 'name', '')
+    if name.endswith(('.yml', '.yaml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("PyYAML is required to read %s" % name)
+        raw_policy = yaml.safe_load(policy_file)
+    else:
+        raw_policy = json.load(policy_file)
+    return compile_policy(
+        raw_policy or {},
+        max_container_age=max_container_age,
+        max_image_age=max_image_age,
+    )
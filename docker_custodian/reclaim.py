@@ -0,0 +1,215 @@
+# -*- coding: utf8 -*-
+"""
+Estimate the disk space freed by removing a set of images.
+
+Images share layers, so the sum of image ``Size`` overstates what is freed.
+Layers are always shared as a common prefix of ``RootFS.Layers``, so the
+layers of all images form a tree. A layer is freed when every image below it
+in the tree is removed.
+
+The API only reports the cumulative size of an image (``Size``) and the size
+of its layers which are shared with any other image (``SharedSize``). Those
+give the cumulative size of every node in the tree which holds an image or
+where images branch off, which is enough to size every segment of layers
+between two such nodes.
+"""
+import logging
+
+from docker_custodian.docker_gc import api_call
+
+
+log = logging.getLogger(__name__)
+
+
+class _Node(object):
+
+    __slots__ = ('parent', 'children', 'images', 'size', 'total')
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.children = {}
+        self.images = []
+        # Cumulative size of the layers from the root to this node
+        self.size = None
+        # Number of images at or below this node
+        self.total = 0
+
+
+class LayerIndex(object):
+    """A reference count of images for each layer, used to compute the
+    unique bytes freed by removing a set of images.
+    """
+
+    def __init__(self):
+        self.root = _Node(None)
+        self.root.size = 0
+        self.nodes = {}
+        self.shared_sizes = {}
+        self.standalone = {}
+        self._finalized = False
+
+    def __len__(self):
+        return len(self.nodes) + len(self.standalone)
+
+    def add(self, image_id, layers, size, shared_size=-1):
+        """Add an image.
+
+        :param layers: the ``RootFS.Layers`` of the image, may be empty
+        :param size: the ``Size`` of the image
+        :param shared_size: the ``SharedSize`` of the image, ``-1`` when the
+            daemon did not compute it
+        """
+        self._finalized = False
+        if not layers:
+            self.standalone[image_id] = size
+            return
+
+        node = self.root
+        for layer in layers:
+            child = node.children.get(layer)
+            if child is None:
+                child = node.children[layer] = _Node(node)
+            node = child
+        node.images.append(image_id)
+        node.size = size
+        self.nodes[image_id] = node
+        self.shared_sizes[image_id] = shared_size
+
+    def reclaimable(self, image_ids):
+        """Return the number of bytes freed by removing all of image_ids."""
+        self._finalize()
+        freed = sum(self.standalone.get(image_id, 0) for image_id in image_ids)
+
+        removed = {}
+        for image_id in set(image_ids):
+            node = self.nodes.get(image_id)
+            while node is not None:
+                removed[node] = removed.get(node, 0) + 1
+                node = node.parent
+
+        for node, count in removed.items():
+            if node is self.root or count != node.total:
+                continue
+            if not self._is_boundary(node):
+                continue
+            parent = self._boundary_parent(node)
+            freed += max(node.size - parent.size, 0)
+        return freed
+
+    def _is_boundary(self, node):
+        return bool(node.images) or len(node.children) != 1
+
+    def _boundary_parent(self, node):
+        node = node.parent
+        while node is not self.root and not self._is_boundary(node):
+            node = node.parent
+        return node
+
+    def _finalize(self):
+        if self._finalized:
+            return
+
+        # Count the images below every node, deepest nodes first
+        order = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.total = 0
+            if not node.images and node is not self.root:
+                node.size = None
+            order.append(node)
+            stack.extend(node.children.values())
+        for node in reversed(order):
+            node.total += len(node.images)
+            if node.parent is not None:
+                node.parent.total += node.total
+
+        # The SharedSize of an image is the cumulative size of the deepest
+        # boundary on its path which is shared with another image.
+        branch_sizes = {}
+        for image_id, node in self.nodes.items():
+            shared_size = self.shared_sizes[image_id]
+            if shared_size < 0 or node.total > 1:
+                continue
+            branch = self._boundary_parent(node)
+            if branch is not self.root and branch.size is None:
+                branch_sizes[branch] = shared_size
+        for branch, size in branch_sizes.items():
+            branch.size = size
+
+        # Without a SharedSize, assume a branch is as large as its smallest
+        # descendant. This under-estimates what is freed.
+        for node in reversed(order):
+            if node.size is None and node is not self.root:
+                sizes = [
+                    child.size for child in node.children.values()
+                    if child.size is not None
+                ]
+                node.size = min(sizes) if sizes else 0
+
+        self._finalized = True
+
+
+def list_images_with_shared_size(client):
+    # APIClient.images() does not support shared-size
+    url = client._url('/images/json')
+    return client._result(client._get(url, params={'shared-size': 1}), True)
+
+
+def get_shared_sizes(client):
+    """Return a dict of image id to ``SharedSize``.
+
+    The image listing only computes ``SharedSize`` when asked to, from API
+    1.42. Older daemons compute it for ``/system/df``, which also sizes every
+    container and volume.
+    """
+    from docker.utils import compare_version
+
+    if compare_version('1.42', client._version) >= 0:
+        images = api_call(list_images_with_shared_size, client=client)
+    else:
+        images = (api_call(client.df) or {}).get('Images')
+    return {
+        image['Id']: image.get('SharedSize')
+        for image in images or []
+    }
+
+
+def build_layer_index(client, images, inspected):
+    """Build a :class:`LayerIndex` for all images on the host.
+
+    :param images: the image summaries of every image
+    :param inspected: a dict of image id to inspect data for the images which
+        were already inspected, the images being removed. Other images are
+        only inspected when they, and one of the inspected images, may share
+        layers with another image.
+    """
+    shared_sizes = get_shared_sizes(client)
+
+    def get_shared_size(image_summary):
+        shared_size = shared_sizes.get(image_summary['Id'])
+        if shared_size is None:
+            shared_size = image_summary.get('SharedSize')
+        return -1 if shared_size is None else shared_size
+
+    # When no removed image shares a layer, each frees its own size
+    may_share = any(
+        get_shared_size(image_summary) != 0
+        for image_summary in images
+        if image_summary['Id'] in inspected
+    )
+    index = LayerIndex()
+    for image_summary in images:
+        image_id = image_summary['Id']
+        shared_size = get_shared_size(image_summary)
+        image = inspected.get(image_id)
+        if image is None and may_share and shared_size != 0:
+            image = api_call(client.inspect_image, image=image_id)
+        layers = ((image or {}).get('RootFS') or {}).get('Layers') or []
+        index.add(
+            image_id,
+            layers,
+            image_summary.get('Size', 0),
+            shared_size,
+        )
+    return index
@@ -0,0 +1,107 @@
+# -*- coding: utf8 -*-
+"""
+Find containers which use more CPU or memory than a limit for a period of
+time, by sampling ``/containers/{id}/stats`` for all candidates concurrently.
+"""
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from docker_custodian.docker_gc import api_call
+
+
+log = logging.getLogger(__name__)
+
+
+ResourceLimits = collections.namedtuple(
+    'ResourceLimits',
+    ['max_cpu', 'max_memory'],
+)
+
+
+def cpu_percent(stats):
+    """Return the CPU usage in percent of one CPU, computed the same way as
+    ``docker stats``.
+    """
+    cpu_stats = stats.get('cpu_stats') or {}
+    precpu_stats = stats.get('precpu_stats') or {}
+    cpu_delta = (
+        cpu_stats.get('cpu_usage', {}).get('total_usage', 0) -
+        precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    )
+    system_delta = (
+        cpu_stats.get('system_cpu_usage', 0) -
+        precpu_stats.get('system_cpu_usage', 0)
+    )
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    online_cpus = cpu_stats.get('online_cpus') or len(
+        cpu_stats.get('cpu_usage', {}).get('percpu_usage') or [None])
+    return float(cpu_delta) / system_delta * online_cpus * 100
+
+
+def memory_usage(stats):
+    """Return the memory used in bytes, excluding the page cache."""
+    memory_stats = stats.get('memory_stats') or {}
+    usage = memory_stats.get('usage', 0)
+    details = memory_stats.get('stats') or {}
+    # cgroup v1 reports the page cache as cache, cgroup v2 as inactive_file
+    cache = details.get('total_inactive_file', details.get(
+        'inactive_file', details.get('cache', 0)))
+    return max(usage - cache, 0)
+
+
+def is_over_limits(stats, limits):
+    if limits.max_cpu is not None and cpu_percent(stats) > limits.max_cpu:
+        return True
+    if (
+        limits.max_memory is not None and
+        memory_usage(stats) > limits.max_memory
+    ):
+        return True
+    return False
+
+
+def sample_stats(client, container_ids, workers):
+    """Return a dict of container id to a single stats sample, fetched with
+    at most workers concurrent requests.
+    """
+    def sample(container_id):
+        return api_call(client.stats, container=container_id, stream=False)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        samples = executor.map(sample, container_ids)
+        return {
+            container_id: stats
+            for container_id, stats in zip(container_ids, samples)
+            if stats
+        }
+
+
+def find_containers_over_limits(
+    client,
+    container_ids,
+    limits,
+    window,
+    interval,
+    workers,
+    sleep=time.sleep,
+):
+    """Return the ids of the containers which were over the limits in every
+    sample taken over window seconds, sampling every interval seconds.
+    """
+    candidates = list(container_ids)
+    num_samples = 1 + int(window // interval) if interval else 1
+    for sample_num in range(num_samples):
+        if not candidates:
+            break
+        if sample_num:
+            sleep(interval)
+        samples = sample_stats(client, candidates, workers)
+        candidates = [
+            container_id for container_id in candidates
+            if container_id in samples and
+            is_over_limits(samples[container_id], limits)
+        ]
+    return candidates
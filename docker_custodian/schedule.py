@@ -0,0 +1,141 @@
+# -*- coding: utf8 -*-
+"""
+Run dcgc in a loop, spread over a fleet of hosts and out of the way of busy
+hosts.
+
+Runs are started on a grid of ``--schedule`` intervals, offset by a delay
+derived from the host name. Every host runs at the same time in each
+interval, but hosts don't run at the same time as each other, so they don't
+remove and then pull the same images from a registry all at once.
+
+Before a run starts, the run is deferred while the load average of the host
+or the time to ping dockerd is too high. A run which is deferred for a whole
+interval is skipped.
+
+When a run removes nothing, the interval to the next run is doubled, up to
+:data:`MAX_BACKOFF` times the schedule. It goes back to the schedule once a
+run removes something again.
+"""
+import hashlib
+import logging
+import os
+import socket
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+MAX_BACKOFF = 4
+
+# Time between checks of a busy host
+DEFER_SECONDS = 60
+
+
+def host_offset(host, interval):
+    """Return the offset of the runs of host, in seconds into every
+    interval.
+    """
+    digest = hashlib.sha256(host.encode('utf-8')).hexdigest()
+    return int(digest, 16) % int(interval)
+
+
+def align(when, interval, offset):
+    """Return the first time at or after when which is offset seconds into an
+    interval.
+    """
+    return when + (offset - when) % interval
+
+
+def load_per_cpu():
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+class Scheduler(object):
+
+    def __init__(
+        self,
+        client,
+        interval,
+        max_load=None,
+        max_ping=None,
+        host=None,
+        clock=time.time,
+        sleep=time.sleep,
+        get_load=load_per_cpu,
+    ):
+        self.client = client
+        self.interval = interval
+        self.max_load = max_load
+        self.max_ping = max_ping
+        self.offset = host_offset(host or socket.gethostname(), interval)
+        self.clock = clock
+        self.sleep = sleep
+        self.get_load = get_load
+        self.backoff = 1
+
+    def busy(self):
+        """Return the reason the host is too busy for a run, or None."""
+        if self.max_load is not None:
+            load = self.get_load()
+            if load > self.max_load:
+                return "load average per CPU is %.2f" % load
+
+        if self.max_ping is not None:
+            start = self.clock()
+            try:
+                self.client.ping()
+            except Exception as e:
+                return "dockerd did not answer a ping: %s" % e
+            elapsed = self.clock() - start
+            if elapsed > self.max_ping:
+                return "dockerd took %.2fs to answer a ping" % elapsed
+        return None
+
+    def wait_until_idle(self, until):
+        """Wait until the host is not busy. Returns False if it is still busy
+        at until.
+        """
+        while True:
+            reason = self.busy()
+            if reason is None:
+                return True
+            now = self.clock()
+            if now + DEFER_SECONDS > until:
+                log.info("Skipping run, host is busy: %s" % reason)
+                return False
+            log.info("Deferring run, host is busy: %s" % reason)
+            self.sleep(DEFER_SECONDS)
+
+    def next_run(self, after):
+        return align(after, self.interval, self.offset)
+
+    def wait_until(self, when):
+        delay = when - self.clock()
+        if delay > 0:
+            log.info("Next run in %.0fs" % delay)
+            self.sleep(delay)
+
+    def adapt(self, removed):
+        if removed:
+            self.backoff = 1
+        else:
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    def run_forever(self, run_once, runs=None):
+        """Call run_once at every scheduled time. run_once returns the number
+        of objects it removed.
+
+        :param runs: stop after this many scheduled times, for tests
+        """
+        start = self.next_run(self.clock())
+        count = 0
+        while runs is None or count < runs:
+            count += 1
+            self.wait_until(start)
+            if self.wait_until_idle(start + self.interval):
+                self.adapt(run_once())
+            start = self.next_run(max(
+                start + self.interval * self.backoff,
+                self.clock(),
+            ))
@@ -0,0 +1,290 @@
+# -*- coding: utf8 -*-
+"""
+Record the docker API traffic of a run, and replay it later without a docker
+daemon.
+
+A trace is a JSON lines file. The first line holds the API version, every
+other line one HTTP request and its response::
+
+    {"version": 1, "api_version": "1.41"}
+    {"method": "GET", "path": "/v1.41/containers/json?all=1", "status": 200,
+     "duration": 0.0123, "json": [...]}
+
+Traces are recorded at the HTTP level, below :class:`docker.APIClient`, so a
+replayed run goes through the same client code as a live one, including the
+errors raised for failed requests. Bodies of streamed responses are not
+recorded and replay as empty.
+
+When anonymized, names, tags, labels, commands and paths are replaced by
+stable tokens, so that a trace of a production host can be shared. Ids and
+digests are kept, as well as the separators of names (``/``, ``:``, ``@``)
+so that tags still parse.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import unquote
+from urllib.parse import unquote_plus
+
+
+TRACE_VERSION = 1
+
+ANONYMIZED_KEYS = frozenset([
+    'Args',
+    'Cmd',
+    'Command',
+    'Domainname',
+    'Entrypoint',
+    'Env',
+    'Hostname',
+    'HostnamePath',
+    'HostsPath',
+    'Image',
+    'Labels',
+    'LogPath',
+    'Mountpoint',
+    'Name',
+    'Names',
+    'Path',
+    'RepoDigests',
+    'RepoTags',
+    'ResolvConfPath',
+    'Source',
+])
+
+SEPARATORS_RE = re.compile(r'([/:@=])')
+KEPT_PIECES = frozenset(['', '<none>', 'sha256'])
+HEX_ID_RE = re.compile(r'^[0-9a-f]{12,}$')
+PATH_PIECE_RE = re.compile(r'[^/:@]+')
+# The name of an object in a request path, with the API word after it
+OBJECT_PATH_RE = re.compile(
+    r'^(?P<prefix>(?:/v[0-9.]+)?/(?:containers|images|volumes|networks)/)'
+    r'(?P<name>.+?)(?P<suffix>/[a-z]+)?$')
+API_WORDS = frozenset([
+    'archive', 'attach', 'changes', 'connect', 'create', 'disconnect',
+    'exec', 'export', 'get', 'history', 'json', 'kill', 'load', 'logs',
+    'pause', 'prune', 'push', 'rename', 'resize', 'restart', 'search',
+    'start', 'stats', 'stop', 'tag', 'top', 'unpause', 'update', 'wait',
+])
+
+
+class ReplayError(Exception):
+    pass
+
+
+class Anonymizer(object):
+    """Replace sensitive strings with tokens which are stable within one
+    trace.
+    """
+
+    def __init__(self, salt=None):
+        self.salt = os.urandom(16) if salt is None else salt
+        self.tokens = {}
+
+    def token(self, piece):
+        if piece in KEPT_PIECES or HEX_ID_RE.match(piece):
+            return piece
+        token = self.tokens.get(piece)
+        if token is None:
+            digest = hashlib.sha256(self.salt + piece.encode('utf-8'))
+            token = self.tokens[piece] = 'anon-' + digest.hexdigest()[:12]
+        return token
+
+    def string(self, value):
+        return ''.join(
+            piece if SEPARATORS_RE.match(piece) else self.token(piece)
+            for piece in SEPARATORS_RE.split(value)
+        )
+
+    def value(self, value):
+        if isinstance(value, str):
+            return self.string(value)
+        if isinstance(value, list):
+            return [self.value(item) for item in value]
+        if isinstance(value, dict):
+            return {
+                self.string(key): self.value(item)
+                for key, item in value.items()
+            }
+        return value
+
+    def document(self, document):
+        """Anonymize the values of :data:`ANONYMIZED_KEYS` in a decoded
+        JSON response.
+        """
+        if isinstance(document, list):
+            return [self.document(item) for item in document]
+        if not isinstance(document, dict):
+            return document
+        return {
+            key: (
+                self.value(item) if key in ANONYMIZED_KEYS
+                else self.document(item)
+            )
+            for key, item in document.items()
+        }
+
+    def path(self, path):
+        """Anonymize the names seen in earlier responses in the name of the
+        container, image, volume or network of a request path. API words
+        and the query are kept.
+        """
+        path, separator, query = path.partition('?')
+        match = OBJECT_PATH_RE.match(path)
+        if match is None:
+            return path + separator + query
+        name, suffix = match.group('name'), match.group('suffix') or ''
+        if suffix and suffix[1:] not in API_WORDS:
+            name, suffix = name + suffix, ''
+        # /containers/json, /images/create, ...
+        if not suffix and name in API_WORDS:
+            return path + separator + query
+        name = PATH_PIECE_RE.sub(
+            lambda piece: self.tokens.get(piece.group(0), piece.group(0)),
+            name,
+        )
+        return match.group('prefix') + name + suffix + separator + query
+
+
+class Recorder(object):
+    """A ``requests`` response hook which writes every response to a trace."""
+
+    def __init__(self, trace_file, anonymizer=None):
+        self.trace_file = trace_file
+        self.anonymizer = anonymizer
+        self.lock = threading.Lock()
+
+    def __call__(self, response, *args, **kwargs):
+        entry = {
+            'method': response.request.method,
+            'status': response.status_code,
+            'duration': round(response.elapsed.total_seconds(), 6),
+        }
+        if kwargs.get('stream'):
+            entry['stream'] = True
+        elif response.content:
+            try:
+                entry['json'] = response.json()
+            except ValueError:
+                entry['body'] = response.content.decode('utf-8', 'replace')
+
+        with self.lock:
+            # Anonymize the body first, the path may use names it contains
+            if self.anonymizer and 'json' in entry:
+                entry['json'] = self.anonymizer.document(entry['json'])
+            path = normalize_path(response.request.path_url)
+            if self.anonymizer:
+                path = self.anonymizer.path(path)
+            entry['path'] = path
+            self.trace_file.write(json.dumps(entry, sort_keys=True) + '\n')
+            self.trace_file.flush()
+
+
+def normalize_path(path_url):
+    """Unquote a request path and sort its query, so that the order of
+    the parameters does not matter when matching requests.
+    """
+    path, _, query = path_url.partition('?')
+    path = unquote(path)
+    if not query:
+        return path
+    return path + '?' + '&'.join(sorted(
+        unquote_plus(param) for param in query.split('&')))
+
+
+def record(client, trace_file, anonymize=False):
+    """Record all further requests made by client to trace_file."""
+    trace_file.write(json.dumps({
+        'version': TRACE_VERSION,
+        'api_version': client._version,
+    }) + '\n')
+    client.hooks['response'].append(
+        Recorder(trace_file, Anonymizer() if anonymize else None))
+    return client
+
+
+def read_trace(trace_file):
+    """Return the header and the entries of a trace."""
+    header = json.loads(trace_file.readline())
+    if header.get('version') != TRACE_VERSION:
+        raise ValueError("Unsupported trace version: %s" % header.get(
+            'version'))
+    entries = [json.loads(line) for line in trace_file if line.strip()]
+    return header, entries
+
+
+class ReplayAdapter(object):
+    """A ``requests`` transport adapter which serves responses from a trace.
+
+    Requests are matched by method and path, in the order they were recorded.
+    Once all recorded responses for a request are served, the last one is
+    served again.
+
+    :param scale: multiplies the recorded latency of every response, ``0``
+        replays without any delay
+    """
+
+    def __init__(self, entries, scale=1.0, sleep=time.sleep):
+        self.scale = scale
+        self.sleep = sleep
+        self.responses = {}
+        for entry in entries:
+            key = (entry['method'], normalize_path(entry['path']))
+            self.responses.setdefault(key, []).append(entry)
+        self.lock = threading.Lock()
+
+    def next_entry(self, method, path):
+        with self.lock:
+            entries = self.responses.get((method, path))
+            if not entries:
+                raise ReplayError("No recorded response for %s %s" % (
+                    method, path))
+            if len(entries) > 1:
+                return entries.pop(0)
+            return entries[0]
+
+    def send(self, request, **kwargs):
+        import io
+        import requests
+
+        entry = self.next_entry(
+            request.method, normalize_path(request.path_url))
+        if self.scale:
+            self.sleep(entry['duration'] * self.scale)
+
+        if 'json' in entry:
+            body = json.dumps(entry['json']).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            body = entry.get('body', '').encode('utf-8')
+            content_type = 'text/plain'
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers['Content-Type'] = content_type
+        response.encoding = 'utf-8'
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def replay_client(trace_file, scale=1.0, sleep=time.sleep):
+    """Return a :class:`docker.APIClient` which serves the requests recorded
+    in trace_file.
+    """
+    import docker
+
+    header, entries = read_trace(trace_file)
+    client = docker.APIClient(version=header['api_version'])
+    adapter = ReplayAdapter(entries, scale=scale, sleep=sleep)
+    for prefix in list(client.adapters):
+        client.mount(prefix, adapter)
+    return client
@@ -18,11 +18,16 @@ setup(
         'docker',
         'pytimeparse',
     ],
+    extras_require={
+        'inventory': ['numpy'],
+        'yaml': ['PyYAML'],
+    },
     license="Apache License 2.0",
     entry_points={
         'console_scripts': [
             'dcstop = docker_custodian.docker_autostop:main',
             'dcgc = docker_custodian.docker_gc:main',
+            'dccustodian = docker_custodian.custodian:main',
         ],
     },
 )
@@ -0,0 +1,170 @@
+import datetime
+
+import docker.errors
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import api
+
+
+class FakeBackend(object):
+    """An in memory backend."""
+
+    _version = '1.41'
+
+    def __init__(self, containers, images):
+        self.container_data = {c['Id']: c for c in containers}
+        self.image_data = {i['Id']: i for i in images}
+        self.removed = []
+
+    def containers(self, all=False):
+        return [
+            {
+                'Id': c['Id'],
+                'ImageID': c['Image'],
+                'Labels': {},
+                'Names': [c['Name']],
+                'State': 'running' if c['State']['Running'] else 'exited',
+            }
+            for c in self.container_data.values()
+        ]
+
+    def inspect_container(self, container):
+        return self.container_data[container]
+
+    def remove_container(self, container, v=False):
+        del self.container_data[container]
+        self.removed.append(container)
+
+    def images(self):
+        return [
+            {'Id': i['Id'], 'RepoTags': i['RepoTags']}
+            for i in self.image_data.values()
+        ]
+
+    def inspect_image(self, image):
+        return self.image_data[image]
+
+    def remove_image(self, image, force=False):
+        if image == 'busy':
+            raise docker.errors.APIError('conflict')
+        del self.image_data[image]
+        self.removed.append(image)
+
+
+def make_container(container_id, image, running=False):
+    return {
+        'Id': container_id,
+        'Name': '/' + container_id,
+        'Image': image,
+        'Created': '2014-01-01T00:00:00Z',
+        'State': {
+            'Running': running,
+            'StartedAt': '2014-01-01T00:00:00Z',
+            'FinishedAt': '2014-01-01T01:00:00Z',
+        },
+    }
+
+
+def make_image(image_id):
+    return {
+        'Id': image_id,
+        'RepoTags': ['<none>:<none>'],
+        'Created': '2014-01-01T00:00:00Z',
+    }
+
+
+def test_remove_containers_and_images():
+    backend = FakeBackend(
+        [make_container('old', 'one'), make_container('up', 'two', True)],
+        [make_image('one'), make_image('two'), make_image('busy')],
+    )
+    sink = mock.Mock()
+    results = api.remove_containers(
+        backend, max_age=datetime.timedelta(days=1), sink=sink)
+    assert results == [
+        api.Result('container', 'remove', 'old', 'old', False, None)]
+    sink.assert_called_once_with(results[0])
+
+    results = api.remove_images(backend, max_age=3600)
+    assert [(r.id, r.ok) for r in results] == [
+        ('busy', False),
+        ('one', True),
+    ]
+    assert isinstance(results[0].error, docker.errors.APIError)
+    assert backend.removed == ['old', 'one']
+
+
+def test_remove_containers_dry_run(mock_client, container):
+    mock_client.containers.return_value = [dict(container, Labels={})]
+    mock_client.inspect_container.return_value = container
+    results = api.remove_containers(
+        mock_client, max_age=3600, exclude_labels=['keep'], dry_run=True)
+    assert results == [api.Result(
+        'container', 'remove', container['Id'], 'container_name', True, None)]
+    assert not mock_client.remove_container.mock_calls
+
+
+@pytest.mark.parametrize('remove', [api.remove_containers, api.remove_images])
+def test_remove_without_max_age_or_policy(mock_client, remove):
+    with pytest.raises(ValueError):
+        remove(mock_client)
+    assert not mock_client.containers.called
+
+
+def test_remove_volumes(mock_client):
+    mock_client.volumes.return_value = {'Volumes': [{'Name': 'one'}]}
+    mock_client.remove_volume.side_effect = docker.errors.APIError('in use')
+    [result] = api.remove_volumes(mock_client)
+    assert result.id == 'one'
+    assert not result.ok
+
+
+def test_remove_networks(mock_client):
+    mock_client.containers.return_value = []
+    mock_client.networks.return_value = [{
+        'Id': 'abcd',
+        'Name': 'app_default',
+        'Created': '2014-01-01T01:01:01Z',
+        'Labels': None,
+    }]
+    results = api.remove_networks(mock_client, 3600, dry_run=True)
+    assert results == [
+        api.Result('network', 'remove', 'abcd', 'app_default', True, None)]
+
+
+def test_stop_containers(mock_client):
+    running = make_container('app_web', 'one', running=True)
+    mock_client.containers.return_value = [
+        {'Id': 'app_web', 'Names': ['/app_web'], 'State': 'running'},
+        {'Id': 'other', 'Names': ['/other'], 'State': 'running'},
+    ]
+    mock_client.inspect_container.return_value = running
+    results = api.stop_containers(
+        mock_client, 3600, ['app_'], containers=None)
+    assert results == [
+        api.Result('container', 'stop', 'app_web', 'app_web', False, None)]
+    mock_client.stop.assert_called_once_with('app_web')
+
+
+def test_caching_backend(mock_client):
+    mock_client.inspect_image.return_value = make_image('one')
+    backend = api.CachingBackend(mock_client)
+    assert backend.inspect_image(image='one') == make_image('one')
+    assert backend.inspect_image(image='one') == make_image('one')
+    mock_client.inspect_image.assert_called_once_with(image='one')
+
+    backend.remove_image(image='one')
+    backend.inspect_image(image='one')
+    assert mock_client.inspect_image.call_count == 2
+    assert backend.images is mock_client.images
+
+
+def test_min_date():
+    assert api.min_date(None) is None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    date = api.min_date(datetime.timedelta(hours=1))
+    assert abs((now - date).total_seconds() - 3600) < 60
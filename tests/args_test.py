@@ -5,6 +5,7 @@ except ImportError:
     import mock
 
 from dateutil import tz
+import pytest
 
 from docker_custodian import args
 
@@ -31,3 +32,33 @@ def test_timedelta_type(now):
     ) as mock_datetime:
         mock_datetime.now.return_value = now
         assert args.timedelta_type('5 days') == expected
+
+
+def test_seconds_type():
+    assert args.seconds_type('1h') == 3600
+    assert args.seconds_type(None) is None
+    with pytest.raises(ValueError):
+        args.seconds_type('soon')
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('512', 512),
+    ('1k', 1024),
+    ('8G', 8 * 1024 ** 3),
+    ('8GB', 8 * 1024 ** 3),
+    ('1.5 MiB', 3 * 512 * 1024),
+])
+def test_size_type(value, expected):
+    assert args.size_type(value) == expected
+
+
+def test_size_type_invalid():
+    with pytest.raises(ValueError):
+        args.size_type('lots')
+
+
+def test_keep_last_type():
+    assert args.keep_last_type('5') == (None, 5)
+    assert args.keep_last_type('user/ci-*=20') == ('user/ci-*', 20)
+    with pytest.raises(ValueError):
+        args.keep_last_type('user/ci-*=')
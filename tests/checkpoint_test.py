@@ -0,0 +1,173 @@
+import json
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import checkpoint
+from docker_custodian import docker_gc
+
+
+@pytest.fixture
+def inventory(mock_client):
+    containers = [
+        {'Id': 'aaaa', 'ImageID': '1', 'State': 'exited', 'Labels': {}},
+        {'Id': 'bbbb', 'ImageID': '1', 'State': 'exited', 'Labels': {}},
+    ]
+    mock_client.containers.side_effect = lambda **kwargs: list(containers)
+
+    def remove_container(container, v):
+        containers[:] = [c for c in containers if c['Id'] != container]
+    mock_client.remove_container.side_effect = remove_container
+    mock_client.inspect_container.side_effect = lambda container: {
+        'Id': container,
+        'Name': '/' + container,
+        'Created': '2013-12-20T17:00:00Z',
+        'State': {'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'},
+    }
+    mock_client.images.return_value = [
+        {'Id': '1', 'RepoTags': ['user/one:latest']},
+    ]
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-01T01:01:01Z',
+    }
+    mock_client.volumes.return_value = {'Volumes': [{'Name': 'vol'}]}
+    return mock_client
+
+
+@pytest.fixture
+def journal_path(tmpdir):
+    return str(tmpdir.join('dcgc.checkpoint'))
+
+
+def get_args(journal_path, *extra):
+    return docker_gc.get_args(args=[
+        '--max-container-age', '1d',
+        '--max-image-age', '1d',
+        '--dangling-volumes',
+        '--checkpoint', journal_path,
+    ] + list(extra))
+
+
+def run(client, args):
+    return checkpoint.run_checkpointed(client, args, [], set())
+
+
+def test_run_checkpointed(inventory, journal_path, tmpdir):
+    assert run(inventory, get_args(journal_path))
+    assert inventory.remove_container.call_count == 2
+    inventory.remove_image.assert_called_once_with(image='user/one:latest')
+    inventory.remove_volume.assert_called_once_with(name='vol')
+    assert not tmpdir.listdir()
+
+
+def test_run_checkpointed_sink(inventory, journal_path):
+    results = []
+    checkpoint.run_checkpointed(
+        inventory, get_args(journal_path), [], set(), sink=results.append)
+    assert sorted((result.kind, result.id) for result in results) == [
+        ('container', 'aaaa'),
+        ('container', 'bbbb'),
+        ('image', '1'),
+        ('volume', 'vol'),
+    ]
+    assert all(result.ok for result in results)
+
+
+def test_run_max_duration_sink(inventory):
+    results = []
+    docker_gc.run(
+        inventory,
+        docker_gc.get_args(args=[
+            '--max-container-age', '1d', '--max-duration', '1h']),
+        sink=results.append,
+    )
+    assert sorted(result.id for result in results) == ['aaaa', 'bbbb']
+
+
+def test_run_max_duration_warns_about_ignored_options(inventory):
+    args = docker_gc.get_args(args=[
+        '--max-image-age', '1d',
+        '--keep-last', '5',
+        '--failure-ledger', '/tmp/ledger',
+        '--max-duration', '10m',
+    ])
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.run(inventory, args)
+
+    assert mock_log.warning.mock_calls == [
+        mock.call("Ignoring --keep-last, it is not used with --max-duration"),
+        mock.call(
+            "Ignoring --failure-ledger, it is not used with --max-duration"),
+    ]
+
+
+def test_run_checkpointed_resumes(inventory, journal_path):
+    inventory.remove_image.side_effect = KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        run(inventory, get_args(journal_path))
+
+    with open(journal_path) as journal_file:
+        lines = [json.loads(line) for line in journal_file]
+    assert lines[1:] == [
+        {'kind': 'container', 'id': 'bbbb'},
+        {'kind': 'container', 'id': 'aaaa'},
+    ]
+
+    inventory.inspect_container.reset_mock()
+    inventory.inspect_image.reset_mock()
+    inventory.remove_container.reset_mock()
+    inventory.remove_image.reset_mock(side_effect=True)
+    assert run(inventory, get_args(journal_path))
+
+    # Nothing is inspected again, the rest of the plan is removed
+    assert not inventory.inspect_container.mock_calls
+    assert not inventory.inspect_image.mock_calls
+    assert not inventory.remove_container.mock_calls
+    inventory.remove_image.assert_called_once_with(image='user/one:latest')
+    inventory.remove_volume.assert_called_once_with(name='vol')
+
+
+def test_read_checkpoint_other_options(inventory, journal_path):
+    plan = {'containers': [], 'images': [], 'volumes': []}
+    options = checkpoint.plan_options(get_args(journal_path))
+    checkpoint.Journal.start(journal_path, plan, options).close(False)
+
+    assert checkpoint.read_checkpoint(journal_path, options) == plan
+    other = checkpoint.plan_options(
+        get_args(journal_path, '--exclude-image', 'user/one:latest'))
+    assert checkpoint.read_checkpoint(journal_path, other) is None
+
+
+def test_read_checkpoint_cut_short(journal_path):
+    plan = {
+        'containers': [{'id': 'aaaa'}, {'id': 'bbbb'}],
+        'images': [{'id': '1'}],
+        'volumes': [{'name': 'vol'}],
+    }
+    journal = checkpoint.Journal.start(journal_path, plan, {})
+    journal.removed('container', 'aaaa')
+    journal.removed('volume', 'vol')
+    journal.close(False)
+    with open(journal_path, 'a') as journal_file:
+        journal_file.write('{"kind": "ima')
+
+    assert checkpoint.read_checkpoint(journal_path, {}) == {
+        'containers': [{'id': 'bbbb'}],
+        'images': [{'id': '1'}],
+        'volumes': [],
+    }
+
+
+def test_read_checkpoint_missing(journal_path):
+    assert checkpoint.read_checkpoint(journal_path, {}) is None
+
+
+def test_run_checkpointed_dry_run(inventory, journal_path, tmpdir):
+    assert run(inventory, get_args(journal_path, '--dry-run'))
+    assert not inventory.remove_container.mock_calls
+    assert not tmpdir.listdir()
@@ -0,0 +1,161 @@
+import gzip
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import docker.errors
+import pytest
+
+from docker_custodian import container_logs
+from docker_custodian import docker_gc
+from docker_custodian.container_logs import LogLimit
+
+
+@pytest.fixture
+def log_file(tmpdir):
+    path = tmpdir.join('abcd-json.log')
+    path.write(b'{"log": "line\\n"}\n' * 1000, mode='wb')
+    return path
+
+
+@pytest.fixture
+def logged_container(container, log_file):
+    return dict(container, LogPath=str(log_file))
+
+
+def test_get_log_size(logged_container, log_file):
+    assert container_logs.get_log_size(logged_container) == log_file.size()
+
+
+def test_get_log_size_missing(container, tmpdir):
+    assert container_logs.get_log_size(container) == 0
+    container['LogPath'] = str(tmpdir.join('missing'))
+    assert container_logs.get_log_size(container) == 0
+
+
+def test_get_log_size_other_driver(logged_container):
+    logged_container['HostConfig'] = {'LogConfig': {'Type': 'journald'}}
+    assert container_logs.get_log_size(logged_container) == 0
+
+
+def test_enforce_log_limit_under_limit(logged_container, log_file):
+    size = log_file.size()
+    limit = LogLimit(size, container_logs.TRUNCATE)
+    assert container_logs.enforce_log_limit(logged_container, limit, False) == 0
+    assert log_file.size() == size
+
+
+def test_enforce_log_limit_truncate(logged_container, log_file):
+    size = log_file.size()
+    limit = LogLimit(100, container_logs.TRUNCATE)
+    assert container_logs.enforce_log_limit(
+        logged_container, limit, False) == size
+    assert log_file.size() == 0
+
+
+def test_enforce_log_limit_dry_run(logged_container, log_file):
+    size = log_file.size()
+    limit = LogLimit(100, container_logs.TRUNCATE)
+    assert container_logs.enforce_log_limit(
+        logged_container, limit, True) == size
+    assert log_file.size() == size
+
+
+def test_enforce_log_limit_rotate(logged_container, log_file):
+    content = log_file.read(mode='rb')
+    limit = LogLimit(100, container_logs.ROTATE)
+    freed = container_logs.enforce_log_limit(logged_container, limit, False)
+
+    rotated = log_file.dirpath().join('abcd-json.log.1.gz')
+    assert log_file.size() == 0
+    assert freed == len(content) - rotated.size()
+    with gzip.open(str(rotated), 'rb') as fh:
+        assert fh.read() == content
+
+
+def test_rotate_log_streams_in_chunks(log_file):
+    with mock.patch.object(container_logs, 'CHUNK_SIZE', 7):
+        with mock.patch(
+            'docker_custodian.container_logs.shutil.copyfileobj',
+            wraps=container_logs.shutil.copyfileobj,
+        ) as mock_copy:
+            container_logs.rotate_log(str(log_file))
+    assert mock_copy.call_args[0][2] == 7
+
+
+def test_enforce_log_limit_error(logged_container, log_file):
+    limit = LogLimit(100, container_logs.TRUNCATE)
+    with mock.patch(
+        'docker_custodian.container_logs.os.truncate',
+        side_effect=OSError("read-only"),
+    ):
+        assert container_logs.enforce_log_limit(
+            logged_container, limit, False) == 0
+
+
+def test_cleanup_containers_log_limit(mock_client, now, tmpdir):
+    removed_log = tmpdir.join('removed.log')
+    removed_log.write('x' * 50)
+    kept_log = tmpdir.join('kept.log')
+    kept_log.write('x' * 500)
+    mock_client.containers.return_value = [{'Id': 'abcd'}, {'Id': 'abbb'}]
+    mock_client.inspect_container.side_effect = iter([
+        {
+            'Id': 'abbb',
+            'LogPath': str(kept_log),
+            'State': {'Running': True},
+        },
+        {
+            'Id': 'abcd',
+            'LogPath': str(removed_log),
+            'State': {
+                'Running': False,
+                'FinishedAt': '2014-01-01T01:01:01Z',
+            },
+        },
+    ])
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.cleanup_containers(
+            mock_client, now, False, None,
+            log_limit=LogLimit(100, container_logs.TRUNCATE))
+
+    assert kept_log.size() == 0
+    mock_client.remove_container.assert_called_once_with(
+        container='abcd', v=True)
+    mock_log.info.assert_called_with("Container logs freed: 550.0 B")
+
+
+def test_cleanup_containers_log_limit_failed_removal(mock_client, now, tmpdir):
+    removed_log = tmpdir.join('removed.log')
+    removed_log.write('x' * 50)
+    mock_client.containers.return_value = [{'Id': 'abcd'}]
+    mock_client.inspect_container.return_value = {
+        'Id': 'abcd',
+        'LogPath': str(removed_log),
+        'State': {'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'},
+    }
+    mock_client.remove_container.side_effect = docker.errors.APIError('busy')
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.cleanup_containers(
+            mock_client, now, False, None,
+            log_limit=LogLimit(100, container_logs.TRUNCATE))
+
+    mock_log.info.assert_called_with("Container logs freed: 0.0 B")
+
+
+def test_cleanup_container_logs(mock_client, logged_container, log_file):
+    mock_client.containers.return_value = [
+        {'Id': logged_container['Id'], 'Labels': {'keep': 'yes'}},
+    ]
+    mock_client.inspect_container.return_value = logged_container
+    limit = LogLimit(100, container_logs.TRUNCATE)
+
+    docker_gc.cleanup_container_logs(
+        mock_client, limit, False, [docker_gc.ExcludeLabel('keep', None)])
+    assert log_file.size() > 0
+
+    docker_gc.cleanup_container_logs(mock_client, limit, False, [])
+    assert log_file.size() == 0
@@ -0,0 +1,120 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import custodian
+
+
+def test_custodian_lists_containers_once(mock_client, container, now):
+    other = dict(container, Id='abbb', Name='/other')
+    other['State'] = dict(container['State'], FinishedAt='2014-01-21T00:00:00Z')
+    mock_client.containers.return_value = [
+        {'Id': container['Id'], 'ImageID': '1', 'State': 'running',
+         'Names': ['/container_name'], 'Labels': {}},
+        {'Id': 'abbb', 'ImageID': '2', 'State': 'running',
+         'Names': ['/other'], 'Labels': {}},
+    ]
+    mock_client.inspect_container.side_effect = lambda container_id=None, **kwargs: {
+        container['Id']: container,
+        'abbb': other,
+    }[container_id or kwargs['container']]
+    mock_client.images.return_value = [
+        {'Id': '1', 'RepoTags': ['one:latest']},
+        {'Id': '2', 'RepoTags': ['two:latest']},
+    ]
+    mock_client.inspect_image.return_value = {
+        'Id': '1',
+        'Created': '2014-01-01T01:01:01Z',
+    }
+    args = custodian.get_args(args=[
+        '--prefix', 'container_',
+        '--max-run-time', '1d',
+        '--max-container-age', '1d',
+        '--max-image-age', '1d',
+    ])
+    args.max_run_time = args.max_container_age = args.max_image_age = now
+
+    runner = custodian.Custodian(mock_client)
+    runner.stop_containers(args.max_run_time, args.prefix, args.dry_run)
+    runner.gc(args)
+
+    mock_client.containers.assert_called_once_with(all=True)
+    mock_client.stop.assert_called_once_with(container['Id'])
+    # Only the container matching the prefix is inspected to be stopped
+    assert mock_client.inspect_container.mock_calls[0] == \
+        mock.call(container['Id'])
+    mock_client.remove_container.assert_called_once_with(
+        container=container['Id'], v=True)
+    # The removed container no longer keeps its image in use
+    assert [c['Id'] for c in runner.containers] == ['abbb']
+    mock_client.remove_image.assert_called_once_with(image='one:latest')
+
+
+def test_main_nothing_to_do():
+    args = custodian.get_args(args=[])
+    with mock.patch(
+            'docker_custodian.custodian.client_from_args',
+            autospec=True) as mock_client_from_args:
+        with mock.patch(
+                'docker_custodian.custodian.get_args',
+                autospec=True) as mock_get_args:
+            mock_get_args.return_value = args
+            custodian.main()
+    assert not mock_client_from_args.mock_calls
+
+
+@mock.patch('docker_custodian.custodian.Custodian', autospec=True)
+@mock.patch('docker_custodian.custodian.client_from_args', autospec=True)
+def test_main(mock_client_from_args, mock_custodian):
+    args = custodian.get_args(args=[
+        '--prefix', 'one_',
+        '--max-run-time', '2h',
+        '--max-memory', '1G',
+        '--dangling-volumes',
+        '-t', '30',
+    ])
+    mock_custodian.return_value.gc.return_value = None
+    with mock.patch(
+            'docker_custodian.custodian.get_args',
+            autospec=True,
+            return_value=args):
+        custodian.main()
+
+    mock_client_from_args.assert_called_once_with(args)
+    runner = mock_custodian.return_value
+    runner.stop_containers.assert_called_once_with(
+        args.max_run_time, ['one_'], False)
+    runner.stop_containers_over_limits.assert_called_once_with(
+        (None, 1024 ** 3), 0, 30, 8, ['one_'], False)
+    runner.gc.assert_called_once_with(args)
+
+
+@mock.patch('docker_custodian.custodian.Custodian', autospec=True)
+@mock.patch('docker_custodian.custodian.client_from_args', autospec=True)
+def test_main_exit_status(mock_client_from_args, mock_custodian):
+    args = custodian.get_args(args=[
+        '--max-container-age', '1d',
+        '--verify-against-reference',
+    ])
+    mock_custodian.return_value.gc.return_value = 1
+    with mock.patch(
+            'docker_custodian.custodian.get_args',
+            autospec=True,
+            return_value=args):
+        with pytest.raises(SystemExit) as exc_info:
+            custodian.main()
+    assert exc_info.value.code == 1
+
+
+def test_get_args():
+    args = custodian.get_args(args=[
+        '--prefix', 'one_',
+        '--max-image-age', '1d',
+        '--dry-run',
+    ])
+    assert args.prefix == ['one_']
+    assert args.dry_run is True
+    assert args.max_run_time is None
+    assert args.dangling_volumes is False
@@ -0,0 +1,214 @@
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import deadline
+from docker_custodian import plan
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def removal_plan():
+    return {
+        'version': plan.PLAN_VERSION,
+        'exclude_images': [],
+        'containers': [
+            {'id': 'small', 'name': 'small', 'timestamp': None},
+            {'id': 'big', 'name': 'big', 'timestamp': None},
+            {'id': 'user', 'name': 'user', 'timestamp': None},
+        ],
+        'images': [
+            {'id': 'many-tags'},
+            {'id': 'used'},
+        ],
+        'volumes': [{'name': 'vol'}],
+    }
+
+
+@pytest.fixture
+def client(mock_client):
+    mock_client.containers.return_value = [
+        {'Id': 'small', 'ImageID': 'x', 'State': 'exited', 'SizeRw': 10},
+        {'Id': 'big', 'ImageID': 'x', 'State': 'exited', 'SizeRw': 1000},
+        {'Id': 'user', 'ImageID': 'used', 'State': 'exited', 'SizeRw': 1},
+        {'Id': 'keep', 'ImageID': 'x', 'State': 'running'},
+    ]
+    mock_client.images.return_value = [
+        {'Id': 'many-tags', 'Size': 3000, 'SharedSize': -1,
+         'RepoTags': ['a:1', 'a:2', 'a:3']},
+        {'Id': 'used', 'Size': 800, 'SharedSize': 300,
+         'RepoTags': ['b:1']},
+        {'Id': 'x', 'Size': 1, 'RepoTags': ['x:1']},
+    ]
+    mock_client.volumes.return_value = {'Volumes': [{'Name': 'vol'}]}
+    return mock_client
+
+
+def test_deadline(clock):
+    budget = deadline.Deadline(100, clock=clock)
+    assert not budget.planning_expired()
+    clock.now = 50
+    assert budget.planning_expired()
+    assert not budget.expired()
+    clock.now = 100
+    assert budget.expired()
+
+
+def test_image_removal_calls():
+    assert deadline.image_removal_calls({'Id': 'a'}) == 1
+    assert deadline.image_removal_calls({'RepoTags': ['a:1', 'a:2']}) == 1
+
+
+def test_image_unique_size():
+    assert deadline.image_unique_size({'Size': 10}) == 10
+    assert deadline.image_unique_size({'Size': 10, 'SharedSize': -1}) == 10
+    assert deadline.image_unique_size({'Size': 10, 'SharedSize': 4}) == 6
+
+
+def test_apply_plan_by_value_order(client, removal_plan, clock):
+    budget = deadline.Deadline(100, clock=clock)
+    calls = []
+    client.remove_container.side_effect = \
+        lambda container, v: calls.append(container)
+    client.remove_image.side_effect = \
+        lambda image, force=False: calls.append(image)
+    client.remove_volume.side_effect = lambda name: calls.append(name)
+
+    deferred = deadline.apply_plan_by_value(
+        client, removal_plan, False, budget)
+
+    assert deferred == []
+    # The used image waits for the container which uses it
+    assert calls == ['many-tags', 'big', 'user', 'b:1', 'small', 'vol']
+    client.containers.assert_called_once_with(all=True, size=True)
+
+
+def test_list_containers_without_sizes_when_too_slow(client):
+    listed = threading.Event()
+
+    def containers(all=False, size=False):
+        if size:
+            listed.wait(5)
+        return [{'Id': 'one', 'SizeRw': 10 if size else None}]
+    client.containers.side_effect = containers
+
+    try:
+        with mock.patch('docker_custodian.deadline.log', autospec=True):
+            containers = deadline.list_containers(
+                client, deadline.Deadline(0.2))
+    finally:
+        listed.set()
+    assert containers == [{'Id': 'one', 'SizeRw': None}]
+    client.containers.assert_called_with(all=True)
+
+
+def test_list_containers_after_planning_expired(client, clock):
+    budget = deadline.Deadline(100, clock=clock)
+    clock.now = 60
+
+    with mock.patch('docker_custodian.deadline.log', autospec=True):
+        deadline.list_containers(client, budget)
+    client.containers.assert_called_once_with(all=True)
+
+
+def test_apply_plan_by_value_stops_at_deadline(client, removal_plan, clock):
+    budget = deadline.Deadline(100, clock=clock)
+
+    def remove_image(image, force=False):
+        clock.now = 100
+    client.remove_image.side_effect = remove_image
+
+    with mock.patch('docker_custodian.deadline.log',
+                    autospec=True) as mock_log:
+        deferred = deadline.apply_plan_by_value(
+            client, removal_plan, False, budget)
+
+    client.remove_image.assert_called_once_with(image='many-tags', force=True)
+    assert not client.remove_container.mock_calls
+    assert not client.remove_volume.mock_calls
+    assert [candidate.name for candidate in deferred] == [
+        'big', 'used', 'small', 'user', 'vol']
+    mock_log.info.assert_called_with(
+        "Deferred 3 containers, 1 images and 1 volumes (1.5 KB) to the next run")
+
+
+def test_apply_plan_by_value_blocked_by_running_container(
+    client,
+    removal_plan,
+    clock,
+):
+    client.containers.return_value[2]['State'] = 'running'
+    budget = deadline.Deadline(100, clock=clock)
+
+    deferred = deadline.apply_plan_by_value(
+        client, removal_plan, False, budget)
+
+    assert [candidate.name for candidate in deferred] == ['used']
+    assert mock.call(image='b:1') not in client.remove_image.mock_calls
+
+
+def test_build_plan_stops_at_planning_deadline(mock_client, now, clock):
+    mock_client.containers.return_value = [{'Id': 'a'}, {'Id': 'b'}]
+    mock_client.inspect_container.side_effect = lambda container: {
+        'Id': container,
+        'State': {'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'},
+    }
+    budget = deadline.Deadline(10, clock=clock)
+    clock.now = 5
+
+    result = plan.build_plan(
+        mock_client, now, None, False, [], set(), deadline=budget)
+
+    assert result['containers'] == []
+    assert not mock_client.inspect_container.called
+
+
+def test_build_plan_stops_inspecting_objects_which_are_kept(
+    mock_client,
+    now,
+    clock,
+):
+    mock_client.containers.return_value = [
+        {'Id': str(i), 'ImageID': 'in-use'} for i in range(5)]
+    mock_client.images.return_value = [
+        {'Id': str(i), 'RepoTags': ['a:%s' % i]} for i in range(5)]
+    budget = deadline.Deadline(10, clock=clock)
+
+    def inspect_container(container):
+        # Each inspect takes a second, and no container is old
+        clock.now += 1
+        return {
+            'Id': container,
+            'State': {'Running': True, 'FinishedAt': '0001-01-01T00:00:00Z'},
+        }
+
+    def inspect_image(image):
+        clock.now += 1
+        return {'Id': image, 'Created': '2014-01-20T10:10:00Z'}
+    mock_client.inspect_container.side_effect = inspect_container
+    mock_client.inspect_image.side_effect = inspect_image
+
+    result = plan.build_plan(
+        mock_client, now, now, False, [], set(), deadline=budget)
+
+    assert result['containers'] == result['images'] == []
+    # Planning stops after half of the budget
+    assert mock_client.inspect_container.call_count == 5
+    assert not mock_client.inspect_image.called
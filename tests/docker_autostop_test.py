@@ -10,7 +10,9 @@ from docker_custodian.docker_autostop import (
     main,
     stop_container,
     stop_containers,
+    stop_containers_over_limits,
 )
+from docker_custodian.resource_limits import ResourceLimits
 
 
 def test_stop_containers(mock_client, container, now):
@@ -53,16 +55,19 @@ def test_has_been_running_since_false(container, earlier_time):
             autospec=True)
 @mock.patch('docker_custodian.docker_autostop.get_opts',
             autospec=True)
-@mock.patch('docker_custodian.docker_autostop.docker', autospec=True)
+@mock.patch('docker_custodian.docker_autostop.client_from_args', autospec=True)
 def test_main(
-        mock_docker,
+        mock_client_from_args,
         mock_get_opts,
         mock_stop_containers,
         mock_build_matcher
 ):
-    mock_get_opts.return_value.timeout = 30
+    mock_get_opts.return_value.max_cpu = None
+    mock_get_opts.return_value.max_memory = None
     main()
     mock_get_opts.assert_called_once_with()
+    mock_client_from_args.assert_called_once_with(
+        mock_get_opts.return_value)
     mock_build_matcher.assert_called_once_with(
         mock_get_opts.return_value.prefix)
     mock_stop_containers.assert_called_once_with(
@@ -88,3 +93,38 @@ def test_get_opts_with_args(now):
         opts = get_opts(args=['--prefix', 'one', '--max-run-time', '24h'])
     assert opts.max_run_time == mock_timedelta_type.return_value
     mock_timedelta_type.assert_called_once_with('24h')
+
+
+def test_stop_containers_over_limits(mock_client):
+    mock_client.containers.return_value = [
+        {'Id': 'abcd', 'Names': ['/one_a']},
+        {'Id': 'abbb', 'Names': ['/one_b']},
+        {'Id': 'accc', 'Names': ['/two_c']},
+    ]
+    limits = ResourceLimits(max_cpu=None, max_memory=100)
+    with mock.patch(
+        'docker_custodian.docker_autostop.find_containers_over_limits',
+        autospec=True,
+        return_value=['abbb'],
+    ) as mock_find:
+        stop_containers_over_limits(
+            mock_client, limits, 600, 30, 4,
+            build_container_matcher(['one_']), False)
+
+    mock_find.assert_called_once_with(
+        mock_client, ['abcd', 'abbb'], limits, 600, 30, 4)
+    mock_client.stop.assert_called_once_with('abbb')
+
+
+def test_get_opts_resource_limits():
+    opts = get_opts(args=[
+        '--prefix', 'one',
+        '--max-cpu', '200%',
+        '--max-memory', '8G',
+        '--for', '10m',
+    ])
+    assert opts.max_cpu == 200.0
+    assert opts.max_memory == 8 * 1024 ** 3
+    assert opts.limit_window == 600
+    assert opts.sample_interval == 30
+    assert opts.stats_workers == 8
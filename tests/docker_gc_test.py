@@ -1,5 +1,8 @@
 from callee import String, Regex
 from six import StringIO
+import datetime
+import subprocess
+import sys
 import textwrap
 
 import docker.errors
@@ -7,6 +10,7 @@ try:
     from unittest import mock
 except ImportError:
     import mock
+import pytest
 import requests.exceptions
 
 from docker_custodian import docker_gc
@@ -150,11 +154,95 @@ def test_cleanup_volumes(mock_client):
         'Warnings': None,
     }
 
-    docker_gc.cleanup_volumes(mock_client, False)
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.cleanup_volumes(mock_client, False)
     assert mock_client.remove_volume.mock_calls == [
         mock.call(name=volume['Name'])
         for volume in reversed(volumes['Volumes'])
     ]
+    removal_lines = [
+        call for call in mock_log.info.mock_calls
+        if call[1][0].startswith('Removing')
+    ]
+    assert len(removal_lines) == 2
+
+
+def test_cleanup_build_cache(mock_client):
+    mock_client._result.return_value = {'SpaceReclaimed': 2048}
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.cleanup_build_cache(mock_client, 3600, 1024, False)
+
+    # BuildKit applies until and keep-storage together, so they are pruned
+    # by two calls
+    assert mock_client._post.mock_calls == [
+        mock.call(
+            mock_client._url.return_value,
+            params={'filters': '{"until": ["3600s"]}'},
+        ),
+        mock.call(
+            mock_client._url.return_value,
+            params={'filters': '{}', 'keep-storage': 1024},
+        ),
+    ]
+    mock_log.info.assert_called_with("Removed build cache: 4.0 KB")
+
+
+def test_cleanup_build_cache_no_filters(mock_client):
+    mock_client._result.return_value = {'SpaceReclaimed': 0}
+    docker_gc.cleanup_build_cache(mock_client, None, 1024, False)
+    mock_client._post.assert_called_once_with(
+        mock_client._url.return_value,
+        params={'filters': '{}', 'keep-storage': 1024},
+    )
+
+
+def test_cleanup_build_cache_dry_run(mock_client):
+    mock_client.df.return_value = {
+        'BuildCache': [
+            {'Size': 100, 'InUse': False, 'LastUsedAt': '2014-01-01T00:00:00Z'},
+            {'Size': 200, 'InUse': True, 'LastUsedAt': '2014-01-01T00:00:00Z'},
+            {'Size': 400, 'InUse': False, 'LastUsedAt': None,
+             'CreatedAt': '2014-01-01T00:00:00Z'},
+        ],
+    }
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.cleanup_build_cache(mock_client, 3600, None, True)
+
+    assert not mock_client._post.mock_calls
+    mock_log.info.assert_called_once_with(
+        "Build cache that would be removed: 500.0 B")
+
+
+def test_estimate_build_cache_keep_storage(mock_client):
+    mock_client.df.return_value = {
+        'BuildCache': [
+            {'Size': 100, 'InUse': False},
+            {'Size': 200, 'InUse': True},
+            {'Size': 400, 'InUse': False},
+        ],
+    }
+    assert docker_gc.estimate_build_cache(mock_client, None, None) == 500
+    assert docker_gc.estimate_build_cache(mock_client, None, 500) == 200
+    assert docker_gc.estimate_build_cache(mock_client, None, 1000) == 0
+
+
+def test_estimate_build_cache_age_and_keep_storage(mock_client, now):
+    mock_client.df.return_value = {
+        'BuildCache': [
+            {'Size': 100, 'InUse': False, 'LastUsedAt': '2014-01-01T00:00:00Z'},
+            {'Size': 200, 'InUse': True, 'LastUsedAt': '2014-01-01T00:00:00Z'},
+            {'Size': 400, 'InUse': False, 'LastUsedAt': now.isoformat()},
+        ],
+    }
+    with mock.patch(
+            'docker_custodian.docker_gc.datetime_seconds_ago',
+            return_value=now - datetime.timedelta(hours=1)):
+        # The old cache is pruned even though the total is under the limit
+        assert docker_gc.estimate_build_cache(mock_client, 3600, 600) == 100
+        assert docker_gc.estimate_build_cache(mock_client, 3600, 300) == 400
 
 
 def test_filter_images_in_use():
@@ -360,11 +448,73 @@ def test_remove_image_with_tags(mock_client, image, now):
             'RepoTags': repo_tags
     }
     mock_client.inspect_image.return_value = image
+    assert docker_gc.remove_image(mock_client, image_summary, now, False)
+
+    mock_client.remove_image.assert_called_once_with(
+        image=image_id,
+        force=True,
+    )
+
+
+def test_remove_image_single_tag(mock_client, image, now):
+    image_summary = {'Id': 'abcd', 'RepoTags': ['user/one:latest']}
+    mock_client.inspect_image.return_value = image
     docker_gc.remove_image(mock_client, image_summary, now, False)
 
+    mock_client.remove_image.assert_called_once_with(image='user/one:latest')
+
+
+def test_delete_image_keep_tags(mock_client):
+    repo_tags = ['user/one:latest', 'user/one:12345', 'user/one:abcde']
+    image_summary = {'Id': 'abcd', 'RepoTags': repo_tags}
+    assert docker_gc.delete_image(
+        mock_client,
+        image_summary,
+        keep_tags={'user/one:latest'},
+    )
+
+    assert mock_client.remove_image.mock_calls == [
+        mock.call(image='user/one:12345'),
+        mock.call(image='user/one:abcde'),
+    ]
+
+
+def test_delete_image_failure(mock_client):
+    image_summary = {'Id': 'abcd', 'RepoTags': ['a:1', 'b:2']}
+    mock_client.remove_image.side_effect = docker.errors.APIError('conflict')
+    assert not docker_gc.delete_image(mock_client, image_summary)
+
+
+def test_removal_calls_saved():
+    assert docker_gc.removal_calls_saved({'Id': 'abcd'}) == 0
+    assert docker_gc.removal_calls_saved({'RepoTags': ['a:1']}) == 0
+    assert docker_gc.removal_calls_saved({'RepoTags': ['a:1', 'a:2', 'b:1']}) == 2
+    assert docker_gc.removal_calls_saved(
+        {'RepoTags': ['a:1', 'a:2', 'b:1']},
+        keep_tags={'a:1'},
+    ) == 0
+
+
+def test_cleanup_images_logs_calls_saved(mock_client, now):
+    mock_client.containers.return_value = []
+    mock_client.images.return_value = [
+        {'Id': 'abcd', 'RepoTags': ['a:1', 'a:2', 'a:3']},
+        {'Id': 'abbb', 'RepoTags': ['b:1', 'b:2']},
+    ]
+    mock_client.inspect_image.return_value = {
+        'Id': 'abcd',
+        'Created': '2014-01-01T01:01:01Z',
+    }
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.cleanup_images(mock_client, now, False, set())
+
     assert mock_client.remove_image.mock_calls == [
-        mock.call(image=tag) for tag in repo_tags
+        mock.call(image='abbb', force=True),
+        mock.call(image='abcd', force=True),
     ]
+    mock_log.info.assert_called_with(
+        "Saved %s image removal calls by removing images by id", 3)
 
 
 def test_api_call_success():
@@ -414,6 +564,49 @@ def days_as_seconds(num):
     return num * 60 * 60 * 24
 
 
+def test_refresh_args(tmpdir):
+    exclude_file = tmpdir.join('exclude')
+    exclude_file.write('user/base:latest\n')
+    args = docker_gc.get_args(args=[
+        '--max-container-age', '1h',
+        '--exclude-image-file', str(exclude_file),
+    ])
+    assert docker_gc.build_exclude_set(None, args.exclude_image_file) == {
+        'user/base:latest'}
+    parsed_at = datetime.datetime.now(datetime.timezone.utc)
+
+    later = docker_gc.refresh_args(
+        args, parsed_at - datetime.timedelta(minutes=10))
+
+    moved = later.max_container_age - args.max_container_age
+    assert datetime.timedelta(minutes=10) <= moved < datetime.timedelta(
+        minutes=11)
+    assert later.exclude_image_file is args.exclude_image_file
+    assert docker_gc.build_exclude_set(None, later.exclude_image_file) == {
+        'user/base:latest'}
+    args.exclude_image_file.close()
+
+
+@pytest.mark.parametrize('option', [
+    ['--plan-out', '-'],
+    ['--export-inventory', '-'],
+    ['--verify-against-reference'],
+    ['--scan-orphans', '/var/lib/docker'],
+])
+def test_get_args_schedule_one_shot_option(option):
+    with pytest.raises(SystemExit):
+        docker_gc.get_args(args=[
+            '--max-container-age', '1d', '--schedule', '1h'] + option)
+
+
+def test_get_args_schedule_apply_plan(tmpdir):
+    plan_file = tmpdir.join('plan.json')
+    plan_file.write('{}')
+    with pytest.raises(SystemExit):
+        docker_gc.get_args(args=[
+            '--schedule', '1h', '--apply-plan', str(plan_file)])
+
+
 def test_get_args_with_defaults():
     opts = docker_gc.get_args(args=[])
     assert opts.timeout == 60
@@ -439,6 +632,15 @@ def test_get_args_with_args():
     assert opts.max_image_age == mock_timedelta_type.return_value
 
 
+def test_get_args_build_cache():
+    opts = docker_gc.get_args(args=[
+        '--max-build-cache-age', '2h',
+        '--max-build-cache-size', '20GB',
+    ])
+    assert opts.max_build_cache_age == 7200
+    assert opts.max_build_cache_size == 20 * 1024 ** 3
+
+
 def test_get_all_containers(mock_client):
     count = 10
     mock_client.containers.return_value = [mock.Mock() for _ in range(count)]
@@ -460,6 +662,112 @@ def test_get_all_images(mock_client):
     mock_log.info.assert_called_with("Found %s images", count)
 
 
+def network(network_id, name=None, labels=None,
+            created='2014-01-01T01:01:01.123456789Z'):
+    return {
+        'Id': network_id,
+        'Name': name or 'net-' + network_id,
+        'Created': created,
+        'Labels': labels or {},
+    }
+
+
+def attached(container_id, *networks):
+    return {
+        'Id': container_id,
+        'NetworkSettings': {'Networks': {
+            name: {'NetworkID': network_id} for name, network_id in networks
+        }},
+    }
+
+
+def test_get_networks_in_use():
+    containers = [
+        attached('one', ('app_default', 'aaaa')),
+        attached('two', ('legacy', '')),
+        {'Id': 'three'},
+    ]
+    assert docker_gc.get_networks_in_use(containers) == {
+        'app_default', 'aaaa', 'legacy'}
+
+
+def test_cleanup_networks(mock_client, now):
+    mock_client.networks.return_value = [
+        network('bridge', name='bridge'),
+        network('in-use'),
+        network('in-use-by-name', name='stopped_default'),
+        network('excluded', labels={'keep': 'yes'}),
+        network('new', created=now.isoformat()),
+        network('old'),
+    ]
+    containers = [
+        attached('one', ('net-in-use', 'in-use')),
+        attached('two', ('stopped_default', '')),
+    ]
+    results = []
+
+    docker_gc.cleanup_networks(
+        mock_client,
+        now,
+        False,
+        docker_gc.format_exclude_labels(['keep']),
+        containers=containers,
+        sink=results.append,
+    )
+    mock_client.remove_network.assert_called_once_with(net_id='old')
+    assert results == [
+        docker_gc.Result('network', 'remove', 'old', 'net-old', False, None)]
+    assert not mock_client.containers.called
+
+
+def test_cleanup_networks_dry_run_and_skip(mock_client, now):
+    mock_client.containers.return_value = []
+    mock_client.networks.return_value = [network('one'), network('two')]
+    results = []
+
+    docker_gc.cleanup_networks(
+        mock_client,
+        now,
+        True,
+        [],
+        sink=results.append,
+        skip=lambda kind, object_id: object_id == 'one',
+    )
+    assert not mock_client.remove_network.called
+    assert results == [
+        docker_gc.Result('network', 'remove', 'two', 'net-two', True, None)]
+
+
+def test_cleanup_networks_error(mock_client, now):
+    mock_client.containers.return_value = []
+    mock_client.networks.return_value = [network('one'), network('two')]
+    mock_client.remove_network.side_effect = [
+        docker.errors.APIError('in use'), None]
+    results = []
+
+    docker_gc.cleanup_networks(
+        mock_client, now, False, [], sink=results.append, workers=1)
+    assert [(result.id, result.ok) for result in results] == [
+        ('one', False), ('two', True)]
+
+
+def test_run_network_phase(mock_client):
+    args = docker_gc.get_args(args=[
+        '--max-network-age', '1h', '--exclude-network-label', 'keep'])
+    mock_client.containers.return_value = []
+    mock_client.networks.return_value = [
+        network('old'), network('kept', labels={'keep': ''})]
+
+    docker_gc.run(mock_client, args)
+    mock_client.remove_network.assert_called_once_with(net_id='old')
+
+
+def test_format_size():
+    assert docker_gc.format_size(512) == '512.0 B'
+    assert docker_gc.format_size(3 * 1024 * 1024) == '3.0 MB'
+    assert docker_gc.format_size(2 * 1024 ** 4) == '2.0 TB'
+
+
 def test_get_dangling_volumes(mock_client):
     count = 4
     mock_client.volumes.return_value = {
@@ -515,7 +823,7 @@ def test_build_exclude_set_empty():
 
 def test_main(mock_client):
     with mock.patch(
-            'docker_custodian.docker_gc.docker.APIClient',
+            'docker_custodian.docker_gc.client_from_args',
             return_value=mock_client):
 
         with mock.patch(
@@ -527,5 +835,50 @@ def test_main(mock_client):
                 exclude_image=[],
                 exclude_image_file=None,
                 exclude_container_label=[],
+                apply_plan=None,
+                plan_out=None,
+                max_build_cache_age=None,
+                max_build_cache_size=None,
+                max_duration=None,
+                max_log_size=None,
+                policy=None,
+                checkpoint=None,
+                export_inventory=None,
+                scan_orphans=None,
+                verify_against_reference=False,
+                lock_file=None,
+                schedule=None,
+                index=None,
+                max_network_age=None,
+                failure_ledger=None,
+                keep_last=[],
+                pipeline=False,
+                archive_logs=None,
             )
             docker_gc.main()
+
+
+def test_main_nothing_to_do():
+    args = docker_gc.get_args(args=[])
+    with mock.patch(
+            'docker_custodian.docker_gc.client_from_args',
+            autospec=True) as mock_client_from_args:
+        with mock.patch(
+                'docker_custodian.docker_gc.get_args',
+                autospec=True) as mock_get_args:
+            mock_get_args.return_value = args
+            docker_gc.main()
+    assert not mock_client_from_args.mock_calls
+
+
+def test_parse_args_does_not_import_docker():
+    code = textwrap.dedent("""
+        import sys
+        from docker_custodian import docker_autostop, docker_gc
+        docker_gc.get_args(args=['--max-image-age', '1d'])
+        docker_autostop.get_opts(args=['--prefix', 'a'])
+        heavy = {'docker', 'requests', 'dateutil.parser'}
+        print(','.join(sorted(heavy & set(sys.modules))))
+    """)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.strip() == b''
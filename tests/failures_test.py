@@ -0,0 +1,142 @@
+import json
+
+import docker.errors
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import failures
+from docker_custodian.docker_gc import Result
+
+
+def conflict():
+    response = mock.Mock(status_code=409)
+    return docker.errors.APIError("conflict", response=response)
+
+
+def failed(object_id, error=None):
+    return Result('container', 'remove', object_id, 'name', False,
+                  error or conflict())
+
+
+@pytest.fixture
+def ledger_path(tmpdir):
+    return str(tmpdir.join('dcgc.failures'))
+
+
+def test_error_class():
+    assert failures.error_class(conflict()) == 'APIError 409'
+    assert failures.error_class(IOError()) == 'OSError'
+
+
+def test_backoff_doubles(ledger_path):
+    ledger = failures.FailureLedger(ledger_path)
+    skipped = []
+    for _ in range(16):
+        if ledger.should_skip('container', 'aaaa'):
+            skipped.append(True)
+            continue
+        skipped.append(False)
+        ledger.record(failed('aaaa'))
+
+    attempts = [i for i, skip in enumerate(skipped) if not skip]
+    assert attempts == [0, 2, 5, 10]
+    assert ledger.entries['container:aaaa']['failures'] == 4
+
+
+def test_backoff_is_capped(ledger_path):
+    ledger = failures.FailureLedger(ledger_path)
+    for _ in range(10):
+        ledger.record(failed('aaaa'))
+    entry = ledger.entries['container:aaaa']
+    assert entry['skip'] == failures.MAX_SKIPPED_RUNS
+
+
+def test_record_new_error_class_starts_over(ledger_path):
+    ledger = failures.FailureLedger(ledger_path)
+    ledger.record(failed('aaaa'))
+    ledger.record(failed('aaaa'))
+    ledger.record(failed('aaaa', IOError("timeout")))
+    entry = ledger.entries['container:aaaa']
+    assert entry['error'] == 'OSError'
+    assert entry['failures'] == 1
+
+
+def test_record_success_forgets(ledger_path):
+    ledger = failures.FailureLedger(ledger_path)
+    ledger.record(failed('aaaa'))
+    ledger.record(failed('aaaa')._replace(error=None))
+    assert ledger.entries == {}
+
+
+def test_record_ignores_dry_run(ledger_path):
+    ledger = failures.FailureLedger(ledger_path)
+    ledger.record(failed('aaaa')._replace(dry_run=True, error=None))
+    assert ledger.entries == {}
+
+
+def test_chronic(ledger_path):
+    ledger = failures.FailureLedger(ledger_path)
+    for _ in range(failures.CHRONIC_FAILURES):
+        ledger.record(failed('aaaa'))
+    ledger.record(failed('bbbb'))
+    assert [key for key, _ in ledger.chronic()] == ['container:aaaa']
+
+
+def test_load_and_save(ledger_path):
+    ledger = failures.FailureLedger(ledger_path, now=1000000000)
+    ledger.record(failed('aaaa'))
+    ledger.save()
+
+    loaded = failures.FailureLedger.load(ledger_path, now=1000000000)
+    assert loaded.entries == ledger.entries
+
+    expired = failures.FailureLedger.load(
+        ledger_path, now=1000000000 + failures.EXPIRE_SECONDS + 1)
+    assert expired.entries == {}
+
+
+@pytest.mark.parametrize('content', ['{not json', '{"version": 99}'])
+def test_load_ignores_bad_ledger(ledger_path, content):
+    with open(ledger_path, 'w') as ledger_file:
+        ledger_file.write(content)
+    assert failures.FailureLedger.load(ledger_path).entries == {}
+
+
+def test_run_skips_failed_containers(mock_client, ledger_path):
+    mock_client.containers.return_value = [
+        {'Id': 'aaaa', 'Labels': {}},
+        {'Id': 'bbbb', 'Labels': {}},
+    ]
+    mock_client.inspect_container.side_effect = lambda container: {
+        'Id': container,
+        'Name': '/' + container,
+        'Created': '2013-12-20T17:00:00Z',
+        'State': {'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'},
+    }
+
+    def remove_container(container, v):
+        if container == 'aaaa':
+            raise conflict()
+    mock_client.remove_container.side_effect = remove_container
+    args = docker_gc.get_args(args=[
+        '--max-container-age', '1d',
+        '--failure-ledger', ledger_path,
+    ])
+
+    docker_gc.run(mock_client, args)
+    with open(ledger_path) as ledger_file:
+        entries = json.load(ledger_file)['failures']
+    assert list(entries) == ['container:aaaa']
+
+    mock_client.reset_mock()
+    docker_gc.run(mock_client, args)
+    # aaaa is skipped for one run, without being inspected
+    mock_client.inspect_container.assert_called_once_with(container='bbbb')
+
+    mock_client.reset_mock()
+    docker_gc.run(mock_client, args)
+    assert mock_client.inspect_container.call_count == 2
@@ -0,0 +1,250 @@
+import json
+import time
+
+import docker.errors
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import incremental
+from docker_custodian.args import datetime_seconds_ago
+
+
+def inspected(container_id, running=False,
+              finished_at='2014-01-01T01:01:01Z'):
+    return {
+        'Id': container_id,
+        'Name': '/name-' + container_id,
+        'Created': '2013-12-20T17:00:00Z',
+        'State': {
+            'Running': running,
+            'FinishedAt': finished_at,
+            'Pid': 1234,
+        },
+        'Config': {'Labels': {'a': 'b'}, 'Env': ['SECRET=1']},
+        'HostConfig': {'LogConfig': {'Type': 'json-file'}},
+        'LogPath': '/var/log/' + container_id,
+        'GraphDriver': {'Name': 'overlay2', 'Data': {}},
+    }
+
+
+def write(path, containers=None, images=None, last_run=1000):
+    with open(path, 'w') as index_file:
+        json.dump({
+            'version': incremental.INDEX_VERSION,
+            'last_run': last_run,
+            'containers': containers or {},
+            'images': images or {},
+        }, index_file)
+
+
+def read(path):
+    with open(path) as index_file:
+        return json.load(index_file)
+
+
+def test_compact_container():
+    compact = incremental.compact_container(inspected('abcd'))
+    assert compact['State'] == {
+        'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'}
+    assert compact['Config'] == {'Labels': {'a': 'b'}}
+    assert compact['HostConfig'] == {'LogConfig': {'Type': 'json-file'}}
+
+
+def test_indexed_backend_inspects_once(mock_client):
+    mock_client.inspect_container.return_value = inspected('abcd')
+    mock_client.inspect_image.return_value = {
+        'Id': 'image', 'Created': '2014-01-01T01:01:01Z'}
+    backend = incremental.IndexedBackend(mock_client)
+
+    for _ in range(2):
+        assert backend.inspect_container('abcd')['Name'] == '/name-abcd'
+        assert backend.inspect_image('image')['Created'] == (
+            '2014-01-01T01:01:01Z')
+    mock_client.inspect_container.assert_called_once_with(container='abcd')
+    mock_client.inspect_image.assert_called_once_with(image='image')
+
+
+def test_indexed_backend_drops_containers_which_changed_state(mock_client):
+    backend = incremental.IndexedBackend(mock_client, containers={
+        'stopped': incremental.compact_container(inspected('stopped')),
+        'started': incremental.compact_container(inspected('started')),
+    })
+    mock_client.containers.return_value = [
+        {'Id': 'stopped', 'State': 'exited'},
+        {'Id': 'started', 'State': 'running'},
+    ]
+
+    backend.containers(all=True)
+    assert set(backend.container_index) == {'stopped'}
+    assert backend.listed_containers == {'stopped', 'started'}
+
+
+def test_indexed_backend_remove(mock_client):
+    mock_client.inspect_container.return_value = inspected('abcd')
+    backend = incremental.IndexedBackend(
+        mock_client,
+        containers={'abcd': incremental.compact_container(inspected('abcd'))},
+        images={'image': {}},
+    )
+    backend.remove_container('abcd', v=True)
+    backend.remove_image('image')
+
+    assert backend.container_index == {}
+    assert backend.image_index == {}
+    # Served from the index, so inspected again before removal
+    mock_client.inspect_container.assert_called_once_with(container='abcd')
+    mock_client.remove_container.assert_called_once_with(
+        container='abcd', v=True)
+    mock_client.remove_image.assert_called_once_with(
+        image='image', force=False)
+
+
+def test_indexed_backend_remove_inspected_in_run(mock_client):
+    mock_client.inspect_container.return_value = inspected('abcd')
+    backend = incremental.IndexedBackend(mock_client)
+    backend.inspect_container('abcd')
+    backend.remove_container('abcd')
+
+    mock_client.inspect_container.assert_called_once_with(container='abcd')
+    mock_client.remove_container.assert_called_once_with(
+        container='abcd', v=False)
+
+
+def test_indexed_backend_keeps_container_started_and_stopped(mock_client):
+    # The start and die events were missed, the listed state is the same
+    backend = incremental.IndexedBackend(mock_client, containers={
+        'abcd': incremental.compact_container(inspected('abcd')),
+    })
+    mock_client.containers.return_value = [{'Id': 'abcd', 'State': 'exited'}]
+    mock_client.inspect_container.return_value = inspected(
+        'abcd', finished_at='2024-06-01T01:01:01Z')
+
+    backend.containers(all=True)
+    assert backend.inspect_container('abcd')['State']['FinishedAt'] == (
+        '2014-01-01T01:01:01Z')
+    with pytest.raises(docker.errors.APIError):
+        backend.remove_container('abcd')
+
+    assert not mock_client.remove_container.called
+    assert backend.container_index['abcd']['State']['FinishedAt'] == (
+        '2024-06-01T01:01:01Z')
+
+
+def test_read_index_missing_or_unreadable(tmpdir):
+    path = str(tmpdir.join('index'))
+    assert incremental.read_index(path) is None
+
+    tmpdir.join('index').write('{')
+    assert incremental.read_index(path) is None
+
+    tmpdir.join('index').write('{"version": 0}')
+    assert incremental.read_index(path) is None
+
+
+def test_apply_events(mock_client):
+    index = {
+        'last_run': 1000,
+        'containers': {'died': {}, 'destroyed': {}, 'same': {}},
+        'images': {'untagged': {}, 'same': {}},
+    }
+    mock_client.events.return_value = iter([
+        {'Type': 'container', 'Action': 'die', 'id': 'died'},
+        {'Type': 'container', 'Action': 'destroy', 'id': 'destroyed'},
+        {'Type': 'container', 'Action': 'exec_start', 'id': 'same'},
+        {'Type': 'image', 'Action': 'untag', 'Actor': {'ID': 'untagged'}},
+        {'Type': 'network', 'Action': 'connect', 'id': 'same'},
+    ])
+
+    assert incremental.apply_events(mock_client, index, 2000)
+    assert index['containers'] == {'same': {}}
+    assert index['images'] == {'same': {}}
+    mock_client.events.assert_called_once_with(
+        since=1000, until=2000, decode=True)
+
+
+def test_apply_events_index_too_old(mock_client):
+    index = {'last_run': 1000, 'containers': {}, 'images': {}}
+    assert not incremental.apply_events(
+        mock_client, index, 1001 + incremental.MAX_INDEX_AGE)
+    assert not mock_client.events.called
+
+
+def test_apply_events_too_many_events(mock_client):
+    index = {'last_run': 1000, 'containers': {}, 'images': {}}
+    mock_client.events.return_value = iter(
+        [{'Type': 'container', 'Action': 'exec_start', 'id': 'abcd'}] *
+        incremental.EVENTS_LIMIT)
+    assert not incremental.apply_events(mock_client, index, 2000)
+
+
+def test_apply_events_error(mock_client):
+    index = {'last_run': 1000, 'containers': {}, 'images': {}}
+    mock_client.events.side_effect = docker.errors.APIError('boom')
+    assert not incremental.apply_events(mock_client, index, 2000)
+
+
+def test_incremental_index_without_path(mock_client):
+    with incremental.incremental_index(mock_client, None) as client:
+        assert client is mock_client
+
+
+def test_incremental_index_full_scan(mock_client, tmpdir):
+    path = str(tmpdir.join('index'))
+    mock_client.containers.return_value = [{'Id': 'abcd', 'State': 'exited'}]
+    mock_client.inspect_container.return_value = inspected('abcd')
+
+    with incremental.incremental_index(mock_client, path) as client:
+        client.containers(all=True)
+        client.inspect_container('abcd')
+
+    index = read(path)
+    assert set(index['containers']) == {'abcd'}
+    assert not mock_client.events.called
+
+
+def test_incremental_index_uses_index(mock_client, tmpdir):
+    path = str(tmpdir.join('index'))
+    container = incremental.compact_container(inspected('abcd'))
+    last_run = int(time.time()) - 60
+    write(path, containers={'abcd': container, 'gone': container},
+          last_run=last_run)
+    mock_client.events.return_value = iter([])
+    mock_client.containers.return_value = [{'Id': 'abcd', 'State': 'exited'}]
+
+    with incremental.incremental_index(mock_client, path) as client:
+        client.containers(all=True)
+        assert client.inspect_container('abcd') == container
+
+    index = read(path)
+    assert not mock_client.inspect_container.called
+    assert set(index['containers']) == {'abcd'}
+    assert index['last_run'] > last_run
+
+
+def test_incremental_index_missed_start_and_die(mock_client, tmpdir):
+    path = str(tmpdir.join('index'))
+    write(path, containers={
+        'abcd': incremental.compact_container(inspected('abcd')),
+    }, last_run=int(time.time()) - 60)
+    # dockerd dropped the events of a run which started and stopped it
+    mock_client.events.return_value = iter([])
+    mock_client.containers.return_value = [{'Id': 'abcd', 'State': 'exited'}]
+    finished_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    mock_client.inspect_container.return_value = inspected(
+        'abcd', finished_at=finished_at)
+    results = []
+
+    with incremental.incremental_index(mock_client, path) as client:
+        removed = docker_gc.cleanup_containers(
+            client,
+            datetime_seconds_ago(24 * 3600),
+            False,
+            [],
+            sink=results.append,
+        )
+
+    assert removed == set()
+    assert not mock_client.remove_container.called
+    assert [result.ok for result in results] == [False]
+    index = read(path)
+    assert index['containers']['abcd']['State']['FinishedAt'] == finished_at
@@ -0,0 +1,141 @@
+import datetime
+import io
+
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import inventory
+
+numpy = pytest.importorskip('numpy')
+
+
+# 2014-01-20T10:10:00Z
+NOW = 1390212600
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def host(mock_client):
+    mock_client.containers.return_value = [
+        {
+            'Id': 'running', 'ImageID': 'i-used', 'State': 'running',
+            'Created': NOW - 30 * DAY, 'Labels': {'team': 'web'},
+        },
+        {
+            'Id': 'old', 'ImageID': 'i-old-user', 'State': 'exited',
+            'Created': NOW - 30 * DAY, 'Labels': {'team': 'web'},
+        },
+        {
+            'Id': 'new', 'ImageID': 'i-new-user', 'State': 'exited',
+            'Created': NOW - 30 * DAY, 'Labels': {},
+        },
+        {
+            'Id': 'kept', 'ImageID': 'i-kept-user', 'State': 'exited',
+            'Created': NOW - 30 * DAY, 'Labels': {'keep': 'yes'},
+        },
+        {
+            'Id': 'never', 'ImageID': 'gone', 'State': 'created',
+            'Created': NOW - 3 * DAY, 'Labels': {},
+        },
+    ]
+    finished = {
+        'old': '2014-01-01T00:00:00Z',
+        'new': '2014-01-20T00:00:00Z',
+        'kept': '2014-01-01T00:00:00Z',
+        'never': docker_gc.YEAR_ZERO,
+    }
+    mock_client.inspect_container.side_effect = lambda container: {
+        'Id': container,
+        'Created': (
+            '2014-01-17T10:10:00Z' if container == 'never'
+            else '2013-12-21T10:10:00Z'
+        ),
+        'State': {
+            'Running': container == 'running',
+            'FinishedAt': finished.get(container, docker_gc.YEAR_ZERO),
+        },
+    }
+    mock_client.images.return_value = [
+        {'Id': image_id, 'Created': NOW - 10 * DAY, 'Size': 10,
+         'RepoTags': tags}
+        for image_id, tags in [
+            ('i-used', ['web:1']),
+            ('i-old-user', ['web:2', 'web:latest']),
+            ('i-new-user', ['<none>:<none>']),
+            ('i-kept-user', ['base:1']),
+            ('i-unused', ['base:2']),
+        ]
+    ]
+    return mock_client
+
+
+def collect(host):
+    return inventory.collect_inventory(host, now=NOW)
+
+
+def test_collect_inventory(host):
+    columns = collect(host)
+    assert list(columns['container_id']) == [
+        'running', 'old', 'new', 'kept', 'never']
+    assert list(columns['container_finished']) == [
+        -1, 1388534400, 1390176000, 1388534400, -1]
+    assert list(columns['container_image']) == [0, 1, 2, 3, -1]
+    assert list(columns['tags']) == [
+        'web:1', 'web:2', 'web:latest', 'base:1', 'base:2']
+    assert list(columns['image_tag_offsets']) == [0, 1, 3, 3, 4, 5]
+    # The web label is stored once
+    assert list(columns['label_keys']) == ['team', 'keep']
+    assert list(columns['container_label_ids']) == [0, 0, 1]
+    # Running containers are not inspected
+    assert host.inspect_container.call_count == 4
+
+
+def test_write_and_load_inventory(host):
+    columns = collect(host)
+    inventory_file = io.BytesIO()
+    inventory.write_inventory(columns, inventory_file)
+    inventory_file.seek(0)
+    loaded = inventory.load_inventory(inventory_file)
+    assert set(loaded) == set(columns)
+    for name, column in columns.items():
+        assert numpy.array_equal(loaded[name], column)
+
+
+def test_evaluate(host):
+    remove_containers, remove_images = inventory.evaluate(
+        collect(host),
+        max_container_age=2 * DAY,
+        max_image_age=DAY,
+        exclude_container_labels=docker_gc.format_exclude_labels(['keep']),
+        exclude_images=['base:2'],
+    )
+    assert list(remove_containers) == [False, True, False, False, True]
+    # Images of kept containers are in use
+    assert list(remove_images) == [False, True, False, False, False]
+
+
+def test_evaluate_label_values(host):
+    remove_containers, remove_images = inventory.evaluate(
+        collect(host),
+        max_container_age=2 * DAY,
+        max_image_age=None,
+        exclude_container_labels=docker_gc.format_exclude_labels(
+            ['team=w*', 'keep=no']),
+    )
+    assert list(remove_containers) == [False, False, False, True, True]
+    assert not remove_images.any()
+
+
+def test_evaluate_matches_dcgc(host, now):
+    remove_containers, _ = inventory.evaluate(
+        collect(host), max_container_age=2 * DAY, max_image_age=None)
+    removed = [
+        container['Id'] for container in docker_gc.find_containers_to_remove(
+            host,
+            now - datetime.timedelta(days=2),
+            [],
+        )
+    ]
+    columns = collect(host)
+    assert sorted(columns['container_id'][remove_containers]) == sorted(
+        removed)
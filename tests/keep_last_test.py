@@ -0,0 +1,206 @@
+import time
+
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import keep_last
+from docker_custodian.keep_last import KeepLast
+
+
+def make_images(*tags_by_age):
+    """Return image summaries, the first one is the newest."""
+    return [
+        {'Id': 'sha256:%04d' % i, 'Created': 1000 - i, 'RepoTags': tags}
+        for i, tags in enumerate(tags_by_age)
+    ]
+
+
+def test_build_keep_last():
+    assert keep_last.build_keep_last([
+        (None, 5),
+        ('user/ci-*', 20),
+        ('user/base', 0),
+    ]) == KeepLast(5, (('user/ci-*', 20), ('user/base', 0)))
+
+
+def test_repository_count():
+    policy = KeepLast(5, (('user/ci-*', 20), ('user/*', 1)))
+    assert keep_last.repository_count(policy, 'user/ci-app') == 20
+    assert keep_last.repository_count(policy, 'user/app') == 1
+    assert keep_last.repository_count(policy, 'other') == 5
+    assert keep_last.repository_count(KeepLast(None, ()), 'other') is None
+
+
+@pytest.mark.parametrize('tag,expected', [
+    ('user/app:1', 'user/app'),
+    ('host:5000/user/app:1', 'host:5000/user/app'),
+    ('host:5000/user/app', 'host:5000/user/app'),
+    ('app', 'app'),
+])
+def test_get_repository(tag, expected):
+    assert keep_last.get_repository(tag) == expected
+
+
+def test_build_tag_index():
+    images = make_images(
+        ['user/app:3', 'user/app:latest'],
+        ['user/app:2', 'user/other:2'],
+        ['<none>:<none>'],
+        ['user/app:1'],
+    )
+    assert keep_last.build_tag_index(images) == {
+        'user/app': ['sha256:0000', 'sha256:0001', 'sha256:0003'],
+        'user/other': ['sha256:0001'],
+    }
+
+
+def test_find_tags_to_remove():
+    images = make_images(
+        ['user/app:3', 'user/app:latest'],
+        ['user/app:2', 'user/other:2'],
+        ['user/app:1'],
+        ['user/other:1'],
+    )
+    assert keep_last.find_tags_to_remove(KeepLast(1, ()), images) == {
+        'user/app:2', 'user/app:1', 'user/other:1',
+    }
+    only_app = KeepLast(None, (('user/app', 2),))
+    assert keep_last.find_tags_to_remove(only_app, images) == {'user/app:1'}
+
+
+def test_find_tags_to_remove_many_tags():
+    images = make_images(*[
+        ['repo%d:%d' % (i % 1000, i)] for i in range(100000)
+    ])
+    start = time.monotonic()
+    tags_to_remove = keep_last.find_tags_to_remove(KeepLast(3, ()), images)
+    assert time.monotonic() - start < 5
+    assert len(tags_to_remove) == 100000 - 3000
+    assert 'repo0:0' not in tags_to_remove
+    assert 'repo0:3000' in tags_to_remove
+
+
+def test_cleanup_images_by_count(mock_client):
+    mock_client.images.return_value = make_images(
+        ['user/app:3'],
+        ['user/app:2', 'user/other:2'],
+        ['user/app:1'],
+        ['user/app:0', 'user/keep:0'],
+        ['user/app:in-use'],
+        ['<none>:<none>'],
+    )
+    mock_client.containers.return_value = [
+        {'Id': 'cccc', 'ImageID': 'sha256:0004'},
+    ]
+    results = []
+
+    keep_last.cleanup_images_by_count(
+        mock_client,
+        KeepLast(1, ()),
+        False,
+        {'user/keep:*'},
+        sink=results.append,
+    )
+    # user/other:2 is the newest of its repository, so only the other tag of
+    # the image is removed
+    assert [result.name for result in results] == [
+        'user/app:1',
+        'user/app:2',
+    ]
+    assert [call[2] for call in mock_client.remove_image.mock_calls] == [
+        {'image': 'user/app:1'},
+        {'image': 'user/app:2'},
+    ]
+
+
+def test_cleanup_images_with_keep_last_and_max_age(mock_client, now):
+    mock_client.images.return_value = make_images(
+        ['user/app:2'],
+        ['user/app:1'],
+        ['<none>:<none>'],
+    )
+    mock_client.containers.return_value = []
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-01T01:01:01Z',
+    }
+
+    docker_gc.cleanup_images(
+        mock_client,
+        now,
+        False,
+        set(),
+        keep_last=KeepLast(1, ()),
+    )
+    # The newest tag is kept by count however old it is, and untagged
+    # images are removed by age
+    assert [call[2] for call in mock_client.remove_image.mock_calls] == [
+        {'image': 'user/app:1'},
+        {'image': 'sha256:0002'},
+    ]
+
+
+def test_cleanup_images_keep_last_override_and_max_age(mock_client, now):
+    mock_client.images.return_value = make_images(
+        ['user/app:2', 'other/tool:1'],
+        ['user/app:1'],
+    )
+    mock_client.containers.return_value = []
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-01T01:01:01Z',
+    }
+
+    docker_gc.cleanup_images(
+        mock_client,
+        now,
+        False,
+        set(),
+        keep_last=KeepLast(None, (('user/app', 1),)),
+    )
+    # Tags outside of the overridden repositories are still removed by age
+    assert [call[2] for call in mock_client.remove_image.mock_calls] == [
+        {'image': 'user/app:1'},
+        {'image': 'other/tool:1'},
+    ]
+
+
+def test_cleanup_images_keep_last_skips_once(mock_client, now):
+    mock_client.images.return_value = make_images(
+        ['user/app:2'],
+        ['user/app:1'],
+        ['<none>:<none>'],
+    )
+    mock_client.containers.return_value = []
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-01T01:01:01Z',
+    }
+    skipped = []
+
+    def skip(kind, object_id):
+        skipped.append(object_id)
+        return object_id == 'sha256:0001'
+
+    docker_gc.cleanup_images(
+        mock_client,
+        now,
+        False,
+        set(),
+        skip=skip,
+        keep_last=KeepLast(1, ()),
+    )
+    # Both passes see every image, but each counts as skipped once
+    assert sorted(skipped) == ['sha256:0000', 'sha256:0001', 'sha256:0002']
+    assert [call[2] for call in mock_client.remove_image.mock_calls] == [
+        {'image': 'sha256:0002'},
+    ]
+
+
+def test_get_args_keep_last():
+    args = docker_gc.get_args(args=[
+        '--keep-last', '5',
+        '--keep-last', 'user/ci-*=20',
+    ])
+    assert args.keep_last == [(None, 5), ('user/ci-*', 20)]
+    assert docker_gc.has_work(args)
@@ -0,0 +1,42 @@
+import json
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from docker_custodian import lock
+
+
+def test_run_lock(tmpdir):
+    path = str(tmpdir.join('dcgc.lock'))
+    with lock.run_lock(path) as acquired:
+        assert acquired
+        with open(path) as lock_file:
+            owner = json.load(lock_file)
+        assert set(owner) == {'pid', 'host', 'started'}
+
+        with lock.run_lock(path) as acquired_again:
+            assert not acquired_again
+
+    # The owner is cleared, and the lock can be taken again
+    assert tmpdir.join('dcgc.lock').read() == ''
+    with lock.run_lock(path) as acquired:
+        assert acquired
+
+
+def test_run_lock_stale_owner(tmpdir):
+    lock_file = tmpdir.join('dcgc.lock')
+    lock_file.write(json.dumps({
+        'pid': 123, 'host': 'other', 'started': '2014-01-01'}))
+    with mock.patch('docker_custodian.lock.log', autospec=True) as mock_log:
+        with lock.run_lock(str(lock_file)) as acquired:
+            assert acquired
+    mock_log.info.assert_called_once_with(
+        "Taking over the lock %s from a run which did not finish "
+        "(pid 123 on other, started 2014-01-01)" % lock_file)
+
+
+def test_run_lock_without_path():
+    with lock.run_lock(None) as acquired:
+        assert acquired
@@ -0,0 +1,171 @@
+import gzip
+import os
+
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import log_archive
+
+
+@pytest.fixture
+def log_file(tmpdir):
+    path = tmpdir.join('aaaa-json.log')
+    path.write('{"log":"hello\\n"}\n')
+    return str(path)
+
+
+@pytest.fixture
+def archive_dir(tmpdir):
+    return str(tmpdir.join('archive'))
+
+
+def inspected(container_id, labels=None, log_path=None):
+    return {
+        'Id': container_id,
+        'Name': '/name-' + container_id,
+        'Created': '2013-12-20T17:00:00Z',
+        'State': {'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'},
+        'Config': {'Labels': labels or {}},
+        'LogPath': log_path,
+    }
+
+
+def read_archive(archive_dir, container_id):
+    path = os.path.join(
+        archive_dir, 'name-%s-%s.log.gz' % (container_id, container_id))
+    with gzip.open(path, 'rb') as archive:
+        return archive.read()
+
+
+def test_archive_logs_from_log_file(mock_client, log_file, archive_dir):
+    container = inspected('aaaa', log_path=log_file)
+    os.makedirs(archive_dir)
+    log_archive.archive_logs(
+        mock_client,
+        container,
+        log_archive.get_archive_path(archive_dir, container),
+    )
+    assert read_archive(archive_dir, 'aaaa') == b'{"log":"hello\\n"}\n'
+    assert not mock_client.logs.mock_calls
+
+
+def test_archive_logs_rotated_streams_from_api(
+    mock_client,
+    log_file,
+    archive_dir,
+):
+    with open(log_file + '.1', 'w') as rotated:
+        rotated.write('older\n')
+    mock_client.logs.return_value = iter([b'one\n', b'two\n'])
+    container = inspected('aaaa', log_path=log_file)
+    os.makedirs(archive_dir)
+    log_archive.archive_logs(
+        mock_client,
+        container,
+        log_archive.get_archive_path(archive_dir, container),
+    )
+    assert read_archive(archive_dir, 'aaaa') == b'one\ntwo\n'
+    mock_client.logs.assert_called_once_with(
+        container='aaaa', stdout=True, stderr=True, stream=True,
+        timestamps=True)
+
+
+def test_archive_logs_failure_leaves_no_archive(mock_client, archive_dir):
+    def logs(**kwargs):
+        yield b'partial'
+        raise IOError("connection reset")
+    mock_client.logs.side_effect = logs
+    container = inspected('aaaa')
+    os.makedirs(archive_dir)
+    with pytest.raises(IOError):
+        log_archive.archive_logs(
+            mock_client,
+            container,
+            log_archive.get_archive_path(archive_dir, container),
+        )
+    assert os.listdir(archive_dir) == []
+
+
+def test_wants():
+    archiver = log_archive.LogArchiver(
+        None, 'archive', docker_gc.format_exclude_labels(['audit=true']))
+    assert archiver.wants(inspected('aaaa', labels={'audit': 'true'}))
+    assert not archiver.wants(inspected('aaaa', labels={'audit': 'no'}))
+    assert not archiver.wants({'Id': 'aaaa', 'Config': {}})
+    assert log_archive.LogArchiver(None, 'archive').wants(inspected('aaaa'))
+
+
+def test_cleanup_containers_archives_before_removal(
+    mock_client,
+    archive_dir,
+    now,
+):
+    mock_client.containers.return_value = [
+        {'Id': 'aaaa', 'Labels': {}},
+        {'Id': 'bbbb', 'Labels': {}},
+        {'Id': 'cccc', 'Labels': {}},
+    ]
+    labels = {
+        'aaaa': {'audit': 'true'},
+        'bbbb': {},
+        'cccc': {'audit': 'true'},
+    }
+    mock_client.inspect_container.side_effect = lambda container: inspected(
+        container, labels=labels[container])
+
+    def logs(container, **kwargs):
+        if container == 'cccc':
+            raise IOError("no logs")
+        assert container not in removed
+        return iter([b'logs of ' + container.encode('ascii')])
+    mock_client.logs.side_effect = logs
+    removed = []
+    mock_client.remove_container.side_effect = \
+        lambda container, v: removed.append(container)
+    results = []
+
+    archiver = log_archive.LogArchiver(
+        mock_client,
+        archive_dir,
+        docker_gc.format_exclude_labels(['audit']),
+        workers=2,
+    )
+    assert docker_gc.cleanup_containers(
+        mock_client,
+        now,
+        False,
+        [],
+        sink=results.append,
+        archive=archiver,
+    ) == {'aaaa', 'bbbb'}
+
+    assert sorted(removed) == ['aaaa', 'bbbb']
+    assert read_archive(archive_dir, 'aaaa') == b'logs of aaaa'
+    assert os.listdir(archive_dir) == ['name-aaaa-aaaa.log.gz']
+    failed = [result for result in results if not result.ok]
+    assert [result.id for result in failed] == ['cccc']
+
+
+def test_cleanup_containers_archive_dry_run(mock_client, archive_dir, now):
+    mock_client.containers.return_value = [{'Id': 'aaaa', 'Labels': {}}]
+    mock_client.inspect_container.return_value = inspected('aaaa')
+    docker_gc.cleanup_containers(
+        mock_client,
+        now,
+        True,
+        [],
+        archive=log_archive.LogArchiver(mock_client, archive_dir),
+    )
+    assert not mock_client.logs.mock_calls
+    assert not os.path.exists(archive_dir)
+
+
+def test_get_args_archive_logs():
+    args = docker_gc.get_args(args=[
+        '--max-container-age', '1d',
+        '--archive-logs', '/archive',
+        '--archive-label', 'audit',
+    ])
+    assert args.archive_logs == '/archive'
+    assert args.archive_label == ['audit']
+    assert args.archive_workers == 4
@@ -0,0 +1,122 @@
+import io
+import json
+import logging
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import log_output
+
+
+def make_record(msg, *args, **kwargs):
+    level = kwargs.pop('level', logging.INFO)
+    record = logging.LogRecord(
+        'docker_custodian.docker_gc', level, __file__, 1, msg, args, None)
+    for key, value in kwargs.items():
+        setattr(record, key, value)
+    return record
+
+
+def object_record(kind='container', action='remove', object_id='abcd'):
+    return make_record(
+        "Removing %s %s", kind, object_id,
+        **log_output.object_extra(kind, action, object_id))
+
+
+def test_object_extra():
+    assert log_output.object_extra('image', 'remove', 'abcd', size=3) == {
+        'object': {'kind': 'image', 'action': 'remove', 'id': 'abcd', 'size': 3},
+    }
+
+
+def test_lazy_format_is_only_called_when_formatted():
+    func = mock.Mock(return_value='formatted')
+    lazy = log_output.LazyFormat(func, 1, 2)
+    assert not func.mock_calls
+    assert make_record("image %s", lazy).getMessage() == 'image formatted'
+    func.assert_called_once_with(1, 2)
+
+
+def test_json_formatter():
+    line = log_output.JsonFormatter().format(object_record())
+    event = json.loads(line)
+    assert event['message'] == 'Removing container abcd'
+    assert event['level'] == 'INFO'
+    assert event['logger'] == 'docker_custodian.docker_gc'
+    assert event['object'] == {
+        'kind': 'container', 'action': 'remove', 'id': 'abcd'}
+    assert 'summary' not in event
+
+
+def test_object_counter_samples_object_lines():
+    counter = log_output.ObjectCounter(sample=3)
+    passed = [counter.filter(object_record()) for _ in range(7)]
+    assert passed == [True, False, False, True, False, False, True]
+    assert counter.filter(make_record("Getting all containers"))
+    assert counter.filter(make_record("Failed", level=logging.WARNING))
+    assert counter.take() == {'remove container': 7, 'warnings': 1}
+    assert counter.take() == {}
+
+
+@pytest.mark.parametrize('counts,expected', [
+    ({}, ''),
+    ({'remove image': 2, 'warnings': 1}, ' (remove image: 2, warnings: 1)'),
+])
+def test_format_counts(counts, expected):
+    assert log_output.format_counts(counts) == expected
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    level = root.level
+    yield root
+    root.setLevel(level)
+    log_output.object_counter.sample = 1
+
+
+def test_configure_logging_json(root_logger):
+    args = mock.Mock(log_format='json', log_level='INFO', log_sample=2)
+    stream = io.StringIO()
+    with mock.patch.object(root_logger, 'handlers', []):
+        listener = log_output.configure_logging(args, stream=stream)
+        with docker_gc.log_duration('volumes'):
+            for name in ('one', 'two', 'three'):
+                docker_gc.remove_volume(mock.Mock(), {'Name': name}, True)
+        listener.stop()
+
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [event['message'] for event in events[:-1]] == [
+        'Removing volume one',
+        'Removing volume three',
+    ]
+    summary = events[-1]
+    assert summary['message'].startswith('Finished volumes in ')
+    assert summary['message'].endswith(' (remove volume: 3)')
+    assert summary['summary']['phase'] == 'volumes'
+    assert summary['summary']['counts'] == {'remove volume': 3}
+
+
+def test_configure_logging_level(root_logger):
+    args = mock.Mock(log_format='text', log_level='WARNING', log_sample=1)
+    stream = io.StringIO()
+    with mock.patch.object(root_logger, 'handlers', []):
+        listener = log_output.configure_logging(args, stream=stream)
+        logging.getLogger('docker_custodian').info("Not written")
+        logging.getLogger('docker_custodian').warning("Written")
+        listener.stop()
+    assert stream.getvalue() == 'Written\n'
+
+
+def test_configure_logging_already_configured():
+    root = logging.getLogger()
+    handler = logging.NullHandler()
+    root.addHandler(handler)
+    try:
+        assert log_output.configure_logging(mock.Mock()) is None
+    finally:
+        root.removeHandler(handler)
@@ -0,0 +1,131 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import docker.errors
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import oracle
+from docker_custodian.args import datetime_seconds_ago
+
+
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def options():
+    return (
+        datetime_seconds_ago(7 * DAY),
+        datetime_seconds_ago(30 * DAY),
+        docker_gc.format_exclude_labels(['keep', 'team=ci']),
+        {'user/repo1:*'},
+    )
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_paths_agree_with_reference(seed, options):
+    snapshot = oracle.synthetic_snapshot(400, 200, seed=seed)
+    reference, divergences = oracle.verify_snapshot(snapshot, *options)
+    assert reference.containers and reference.images
+    expected_paths = {'phases', 'pipeline', 'plan', 'inventory'}
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        expected_paths.remove('inventory')
+    assert set(divergences) == expected_paths
+    assert divergences == {path: [] for path in expected_paths}
+
+
+def test_divergence_is_reported(options):
+    snapshot = oracle.synthetic_snapshot(100, 50, seed=1)
+
+    def ignores_excludes(snapshot, max_container_age, max_image_age, *_):
+        return oracle.reference_decisions(
+            snapshot, max_container_age, max_image_age, [], set())
+
+    reference, divergences = oracle.verify_snapshot(
+        snapshot, *options, paths=[('broken', ignores_excludes)])
+    assert divergences['broken']
+    assert all(
+        not divergence.reference and divergence.path == 'broken'
+        for divergence in divergences['broken']
+    )
+
+
+def test_compare():
+    reference = oracle.Decisions({'a', 'b'}, {'i'})
+    decisions = oracle.Decisions({'b', 'c'}, {'i'})
+    assert oracle.compare('path', reference, decisions) == [
+        oracle.Divergence('path', 'container', 'a', True),
+        oracle.Divergence('path', 'container', 'c', False),
+    ]
+
+
+def test_simulated_backend():
+    snapshot = oracle.Snapshot(
+        '1.41',
+        [{'Id': 'c', 'ImageID': 'sha256:used'}],
+        {'c': {'Id': 'c'}},
+        [
+            {'Id': 'sha256:used', 'RepoTags': ['user/used:1']},
+            {'Id': 'sha256:two', 'RepoTags': ['user/two:1', 'user/two:2']},
+        ],
+        {},
+    )
+    backend = oracle.SimulatedBackend(snapshot)
+
+    with pytest.raises(docker.errors.APIError):
+        backend.remove_image(image='sha256:used')
+    with pytest.raises(docker.errors.APIError):
+        backend.remove_image(image='sha256:two')
+    backend.remove_image(image='user/two:1')
+    assert [image['RepoTags'] for image in backend.images()] == [
+        ['user/used:1'], ['user/two:2']]
+    backend.remove_image(image='user/two:2')
+
+    backend.remove_container(container='c')
+    with pytest.raises(docker.errors.NotFound):
+        backend.inspect_container(container='c')
+    backend.remove_image(image='user/used:1')
+    assert backend.images() == []
+    # The snapshot is not changed
+    assert len(snapshot.images) == 2
+
+
+def test_verify_lists_the_host_once():
+    snapshot = oracle.synthetic_snapshot(50, 20, seed=3)
+    client = mock.Mock(wraps=oracle.SimulatedBackend(snapshot))
+    client._version = '1.41'
+    args = docker_gc.get_args(args=[
+        '--max-container-age', '7days',
+        '--max-image-age', '30days',
+        '--verify-against-reference',
+    ])
+
+    assert docker_gc.run(client, args) is None
+    client.containers.assert_called_once_with(all=True)
+    client.images.assert_called_once_with()
+    assert client.inspect_container.call_count == 50
+    assert client.inspect_image.call_count == 20
+    assert not client.remove_container.mock_calls
+    assert not client.remove_image.mock_calls
+
+
+def test_main_exits_with_divergences(mock_client):
+    args = docker_gc.get_args(args=[
+        '--max-container-age', '7days',
+        '--verify-against-reference',
+    ])
+    divergence = oracle.Divergence('pipeline', 'container', 'abcd', True)
+    with mock.patch(
+            'docker_custodian.docker_gc.get_args', return_value=args), \
+            mock.patch(
+                'docker_custodian.docker_gc.client_from_args',
+                return_value=mock_client), \
+            mock.patch(
+                'docker_custodian.oracle.verify',
+                return_value=[divergence]):
+        with pytest.raises(SystemExit) as exc_info:
+            docker_gc.main()
+    assert exc_info.value.code == 1
@@ -0,0 +1,180 @@
+import os
+
+import docker.errors
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import orphans
+
+
+OLD = 1000000000
+NOW = OLD + 2 * orphans.MIN_AGE_SECONDS
+
+
+def graph_driver(root, layer, lower=()):
+    overlay = os.path.join(root, 'overlay2')
+    return {
+        'Name': 'overlay2',
+        'Data': {
+            'LowerDir': ':'.join(
+                os.path.join(overlay, name, 'diff') for name in lower),
+            'UpperDir': os.path.join(overlay, layer, 'diff'),
+            'WorkDir': os.path.join(overlay, layer, 'work'),
+        },
+    }
+
+
+def make_dir(root, *names, **files):
+    path = root.join(*names)
+    path.ensure(dir=True)
+    for name, size in files.items():
+        path.join(name).write('x' * size)
+    return path
+
+
+@pytest.fixture
+def data_root(tmpdir):
+    """A data root with a container and an image which dockerd knows about,
+    and an orphan of each kind.
+    """
+    root = tmpdir.join('docker')
+    make_dir(root, 'containers', 'c1')
+    make_dir(root, 'containers', 'gone', **{'gone-json.log': 100})
+    make_dir(root, 'overlay2', 'l')
+    make_dir(root, 'overlay2', 'base', 'diff', a=10)
+    make_dir(root, 'overlay2', 'c1layer', 'diff')
+    make_dir(root, 'overlay2', 'c1layer-init', 'diff')
+    orphan = make_dir(root, 'overlay2', 'orphan', 'diff', b=20, c=30)
+    os.link(str(orphan.join('b')), str(orphan.join('b-link')))
+    for path in root.visit():
+        os.utime(str(path), (OLD, OLD))
+    # Changed while scanning, so not an orphan yet
+    make_dir(root, 'overlay2', 'new', 'diff')
+    return str(root)
+
+
+@pytest.fixture
+def docker_host(mock_client, data_root):
+    mock_client.containers.return_value = [{'Id': 'c1'}]
+    mock_client.images.return_value = [{'Id': 'sha256:1'}]
+    mock_client.inspect_container.return_value = {
+        'Id': 'c1',
+        'GraphDriver': graph_driver(
+            data_root, 'c1layer', lower=['c1layer-init', 'base']),
+    }
+    mock_client.inspect_image.return_value = {
+        'Id': 'sha256:1',
+        'GraphDriver': graph_driver(data_root, 'base'),
+    }
+    mock_client.df.return_value = {'BuildCache': []}
+    mock_client.info.return_value = {
+        'DockerRootDir': data_root,
+        'Driver': 'overlay2',
+    }
+    return mock_client
+
+
+def test_graph_driver_layers(data_root):
+    data = {'GraphDriver': graph_driver(
+        data_root, 'top', lower=['one', 'two'])}
+    assert orphans.graph_driver_layers(data) == {'top', 'one', 'two'}
+    assert orphans.graph_driver_layers({'GraphDriver': {'Name': 'btrfs'}}) \
+        == set()
+
+
+def test_tree_size_counts_hard_links_once(data_root):
+    path = os.path.join(data_root, 'overlay2', 'orphan')
+    assert orphans.tree_size(path) == 50
+
+
+def test_scan_orphans(docker_host, data_root):
+    found = orphans.scan_orphans(docker_host, data_root, now=NOW)
+    assert [(orphan.kind, orphan.name) for orphan in found] == [
+        ('container', 'gone'),
+        ('layer', 'orphan'),
+    ]
+    docker_host.images.assert_called_once_with(all=True)
+    # Nothing is moved without a quarantine directory
+    assert os.path.isdir(os.path.join(data_root, 'overlay2', 'orphan'))
+
+
+def test_scan_orphans_incomplete(docker_host, data_root):
+    docker_host.inspect_image.side_effect = docker.errors.APIError('boom')
+    found = orphans.scan_orphans(docker_host, data_root, now=NOW)
+    assert [orphan.name for orphan in found] == ['gone']
+
+
+def test_scan_orphans_quarantine(docker_host, data_root, tmpdir):
+    quarantine_dir = str(tmpdir.join('quarantine'))
+    results = []
+    orphans.scan_orphans(
+        docker_host,
+        data_root,
+        quarantine_dir=quarantine_dir,
+        now=NOW,
+        sink=results.append,
+    )
+    assert sorted(os.listdir(quarantine_dir)) == ['container', 'layer']
+    assert os.listdir(os.path.join(quarantine_dir, 'layer')) == ['orphan']
+    assert not os.path.exists(os.path.join(data_root, 'overlay2', 'orphan'))
+    assert all(result.ok for result in results)
+    assert len(results) == 2
+
+
+def test_scan_orphans_quarantine_with_build_cache(
+    docker_host,
+    data_root,
+    tmpdir,
+):
+    docker_host.df.return_value = {'BuildCache': [{'ID': 'x'}]}
+    quarantine_dir = str(tmpdir.join('quarantine'))
+    orphans.scan_orphans(
+        docker_host, data_root, quarantine_dir=quarantine_dir, now=NOW)
+    assert os.listdir(quarantine_dir) == ['container']
+    assert os.path.exists(os.path.join(data_root, 'overlay2', 'orphan'))
+
+
+@pytest.mark.parametrize('info', [
+    {'DockerRootDir': '/var/lib/docker'},
+    {'DockerRootDir': None},
+    {'Driver': 'btrfs'},
+])
+def test_scan_orphans_quarantine_other_daemon(
+    docker_host,
+    data_root,
+    tmpdir,
+    info,
+):
+    docker_host.info.return_value.update(info)
+    quarantine_dir = str(tmpdir.join('quarantine'))
+    found = orphans.scan_orphans(
+        docker_host, data_root, quarantine_dir=quarantine_dir, now=NOW)
+    assert len(found) == 2
+    assert not os.path.exists(quarantine_dir)
+    assert os.path.exists(os.path.join(data_root, 'overlay2', 'orphan'))
+
+
+def test_scan_orphans_quarantine_info_error(docker_host, data_root, tmpdir):
+    docker_host.info.side_effect = docker.errors.APIError('boom')
+    quarantine_dir = str(tmpdir.join('quarantine'))
+    orphans.scan_orphans(
+        docker_host, data_root, quarantine_dir=quarantine_dir, now=NOW)
+    assert not os.path.exists(quarantine_dir)
+
+
+def test_scan_orphans_quarantine_dry_run(docker_host, data_root, tmpdir):
+    quarantine_dir = str(tmpdir.join('quarantine'))
+    orphans.scan_orphans(
+        docker_host,
+        data_root,
+        quarantine_dir=quarantine_dir,
+        dry_run=True,
+        now=NOW,
+    )
+    assert not os.path.exists(quarantine_dir)
+
+
+def test_get_args_scan_orphans():
+    args = docker_gc.get_args(args=['--scan-orphans', '/var/lib/docker'])
+    assert args.scan_orphans == '/var/lib/docker'
+    assert docker_gc.has_work(args)
@@ -0,0 +1,130 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import pipeline
+
+
+@pytest.fixture
+def host(mock_client):
+    calls = []
+    mock_client.containers.return_value = [
+        {'Id': 'old1', 'ImageID': 'sha256:a', 'Labels': {}},
+        {'Id': 'old2', 'ImageID': 'sha256:a', 'Labels': {}},
+        {'Id': 'new', 'ImageID': 'sha256:b', 'Labels': {}},
+    ]
+    mock_client.images.return_value = [
+        {'Id': 'sha256:a', 'RepoTags': ['user/a:latest']},
+        {'Id': 'sha256:b', 'RepoTags': ['user/b:latest']},
+        {'Id': 'sha256:c', 'RepoTags': ['user/c:latest']},
+        {'Id': 'sha256:d', 'RepoTags': ['user/keep:latest']},
+    ]
+
+    def inspect_container(container):
+        finished = '2014-01-20T10:00:00Z' if container == 'new' else \
+            '2014-01-01T01:01:01Z'
+        return {
+            'Id': container,
+            'Name': '/' + container,
+            'Created': '2013-12-20T17:00:00Z',
+            'State': {'Running': False, 'FinishedAt': finished},
+        }
+    mock_client.inspect_container.side_effect = inspect_container
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-01T01:01:01Z',
+    }
+    mock_client.remove_container.side_effect = \
+        lambda container, v: calls.append(('container', container))
+    mock_client.remove_image.side_effect = \
+        lambda image, **kwargs: calls.append(('image', image))
+    mock_client.volumes.return_value = {'Volumes': [{'Name': 'vol'}]}
+    mock_client.remove_volume.side_effect = \
+        lambda name: calls.append(('volume', name))
+    mock_client.calls = calls
+    return mock_client
+
+
+def get_args(*extra):
+    return docker_gc.get_args(args=[
+        '--max-container-age', '7days',
+        '--max-image-age', '7days',
+        '--exclude-image', 'user/keep:*',
+        '--pipeline',
+    ] + list(extra))
+
+
+def test_run_pipelined(host, now):
+    args = get_args('--dangling-volumes')
+    args.max_container_age = args.max_image_age = now.replace(day=10)
+    results = []
+    docker_gc.run(host, args, sink=results.append)
+
+    calls = host.calls
+    assert sorted(calls) == [
+        ('container', 'old1'),
+        ('container', 'old2'),
+        ('image', 'user/a:latest'),
+        ('image', 'user/c:latest'),
+        ('volume', 'vol'),
+    ]
+    # An image is only removed after the last container using it
+    assert calls.index(('image', 'user/a:latest')) > max(
+        calls.index(('container', 'old1')),
+        calls.index(('container', 'old2')))
+    assert len(results) == 5
+    # Containers and images are listed once
+    host.containers.assert_called_once_with(all=True)
+    host.images.assert_called_once_with()
+
+
+def test_run_pipelined_dry_run(host, now):
+    args = get_args('--dry-run')
+    args.max_container_age = args.max_image_age = now.replace(day=10)
+    results = []
+    docker_gc.run(host, args, sink=results.append)
+
+    assert host.calls == []
+    assert sorted((result.kind, result.id) for result in results) == [
+        ('container', 'old1'),
+        ('container', 'old2'),
+        ('image', 'sha256:a'),
+        ('image', 'sha256:c'),
+    ]
+
+
+def test_image_queue_frees_image_once():
+    executor = mock.Mock()
+    queue = pipeline.ImageQueue(
+        executor,
+        [{'Id': 'a'}, {'Id': 'b'}],
+        [{'Id': 'one', 'ImageID': 'a'}, {'Id': 'two', 'ImageID': 'a'}],
+        remove=mock.sentinel.remove,
+    )
+    queue.start()
+    executor.submit.assert_called_once_with(mock.sentinel.remove, {'Id': 'b'})
+
+    queue.container_removed('one')
+    assert executor.submit.call_count == 1
+    queue.container_removed('two')
+    executor.submit.assert_called_with(mock.sentinel.remove, {'Id': 'a'})
+    queue.container_removed('two')
+    assert executor.submit.call_count == 2
+
+
+@pytest.mark.parametrize('extra,expected', [
+    ([], True),
+    (['--keep-last', '3'], False),
+    (['--report-reclaimable'], False),
+])
+def test_can_pipeline(mock_client, extra, expected):
+    args = get_args(*extra)
+    assert pipeline.can_pipeline(mock_client, args, None) == expected
+
+
+def test_can_pipeline_needs_images(mock_client):
+    args = docker_gc.get_args(args=['--max-container-age', '1d'])
+    assert not pipeline.can_pipeline(mock_client, args, None)
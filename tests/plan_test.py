@@ -0,0 +1,194 @@
+from six import StringIO
+import collections
+import logging
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import docker.errors
+import pytest
+
+from docker_custodian import plan
+
+
+@pytest.fixture
+def inventory(mock_client):
+    mock_client.containers.return_value = [
+        {'Id': 'aaaa', 'ImageID': '1', 'State': 'exited', 'Labels': {}},
+        {'Id': 'bbbb', 'ImageID': '2', 'State': 'running', 'Labels': {}},
+    ]
+    mock_client.inspect_container.side_effect = lambda container: {
+        'aaaa': {
+            'Id': 'aaaa',
+            'Name': '/old',
+            'Created': '2013-12-20T17:00:00Z',
+            'State': {
+                'Running': False,
+                'FinishedAt': '2014-01-01T01:01:01Z',
+            },
+        },
+        'bbbb': {
+            'Id': 'bbbb',
+            'Name': '/running',
+            'Created': '2013-12-20T17:00:00Z',
+            'State': {
+                'Running': True,
+                'FinishedAt': '2014-01-01T01:01:01Z',
+            },
+        },
+    }[container]
+    mock_client.images.return_value = [
+        {'Id': '1', 'RepoTags': ['user/one:latest']},
+        {'Id': '2', 'RepoTags': ['user/two:latest']},
+        {'Id': '3', 'RepoTags': ['<none>:<none>']},
+    ]
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-01T01:01:01Z',
+    }
+    mock_client.volumes.return_value = {'Volumes': [{'Name': 'vol'}]}
+    return mock_client
+
+
+def test_build_plan(inventory, now):
+    result = plan.build_plan(inventory, now, now, True, [], set())
+
+    assert result['containers'] == [{
+        'id': 'aaaa',
+        'name': 'old',
+        'reason': 'finished',
+        'timestamp': '2014-01-01T01:01:01Z',
+    }]
+    # Image 1 is only used by a container which is planned for removal
+    assert [entry['id'] for entry in result['images']] == ['3', '1']
+    assert result['volumes'] == [{'name': 'vol', 'reason': 'dangling'}]
+    assert not inventory.remove_container.mock_calls
+    assert not inventory.remove_image.mock_calls
+    assert not inventory.remove_volume.mock_calls
+
+
+def test_build_plan_only_requested_phases(inventory, now):
+    result = plan.build_plan(inventory, now, None, False, [], set())
+    assert len(result['containers']) == 1
+    assert result['images'] == []
+    assert result['volumes'] == []
+
+
+def test_build_plan_object_log_lines(inventory, now, caplog):
+    caplog.set_level(logging.INFO, logger=plan.log.name)
+    to_apply = plan.build_plan(inventory, now, now, True, [], set())
+    inventory.containers.return_value = []
+    plan.apply_plan(inventory, to_apply, True)
+
+    assert collections.Counter(
+        '%(action)s %(kind)s' % record.object
+        for record in caplog.records
+    ) == {
+        'plan container': 1,
+        'plan image': 2,
+        'plan volume': 1,
+        'skip container': 1,
+        'remove image': 2,
+        'remove volume': 1,
+    }
+
+
+def test_write_and_read_plan(inventory, now):
+    plan_file = StringIO()
+    original = plan.build_plan(inventory, now, now, True, [], set())
+    plan.write_plan(original, plan_file)
+    plan_file.seek(0)
+    assert plan.read_plan(plan_file) == original
+
+
+def test_read_plan_unsupported_version():
+    with pytest.raises(ValueError):
+        plan.read_plan(StringIO('{"version": 0}'))
+
+
+def test_container_removal_reason_never_started(container):
+    container['State']['FinishedAt'] = plan.YEAR_ZERO
+    assert plan.container_removal_reason(container) == (
+        'never-started', container['Created'])
+
+
+def test_apply_plan(inventory, now):
+    to_apply = plan.build_plan(inventory, now, now, True, [], set())
+    inventory.inspect_container.reset_mock()
+    inventory.inspect_image.reset_mock()
+    inventory.containers.side_effect = [
+        inventory.containers.return_value,
+        [inventory.containers.return_value[1]],
+    ]
+
+    plan.apply_plan(inventory, to_apply, False)
+
+    assert not inventory.inspect_container.mock_calls
+    assert not inventory.inspect_image.mock_calls
+    inventory.remove_container.assert_called_once_with(
+        container='aaaa', v=True)
+    assert inventory.remove_image.mock_calls == [
+        mock.call(image='3'),
+        mock.call(image='user/one:latest'),
+    ]
+    inventory.remove_volume.assert_called_once_with(name='vol')
+
+
+def test_apply_plan_skips_containers_started_since(inventory, now):
+    to_apply = plan.build_plan(inventory, now, None, False, [], set())
+    inventory.events.return_value = iter([
+        {'Type': 'container', 'Action': 'start', 'id': 'aaaa'},
+    ])
+
+    plan.apply_plan(inventory, to_apply, False)
+
+    assert not inventory.remove_container.mock_calls
+    _, kwargs = inventory.events.call_args
+    assert kwargs['filters'] == {'type': 'container', 'event': ['start']}
+    assert kwargs['since'] == int(
+        plan.parse_date(to_apply['created']).timestamp())
+
+
+def test_apply_plan_events_error(inventory, now):
+    to_apply = plan.build_plan(inventory, now, None, False, [], set())
+    inventory.events.side_effect = docker.errors.APIError('boom')
+
+    plan.apply_plan(inventory, to_apply, False)
+
+    assert not inventory.remove_container.mock_calls
+
+
+def test_apply_plan_revalidates(inventory):
+    to_apply = {
+        'version': plan.PLAN_VERSION,
+        'exclude_images': ['user/one:*'],
+        'containers': [
+            {'id': 'bbbb', 'name': 'running', 'timestamp': None},
+            {'id': 'gone', 'name': 'gone', 'timestamp': None},
+        ],
+        'images': [{'id': '1'}, {'id': '2'}, {'id': 'gone'}],
+        'volumes': [{'name': 'in-use'}],
+    }
+    inventory.containers.return_value = [
+        {'Id': 'bbbb', 'ImageID': '2', 'State': 'running'},
+    ]
+
+    plan.apply_plan(inventory, to_apply, False)
+
+    assert not inventory.remove_container.mock_calls
+    assert not inventory.remove_image.mock_calls
+    assert not inventory.remove_volume.mock_calls
+
+
+def test_apply_plan_dry_run(inventory, now):
+    to_apply = plan.build_plan(inventory, now, now, True, [], set())
+    plan.apply_plan(inventory, to_apply, True)
+    assert not inventory.remove_container.mock_calls
+    assert not inventory.remove_image.mock_calls
+    assert not inventory.remove_volume.mock_calls
+
+
+def test_is_running_old_api():
+    assert plan.is_running({'Status': 'Up 2 hours'})
+    assert not plan.is_running({'Status': 'Exited (0) 2 hours ago'})
@@ -0,0 +1,172 @@
+import json
+
+from six import StringIO
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import docker_gc
+from docker_custodian import policy
+
+
+@pytest.fixture
+def raw_policy():
+    return {
+        'containers': [
+            {'labels': ['keep'], 'action': 'keep'},
+            {'labels': ['project=ci-*'], 'max_age': '2h'},
+            {'images': ['user/service:*'], 'max_age': '3d'},
+            {'max_age': '7d'},
+        ],
+        'images': [
+            {'tags': ['user/base:*'], 'action': 'keep'},
+            {'tags': ['ci/*', 'tmp/*'], 'max_age': '2d'},
+            {'max_age': '30d'},
+        ],
+    }
+
+
+@pytest.fixture
+def compiled(raw_policy, now):
+    with mock.patch(
+        'docker_custodian.policy.datetime_seconds_ago',
+        side_effect=lambda seconds: seconds,
+    ):
+        return policy.compile_policy(raw_policy)
+
+
+@pytest.mark.parametrize('summary,expected', [
+    ({'Labels': {'keep': ''}, 'Image': 'user/service:1'}, None),
+    ({'Labels': {'project': 'ci-123'}, 'Image': 'other'}, 2 * 3600),
+    ({'Labels': {'project': 'prod'}, 'Image': 'user/service:1'}, 3 * 86400),
+    ({'Labels': None, 'Image': 'other'}, 7 * 86400),
+])
+def test_container_min_date(compiled, summary, expected):
+    assert compiled.container_min_date(summary) == expected
+
+
+def test_container_decisions_are_cached(compiled):
+    summary = {'Labels': {'project': 'ci-1'}, 'Image': 'other'}
+    with mock.patch.object(
+        compiled,
+        '_first_container_rule',
+        wraps=compiled._first_container_rule,
+    ) as mock_first_rule:
+        for _ in range(3):
+            compiled.container_min_date(dict(summary))
+    assert mock_first_rule.call_count == 1
+
+
+@pytest.mark.parametrize('summary,expected', [
+    ({'RepoTags': ['user/base:latest', 'ci/app:1']}, None),
+    ({'RepoTags': ['tmp/thing:1']}, 2 * 86400),
+    ({'RepoTags': ['<none>:<none>']}, 30 * 86400),
+    ({}, 30 * 86400),
+])
+def test_image_min_date(compiled, summary, expected):
+    assert compiled.image_min_date(summary) == expected
+
+
+def test_no_matching_rule_keeps():
+    empty = policy.compile_policy({'containers': [
+        {'labels': ['a'], 'max_age': '1d'},
+    ]})
+    assert empty.container_min_date({'Labels': {'b': ''}}) is None
+    assert empty.image_min_date({'RepoTags': ['a:1']}) is None
+
+
+def test_max_ages_used_without_rules(now):
+    only_images = policy.compile_policy(
+        {'images': [{'tags': ['ci/*'], 'max_age': '1d'}]},
+        max_container_age=now,
+        max_image_age=now,
+    )
+    assert only_images.container_min_date({'Labels': None}) == now
+    assert only_images.image_min_date({'RepoTags': ['other:1']}) is None
+
+
+def test_cleanup_containers_policy_without_container_rules(mock_client, now):
+    mock_client.containers.return_value = [{'Id': 'abcd', 'Labels': None}]
+    mock_client.inspect_container.return_value = {
+        'Id': 'abcd',
+        'State': {'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'},
+    }
+    rules = policy.load_policy(
+        StringIO(json.dumps({'images': [{'max_age': '1d'}]})),
+        max_container_age=now,
+    )
+    docker_gc.cleanup_containers(mock_client, now, False, [], policy=rules)
+    mock_client.remove_container.assert_called_once_with(
+        container='abcd', v=True)
+
+
+@pytest.mark.parametrize('raw_policy', [
+    {'volumes': []},
+    {'containers': [{'labels': ['a']}]},
+    {'containers': [{'max_age': '1d', 'tags': ['a']}]},
+    {'images': [{'max_age': '1d', 'action': 'delete'}]},
+    {'images': [{'max_age': 'soon'}]},
+])
+def test_compile_policy_invalid(raw_policy):
+    with pytest.raises(ValueError):
+        policy.compile_policy(raw_policy)
+
+
+def test_load_policy_json(raw_policy):
+    loaded = policy.load_policy(StringIO(json.dumps(raw_policy)))
+    assert len(loaded.container_rules) == 4
+    assert len(loaded.image_rules) == 3
+
+
+def test_cleanup_containers_with_policy(mock_client, now):
+    mock_client.containers.return_value = [
+        {'Id': 'kept', 'Labels': {'keep': ''}, 'Image': 'a'},
+        {'Id': 'ci', 'Labels': {'project': 'ci-1'}, 'Image': 'a'},
+    ]
+    mock_client.inspect_container.return_value = {
+        'Id': 'ci',
+        'State': {'Running': False, 'FinishedAt': '2014-01-01T01:01:01Z'},
+    }
+    rules = policy.compile_policy({'containers': [
+        {'labels': ['keep'], 'action': 'keep'},
+        {'max_age': '1d'},
+    ]})
+    rules.container_rules[1] = rules.container_rules[1]._replace(min_date=now)
+
+    docker_gc.cleanup_containers(mock_client, None, False, [], policy=rules)
+
+    # The kept container is not even inspected
+    mock_client.inspect_container.assert_called_once_with(container='ci')
+    mock_client.remove_container.assert_called_once_with(
+        container='ci', v=True)
+
+
+def test_cleanup_images_with_policy(mock_client, now, later_time):
+    mock_client.containers.return_value = []
+    mock_client.images.return_value = [
+        {'Id': '1', 'RepoTags': ['user/base:1']},
+        {'Id': '2', 'RepoTags': ['ci/app:1']},
+        {'Id': '3', 'RepoTags': ['other:1']},
+    ]
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-10T01:01:01Z',
+    }
+    rules = policy.Policy([], [
+        policy.Rule([], None, policy.compile_patterns(['user/base:*']),
+                    None, policy.KEEP),
+        policy.Rule([], None, policy.compile_patterns(['ci/*']),
+                    now, policy.REMOVE),
+        policy.Rule([], None, None, later_time.replace(day=2),
+                    policy.REMOVE),
+    ])
+
+    docker_gc.cleanup_images(mock_client, None, False, set(), policy=rules)
+
+    assert mock_client.inspect_image.mock_calls == [
+        mock.call(image='3'),
+        mock.call(image='2'),
+    ]
+    mock_client.remove_image.assert_called_once_with(image='ci/app:1')
@@ -0,0 +1,173 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from docker_custodian import docker_gc
+from docker_custodian import reclaim
+
+
+def build_index():
+    # base <- app <- app-debug
+    #      \- other
+    index = reclaim.LayerIndex()
+    index.add('base', ['l1', 'l2'], 100, 100)
+    index.add('app', ['l1', 'l2', 'l3'], 150, 150)
+    index.add('app-debug', ['l1', 'l2', 'l3', 'l4'], 175, 150)
+    index.add('other', ['l1', 'l2', 'l5'], 120, 100)
+    index.add('scratch', [], 30, 0)
+    return index
+
+
+def test_reclaimable_leaf_image():
+    index = build_index()
+    assert index.reclaimable(['app-debug']) == 25
+    assert index.reclaimable(['other']) == 20
+
+
+def test_reclaimable_shared_layers_not_counted():
+    index = build_index()
+    # app-debug still uses the layers of app
+    assert index.reclaimable(['app']) == 0
+    assert index.reclaimable(['base']) == 0
+
+
+def test_reclaimable_chain_removed_together():
+    index = build_index()
+    assert index.reclaimable(['app', 'app-debug']) == 75
+    assert index.reclaimable(['base', 'app', 'app-debug', 'other']) == 195
+
+
+def test_reclaimable_standalone():
+    index = build_index()
+    assert index.reclaimable(['scratch', 'other']) == 50
+
+
+def test_reclaimable_branch_sized_from_shared_size():
+    # No image holds the common layers, only SharedSize gives their size
+    index = reclaim.LayerIndex()
+    index.add('one', ['l1', 'l2', 'a'], 100, 80)
+    index.add('two', ['l1', 'l2', 'b'], 90, 80)
+    assert index.reclaimable(['one']) == 20
+    assert index.reclaimable(['two']) == 10
+    assert index.reclaimable(['one', 'two']) == 110
+
+
+def test_reclaimable_branch_without_shared_size_under_estimates():
+    index = reclaim.LayerIndex()
+    index.add('one', ['l1', 'a'], 100)
+    index.add('two', ['l1', 'b'], 90)
+    assert index.reclaimable(['one']) == 10
+    assert index.reclaimable(['one', 'two']) == 100
+
+
+def test_reclaimable_after_add():
+    index = build_index()
+    assert index.reclaimable(['other']) == 20
+    index.add('other-child', ['l1', 'l2', 'l5', 'l6'], 130, 120)
+    assert index.reclaimable(['other']) == 0
+    assert index.reclaimable(['other', 'other-child']) == 30
+
+
+def test_reclaimable_many_images_is_fast():
+    index = reclaim.LayerIndex()
+    for i in range(50000):
+        layers = ['base', 'lib%d' % (i % 100), 'app%d' % i]
+        index.add('image%d' % i, layers, 300, 200)
+    ids = ['image%d' % i for i in range(0, 50000, 2)]
+    assert index.reclaimable(ids) == 25000 * 100
+
+
+def test_build_layer_index(mock_client):
+    images = [
+        {'Id': 'one', 'Size': 100, 'SharedSize': 80},
+        {'Id': 'two', 'Size': 90, 'SharedSize': 80},
+        {'Id': 'three', 'Size': 50, 'SharedSize': 0},
+    ]
+    mock_client.inspect_image.return_value = {
+        'Id': 'two',
+        'RootFS': {'Layers': ['l1', 'b']},
+    }
+    inspected = {'one': {'Id': 'one', 'RootFS': {'Layers': ['l1', 'a']}}}
+    mock_client.df.return_value = {'Images': []}
+
+    index = reclaim.build_layer_index(mock_client, images, inspected)
+
+    # Only the image which may share layers is inspected
+    mock_client.inspect_image.assert_called_once_with(image='two')
+    assert len(index) == 3
+    assert index.reclaimable(['one', 'three']) == 70
+
+
+def test_build_layer_index_shared_size_from_df(mock_client):
+    # The image listing of the daemon does not compute SharedSize
+    images = [
+        {'Id': 'one', 'Size': 100, 'SharedSize': -1},
+        {'Id': 'two', 'Size': 90, 'SharedSize': -1},
+        {'Id': 'three', 'Size': 50, 'SharedSize': -1},
+    ]
+    mock_client.df.return_value = {'Images': [
+        {'Id': 'one', 'SharedSize': 80},
+        {'Id': 'two', 'SharedSize': 80},
+        {'Id': 'three', 'SharedSize': 0},
+    ]}
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'RootFS': {'Layers': ['l1', image]},
+    }
+    inspected = {'one': {'Id': 'one', 'RootFS': {'Layers': ['l1', 'one']}}}
+
+    index = reclaim.build_layer_index(mock_client, images, inspected)
+
+    assert mock_client.inspect_image.mock_calls == [mock.call(image='two')]
+    assert index.reclaimable(['one', 'three']) == 70
+
+
+def test_build_layer_index_removed_images_share_nothing(mock_client):
+    images = [
+        {'Id': 'one', 'Size': 100, 'SharedSize': 0},
+        {'Id': 'two', 'Size': 90, 'SharedSize': 80},
+        {'Id': 'three', 'Size': 50, 'SharedSize': 80},
+    ]
+    inspected = {'one': {'Id': 'one', 'RootFS': {'Layers': ['a']}}}
+    mock_client.df.return_value = {'Images': []}
+
+    index = reclaim.build_layer_index(mock_client, images, inspected)
+
+    assert not mock_client.inspect_image.called
+    assert index.reclaimable(['one']) == 100
+
+
+def test_get_shared_sizes_from_image_listing(mock_client):
+    mock_client._version = '1.42'
+    mock_client._result.return_value = [{'Id': 'one', 'SharedSize': 80}]
+
+    assert reclaim.get_shared_sizes(mock_client) == {'one': 80}
+    mock_client._get.assert_called_once_with(
+        mock_client._url.return_value, params={'shared-size': 1})
+    assert not mock_client.df.called
+
+
+def test_cleanup_images_report_reclaimable(mock_client, now):
+    mock_client.containers.return_value = []
+    mock_client.images.return_value = [
+        {'Id': 'one', 'Size': 100, 'SharedSize': 0},
+        {'Id': 'two', 'Size': 90, 'SharedSize': 0},
+    ]
+    mock_client.inspect_image.side_effect = lambda image: {
+        'Id': image,
+        'Created': '2014-01-01T01:01:01Z',
+    }
+    with mock.patch('docker_custodian.docker_gc.log',
+                    autospec=True) as mock_log:
+        docker_gc.cleanup_images(
+            mock_client, now, False, set(), report_reclaimable=True)
+
+    mock_log.info.assert_any_call(
+        "Reclaimable space from 2 images: 190.0 B")
+    mock_log.info.assert_any_call(
+        "Reclaimed space from 2 images: 190.0 B")
+    assert mock_client.remove_image.mock_calls == [
+        mock.call(image='two'),
+        mock.call(image='one'),
+    ]
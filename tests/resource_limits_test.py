@@ -0,0 +1,124 @@
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import resource_limits
+from docker_custodian.resource_limits import ResourceLimits
+
+
+def make_stats(cpu_percent=0, cpus=2, memory=0, cache=0):
+    system_delta = 1000000
+    return {
+        'cpu_stats': {
+            'cpu_usage': {
+                'total_usage': 500 + int(
+                    system_delta * cpu_percent / 100.0 / cpus),
+            },
+            'system_cpu_usage': 2000000,
+            'online_cpus': cpus,
+        },
+        'precpu_stats': {
+            'cpu_usage': {'total_usage': 500},
+            'system_cpu_usage': 2000000 - system_delta,
+        },
+        'memory_stats': {
+            'usage': memory,
+            'stats': {'cache': cache},
+        },
+    }
+
+
+def test_cpu_percent():
+    assert resource_limits.cpu_percent(make_stats(150)) == \
+        pytest.approx(150)
+    assert resource_limits.cpu_percent({}) == 0
+
+
+def test_cpu_percent_without_online_cpus():
+    stats = make_stats(50, cpus=1)
+    del stats['cpu_stats']['online_cpus']
+    stats['cpu_stats']['cpu_usage']['percpu_usage'] = [1]
+    assert resource_limits.cpu_percent(stats) == pytest.approx(50)
+
+
+def test_memory_usage():
+    assert resource_limits.memory_usage(make_stats(memory=100, cache=30)) == 70
+    stats = make_stats(memory=100)
+    stats['memory_stats']['stats'] = {'inactive_file': 40}
+    assert resource_limits.memory_usage(stats) == 60
+    assert resource_limits.memory_usage({}) == 0
+
+
+@pytest.mark.parametrize('stats,limits,expected', [
+    (make_stats(250), ResourceLimits(200, None), True),
+    (make_stats(150), ResourceLimits(200, None), False),
+    (make_stats(memory=200), ResourceLimits(None, 100), True),
+    (make_stats(memory=200, cache=150), ResourceLimits(None, 100), False),
+    (make_stats(150, memory=200), ResourceLimits(200, 300), False),
+])
+def test_is_over_limits(stats, limits, expected):
+    assert resource_limits.is_over_limits(stats, limits) == expected
+
+
+def test_sample_stats_is_concurrent(mock_client):
+    barrier = threading.Barrier(3, timeout=5)
+
+    def stats(container, stream):
+        barrier.wait()
+        return {'id': container}
+    mock_client.stats.side_effect = stats
+
+    samples = resource_limits.sample_stats(mock_client, ['a', 'b', 'c'], 3)
+    assert samples == {'a': {'id': 'a'}, 'b': {'id': 'b'}, 'c': {'id': 'c'}}
+    mock_client.stats.assert_any_call(container='a', stream=False)
+
+
+def test_sample_stats_skips_failures(mock_client):
+    mock_client.stats.side_effect = lambda container, stream: (
+        None if container == 'b' else {'id': container})
+    samples = resource_limits.sample_stats(mock_client, ['a', 'b'], 2)
+    assert list(samples) == ['a']
+
+
+def test_find_containers_over_limits(mock_client):
+    usage = {
+        'always': [300, 300, 300],
+        'spike': [300, 10, 300],
+        'idle': [0, 0, 0],
+    }
+    calls = {name: 0 for name in usage}
+
+    def stats(container, stream):
+        value = usage[container][calls[container]]
+        calls[container] += 1
+        return make_stats(value)
+    mock_client.stats.side_effect = stats
+    sleep = mock.Mock()
+
+    over = resource_limits.find_containers_over_limits(
+        mock_client,
+        ['always', 'spike', 'idle'],
+        ResourceLimits(200, None),
+        window=60,
+        interval=30,
+        workers=2,
+        sleep=sleep,
+    )
+
+    assert over == ['always']
+    assert sleep.mock_calls == [mock.call(30), mock.call(30)]
+    # Containers under the limit are not sampled again
+    assert calls == {'always': 3, 'spike': 2, 'idle': 1}
+
+
+def test_find_containers_over_limits_single_sample(mock_client):
+    mock_client.stats.return_value = make_stats(300)
+    sleep = mock.Mock()
+    over = resource_limits.find_containers_over_limits(
+        mock_client, ['a'], ResourceLimits(200, None), 0, 30, 1, sleep=sleep)
+    assert over == ['a']
+    assert not sleep.mock_calls
@@ -0,0 +1,112 @@
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import schedule
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_scheduler(mock_client, clock, load=0.5, **kwargs):
+    kwargs.setdefault('max_load', 1.0)
+    return schedule.Scheduler(
+        mock_client,
+        3600,
+        host='host-a',
+        clock=clock,
+        sleep=clock.sleep,
+        get_load=lambda: load() if callable(load) else load,
+        **kwargs
+    )
+
+
+def test_host_offset_is_deterministic():
+    offsets = {schedule.host_offset('host-%d' % i, 3600) for i in range(50)}
+    assert schedule.host_offset('host-a', 3600) == \
+        schedule.host_offset('host-a', 3600)
+    assert all(0 <= offset < 3600 for offset in offsets)
+    # Hosts are spread over the interval
+    assert len(offsets) > 40
+
+
+@pytest.mark.parametrize('when,expected', [
+    (0, 100),
+    (100, 100),
+    (101, 3700),
+    (7300, 7300),
+])
+def test_align(when, expected):
+    assert schedule.align(when, 3600, 100) == expected
+
+
+def test_run_forever(mock_client):
+    clock = FakeClock(0)
+    scheduler = make_scheduler(mock_client, clock)
+    offset = scheduler.offset
+    starts = []
+
+    def run_once():
+        starts.append(clock.now)
+        clock.now += 10
+        return 0 if len(starts) in (2, 3) else 5
+
+    scheduler.run_forever(run_once, runs=5)
+    # The interval doubles after runs which removed nothing, and goes back
+    # to the schedule after a run which removed something
+    assert starts == [
+        offset,
+        offset + 3600,
+        offset + 3 * 3600,
+        offset + 7 * 3600,
+        offset + 8 * 3600,
+    ]
+
+
+def test_defer_while_busy(mock_client):
+    clock = FakeClock(0)
+    loads = iter([2.0, 2.0, 0.1])
+    scheduler = make_scheduler(mock_client, clock, load=lambda: next(loads))
+    run_once = mock.Mock(return_value=1)
+
+    scheduler.run_forever(run_once, runs=1)
+    run_once.assert_called_once_with()
+    assert clock.sleeps[-2:] == [schedule.DEFER_SECONDS] * 2
+
+
+def test_skip_when_busy_for_the_interval(mock_client):
+    clock = FakeClock(0)
+    scheduler = make_scheduler(mock_client, clock, load=5.0)
+    run_once = mock.Mock(return_value=1)
+
+    scheduler.run_forever(run_once, runs=2)
+    assert not run_once.mock_calls
+
+
+def test_busy_ping(mock_client):
+    clock = FakeClock(0)
+    scheduler = make_scheduler(mock_client, clock, max_ping=1.0)
+
+    def slow_ping():
+        clock.now += 2
+    mock_client.ping.side_effect = slow_ping
+    assert scheduler.busy() == "dockerd took 2.00s to answer a ping"
+
+    mock_client.ping.side_effect = IOError("refused")
+    assert scheduler.busy() == "dockerd did not answer a ping: refused"
+
+    mock_client.ping.side_effect = None
+    assert scheduler.busy() is None
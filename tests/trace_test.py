@@ -0,0 +1,180 @@
+import io
+
+import docker
+import docker.errors
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+import pytest
+
+from docker_custodian import trace
+
+
+CONTAINERS = [{
+    'Id': 'abcdabcdabcdabcd',
+    'Names': ['/service_web_1'],
+    'Image': 'user/service:latest',
+    'ImageID': 'sha256:' + 'e' * 64,
+    'Labels': {'com.example.team': 'payments'},
+}]
+
+IMAGES = [{
+    'Id': 'sha256:' + 'e' * 64,
+    'RepoTags': ['user/service:latest', '<none>:<none>'],
+    'Size': 100,
+}]
+
+
+def daemon_client(entries):
+    """A client served by hand written trace entries, in place of a
+    docker daemon.
+    """
+    client = docker.APIClient(version='1.41')
+    adapter = trace.ReplayAdapter(entries, scale=0)
+    for prefix in list(client.adapters):
+        client.mount(prefix, adapter)
+    return client
+
+
+def daemon_entries():
+    return [
+        {
+            'method': 'GET',
+            'path': '/v1.41/containers/json?all=1&limit=-1&size=0'
+                    '&trunc_cmd=0',
+            'status': 200,
+            'duration': 0.5,
+            'json': CONTAINERS,
+        },
+        {
+            'method': 'GET',
+            'path': '/v1.41/images/json?only_ids=0&all=0',
+            'status': 200,
+            'duration': 0.25,
+            'json': IMAGES,
+        },
+        {
+            'method': 'DELETE',
+            'path': '/v1.41/images/user/service:latest?force=False&noprune=False',
+            'status': 409,
+            'duration': 0.1,
+            'json': {'message': 'image is being used'},
+        },
+    ]
+
+
+def record_session(anonymize=False):
+    trace_file = io.StringIO()
+    client = trace.record(
+        daemon_client(daemon_entries()), trace_file, anonymize=anonymize)
+    containers = client.containers(all=True)
+    images = client.images()
+    with pytest.raises(docker.errors.APIError):
+        client.remove_image(image=images[0]['RepoTags'][0])
+    trace_file.seek(0)
+    return trace_file, containers, images
+
+
+def test_record_and_replay():
+    trace_file, containers, images = record_session()
+    header, entries = trace.read_trace(trace_file)
+    assert header == {'version': 1, 'api_version': '1.41'}
+    assert [entry['status'] for entry in entries] == [200, 200, 409]
+    trace_file.seek(0)
+
+    sleep = mock.Mock()
+    client = trace.replay_client(trace_file, scale=2, sleep=sleep)
+    assert client.containers(all=True) == CONTAINERS
+    assert client.images() == IMAGES
+    with pytest.raises(docker.errors.APIError) as error:
+        client.remove_image(image='user/service:latest')
+    assert error.value.status_code == 409
+    assert sleep.mock_calls == [
+        mock.call(entry['duration'] * 2) for entry in entries]
+
+
+def test_replay_unrecorded_request():
+    trace_file, _, _ = record_session()
+    client = trace.replay_client(trace_file, scale=0)
+    with pytest.raises(trace.ReplayError):
+        client.volumes()
+
+
+def test_replay_serves_responses_in_order():
+    entries = daemon_entries()
+    entries.insert(1, dict(entries[0], json=[]))
+    client = daemon_client(entries)
+    assert client.containers(all=True) == CONTAINERS
+    assert client.containers(all=True) == []
+    # The last response is served again
+    assert client.containers(all=True) == []
+
+
+def test_record_anonymized():
+    trace_file, _, _ = record_session(anonymize=True)
+    content = trace_file.getvalue()
+    for secret in ('service', 'payments', 'example', 'user'):
+        assert secret not in content
+
+    client = trace.replay_client(trace_file, scale=0)
+    [container] = client.containers(all=True)
+    [image] = client.images()
+    assert container['Id'] == CONTAINERS[0]['Id']
+    assert container['ImageID'] == CONTAINERS[0]['ImageID']
+    assert container['Image'] == image['RepoTags'][0]
+    assert container['Names'][0].startswith('/anon-')
+    assert image['RepoTags'][1] == '<none>:<none>'
+    # Requests for anonymized names match the recorded request
+    with pytest.raises(docker.errors.APIError):
+        client.remove_image(image=image['RepoTags'][0])
+
+
+def test_record_anonymized_keeps_query_and_api_words():
+    entries = daemon_entries()
+    # Label values like the compose container number match query values
+    entries[0]['json'] = [dict(
+        CONTAINERS[0],
+        Labels={'com.docker.compose.container-number': '1', 'kind': 'json'},
+    )]
+    trace_file = io.StringIO()
+    client = trace.record(daemon_client(entries), trace_file, anonymize=True)
+    client.containers(all=True)
+    client.images()
+    trace_file.seek(0)
+
+    client = trace.replay_client(trace_file, scale=0)
+    [container] = client.containers(all=True)
+    assert '1' not in container['Labels'].values()
+    assert client.images() != []
+
+
+def test_anonymizer_path():
+    anonymizer = trace.Anonymizer(salt=b'salt')
+    token = anonymizer.string('json')
+    anonymizer.string('1')
+    assert anonymizer.path('/v1.41/containers/json?all=1') == \
+        '/v1.41/containers/json?all=1'
+    assert anonymizer.path('/v1.41/containers/json/json') == \
+        '/v1.41/containers/%s/json' % token
+    assert anonymizer.path('/v1.41/volumes/1') == \
+        '/v1.41/volumes/%s' % anonymizer.string('1')
+    assert anonymizer.path('/v1.41/info') == '/v1.41/info'
+
+
+def test_anonymizer_keeps_structure():
+    anonymizer = trace.Anonymizer(salt=b'salt')
+    tag = anonymizer.string('registry:5000/user/service:v1')
+    repo, _, version = tag.rpartition(':')
+    assert tag.count('/') == 2
+    assert version != 'v1'
+    assert anonymizer.string('user/other:v1').endswith(':' + version)
+    assert anonymizer.string('<none>@sha256:' + 'a' * 64) == \
+        '<none>@sha256:' + 'a' * 64
+    assert anonymizer.path('/images/user/service:v1/json') == \
+        '/images/%s/json' % anonymizer.string('user/service:v1')
+
+
+def test_read_trace_bad_version():
+    with pytest.raises(ValueError):
+        trace.read_trace(io.StringIO('{"version": 2}\n'))